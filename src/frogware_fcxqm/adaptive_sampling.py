@@ -0,0 +1,143 @@
+"""Nonuniform delay sampling that concentrates the points where the FROG
+signal is"""
+
+import numpy as np
+
+from .scan_planner import ScanPlan
+from .hardware_comms.utilities import dist_um_to_T_fs
+from .resampling import resample_to_uniform
+
+
+def refine_delays(T_fs, marginal, min_step_fs, threshold=0.05, max_new=None, sort=True):
+    """
+    Picks new delays at the midpoints of the intervals where the delay
+    marginal is significant, or where it is curved enough that linear
+    interpolation across the interval would be inaccurate.
+
+    :param T_fs: sampled delays in femtoseconds
+    :param marginal: delay marginal (spectrogram integrated over
+        wavelength) at T_fs
+    :param min_step_fs: intervals narrower than twice this are not split
+    :param threshold: significance, relative to the peak of the marginal,
+        above which an interval is split
+    :param max_new: maximum number of delays to return, the most
+        significant intervals are split first
+    :param sort: if False, the new delays are returned most significant
+        first instead of sorted by delay
+    :return new_T_fs: array of new delays in femtoseconds
+    """
+    order = np.argsort(T_fs)
+    T_fs = np.asarray(T_fs, dtype=float)[order]
+    marginal = np.asarray(marginal, dtype=float)[order]
+    if len(T_fs) < 2:
+        return np.array([])
+
+    peak = np.max(np.abs(marginal))
+    if peak > 0:
+        marginal = marginal / peak
+
+    # second derivative on the nonuniform grid, at the interior points
+    h = np.diff(T_fs)
+    curvature = np.zeros(len(T_fs))
+    if len(T_fs) >= 3:
+        h0, h1 = h[:-1], h[1:]
+        curvature[1:-1] = np.abs(
+            2 * (h0 * marginal[2:] - (h0 + h1) * marginal[1:-1] + h1 * marginal[:-2])
+            / (h0 * h1 * (h0 + h1)))
+        curvature[0], curvature[-1] = curvature[1], curvature[-2]
+
+    # per interval: the larger of the two end values, plus the error bound
+    # of linear interpolation across the interval
+    level = np.maximum(np.abs(marginal[:-1]), np.abs(marginal[1:]))
+    interp_error = np.maximum(curvature[:-1], curvature[1:]) * h**2 / 8
+    significance = level + interp_error
+
+    split = (significance > threshold) & (h >= 2 * min_step_fs)
+    idx = np.nonzero(split)[0]
+
+    # weight by the width of the interval, so wide significant gaps are
+    # closed before narrow ones
+    idx = idx[np.argsort(-(significance[idx] * h[idx]))]
+    if max_new is not None:
+        idx = idx[:max_new]
+
+    new_T_fs = T_fs[idx] + h[idx] / 2
+    return np.sort(new_T_fs) if sort else new_T_fs
+
+
+class AdaptiveScanPlan(ScanPlan):
+    """
+    Scan that starts with a coarse pass over the range and then adds points
+    on the fine grid (start, end, step) where the FROG signal is, until the
+    point budget is used up. The rows are resampled onto the fine grid for
+    display and saving.
+    """
+
+    def __init__(self, start_um, end_um, step_um, T0_um, travel_limits_um=None, clamp=False,
+                 coarse_factor=4, max_points=None, threshold=0.05):
+        """
+        :param coarse_factor: the coarse pass measures every coarse_factor-th
+            point of the fine grid
+        :param max_points: point budget for the whole scan, defaults to half
+            of the fine grid
+        :param threshold: see refine_delays()
+
+        the other parameters are the same as for ScanPlan
+        """
+        super().__init__(start_um, end_um, step_um, T0_um,
+                         travel_limits_um=travel_limits_um, clamp=clamp)
+
+        self.grid_um = self.targets_um
+        n_grid = len(self.grid_um)
+
+        if max_points is None:
+            max_points = n_grid // 2
+        self.max_points = max(min(max_points, n_grid), 2)
+        self.threshold = threshold
+
+        coarse = np.arange(0, n_grid, max(int(coarse_factor), 1))
+        if coarse[-1] != n_grid - 1:
+            coarse = np.append(coarse, n_grid - 1)
+        self.targets_um = self.grid_um[coarse]
+
+    def shift(self, offset_um):
+        super().shift(offset_um)
+        self.grid_um = self.grid_um + offset_um
+
+    @property
+    def grid_fs(self):
+        return dist_um_to_T_fs(self.grid_um - self.T0_um)
+
+    def extend(self, T_fs, rows):
+        budget = self.max_points - self.n_points
+        if budget <= 0:
+            return np.array([])
+
+        grid_fs = self.grid_fs
+        if len(grid_fs) < 2:
+            return np.array([])
+        step_fs = grid_fs[1] - grid_fs[0]
+
+        new_fs = refine_delays(
+            T_fs, np.sum(rows, axis=1), abs(step_fs), threshold=self.threshold, sort=False)
+
+        # snap to the fine grid, and drop points that were already measured,
+        # keeping the most significant ones within the budget
+        idx = np.round((new_fs - grid_fs[0]) / step_fs).astype(int)
+        idx = np.clip(idx, 0, len(grid_fs) - 1)
+        _, first = np.unique(idx, return_index=True)
+        idx = idx[np.sort(first)]
+        idx = idx[~np.isin(self.grid_um[idx], self.targets_um)][:budget]
+        new_um = self.grid_um[np.sort(idx)]
+
+        # go through the new points starting from the end of the range the
+        # stage is closest to
+        if len(new_um) > 0 and abs(new_um[-1] - self.targets_um[-1]) < abs(new_um[0] - self.targets_um[-1]):
+            new_um = new_um[::-1]
+
+        self.targets_um = np.append(self.targets_um, new_um)
+        return new_um
+
+    def resample(self, T_fs, rows):
+        T_uniform_fs = self.grid_within(np.sort(self.grid_fs), T_fs)
+        return T_uniform_fs, resample_to_uniform(T_fs, rows, T_uniform_fs)
@@ -0,0 +1,98 @@
+"""Scan range that follows the FROG signal instead of a guessed start and
+end position"""
+
+import numpy as np
+
+from .scan_planner import ScanPlan
+from .resampling import resample_to_uniform
+
+
+class AutoRangeScanPlan(ScanPlan):
+    """
+    Starts at T0 and walks outward, first towards positive delays and then
+    towards negative delays. Each side ends once the integrated
+    (background subtracted) signal has stayed below the noise threshold for
+    n_below consecutive points, or at the stage limits.
+    """
+
+    def __init__(self, T0_um, step_um, travel_limits_um, threshold=0.02, n_below=3, max_points=None):
+        """
+        :param T0_um: stage position of time zero in micron, the first point
+        :param step_um: step size in micron
+        :param travel_limits_um: (lower bound, upper bound) in micron
+        :param threshold: noise threshold, relative to the largest integrated
+            signal measured so far
+        :param n_below: number of consecutive points below the threshold
+            that end one side of the scan
+        :param max_points: optional limit on the number of points
+        """
+        super().__init__(T0_um, T0_um, step_um, T0_um,
+                         travel_limits_um=travel_limits_um)
+
+        self.step_um = abs(step_um)
+        self.travel_limits_um = travel_limits_um
+        self.threshold = threshold
+        self.n_below = n_below
+        self.max_points = max_points
+
+        self._side = 1
+        self._signal = []
+        self._side_signal = []
+
+    def _next_target_um(self):
+        side_targets = len(self._side_signal)
+        target_um = self.T0_um + self._side * self.step_um * side_targets
+        lower_um, upper_um = self.travel_limits_um
+        if lower_um <= target_um <= upper_um:
+            return target_um
+        return None
+
+    def _side_finished(self):
+        if len(self._side_signal) < self.n_below + 1:
+            return False
+        noise_level = self.threshold * np.max(self._signal)
+        return np.all(np.array(self._side_signal[-self.n_below:]) < noise_level)
+
+    def extend(self, T_fs, rows):
+        # integrated signal of the point that was just measured
+        self._signal.append(np.sum(rows[-1]))
+        self._side_signal.append(self._signal[-1])
+
+        if self.max_points is not None and self.n_points >= self.max_points:
+            return np.array([])
+
+        target_um = None
+        if not self._side_finished():
+            target_um = self._next_target_um()
+
+        if target_um is None and self._side == 1:
+            # continue on the negative side, T0 counts for both sides
+            self._side = -1
+            self._side_signal = [self._signal[0]]
+            target_um = self._next_target_um()
+
+        if target_um is None:
+            return np.array([])
+
+        self.targets_um = np.append(self.targets_um, target_um)
+        return np.array([target_um])
+
+    def resample(self, T_fs, rows):
+        grid_fs = np.sort(self.targets_fs[:len(T_fs)])
+        return grid_fs, resample_to_uniform(T_fs, rows, grid_fs)
+
+    def signal_range_fs(self):
+        """
+        :return (start_fs, end_fs): delays of the outermost points with
+            signal above the noise threshold
+        """
+        T_fs = self.targets_fs[:len(self._signal)]
+        signal = np.array(self._signal)
+        above = T_fs[signal >= self.threshold * np.max(signal)]
+        return np.min(above), np.max(above)
+
+    def report(self):
+        if len(self._signal) == 0:
+            return {}
+        start_fs, end_fs = self.signal_range_fs()
+        return {"signal_start_fs": float(start_fs), "signal_end_fs": float(end_fs)}
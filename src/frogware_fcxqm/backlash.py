@@ -0,0 +1,51 @@
+"""Measurement of the direction dependent position offset of the stage"""
+
+import numpy as np
+
+from .hardware_comms.utilities import T_fs_to_dist_um
+from .scan_planner import ScanPlan
+from .scan_core import Scan
+from .resampling import resample_to_uniform
+from .multi_pass import estimate_delay_shift
+from .dtypes import precise_dtype
+
+
+def measure_direction_offsets(motor, spectrometer, plan: ScanPlan, ambient=None,
+                              callback=None):
+    """
+    Scans the FROG signal once forward and once backward and compares the
+    delay marginals of the two. Backlash between the encoder and the stage
+    shifts the backward scan against the forward one. T0 is found with
+    forward scans (see t0_finder.py), so the forward offset is taken as 0.
+
+    :param motor: LinearMotor with T0 and travel limits set
+    :param spectrometer: Spectrometer to read the signal with
+    :param plan: ScanPlan over the signal, with a step well below the width
+        of the cross correlation
+    :param ambient: optional background spectrum to subtract
+    :param callback: optional function called with every ScanPoint
+    :return direction_offsets_um: (forward, backward) offsets in micron, to
+        set as motor.direction_offsets_um
+    """
+    forward = plan if plan.step_um > 0 else plan.reversed()
+
+    # measured with the readings as they are
+    offsets_um = motor.direction_offsets_um
+    motor.direction_offsets_um = (0.0, 0.0)
+    try:
+        marginals = []
+        grid_fs = forward.targets_fs
+        for direction_plan in (forward, forward.reversed()):
+            result = Scan(motor, spectrometer, direction_plan, ambient=ambient).run(callback)
+            store = result.store
+            rows = resample_to_uniform(store.T_fs, store.subtracted(), grid_fs)
+            marginals.append(np.sum(rows, axis=1, dtype=precise_dtype))
+    finally:
+        motor.direction_offsets_um = offsets_um
+
+    # a backward scan that reads the features late (shift > 0) was really
+    # at a smaller position than it read
+    shift_fs = estimate_delay_shift(marginals[1], marginals[0], grid_fs[1] - grid_fs[0])
+    backward_um = -T_fs_to_dist_um(shift_fs)
+    print("backward moves are off by", "%.3f" % backward_um, "um")
+    return 0.0, float(backward_um)
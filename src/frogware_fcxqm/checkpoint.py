@@ -0,0 +1,148 @@
+"""On disk record of a running scan, so that an interrupted scan can be resumed"""
+
+import json
+import os
+import pickle
+import time
+from pathlib import Path
+
+import numpy as np
+
+from .spectrogram_store import SpectrogramStore
+
+
+class CheckpointState:
+    """
+    A scan as recorded by ScanCheckpoint.
+
+    plan: the ScanPlan, with the targets it had after the last point
+    store: SpectrogramStore with the completed rows
+    n_completed: number of completed points, the indices 0 .. n_completed - 1
+        of the plan's targets
+    settings: dict of the Scan settings (see Scan.settings()), with the T0
+        and integration time of the scan
+    """
+
+    def __init__(self, plan, store, n_completed, settings):
+        self.plan = plan
+        self.store = store
+        self.n_completed = n_completed
+        self.settings = settings
+
+
+class ScanCheckpoint:
+    """
+    Keeps the plan, settings and completed rows of a scan in a directory,
+    updated after every point. The rows are appended to flat binary files,
+    so the cost of a point does not grow with the scan. The number of
+    completed points in checkpoint.json is written last (and atomically),
+    so a crash in between leaves a consistent record behind.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self._record = None
+
+    @property
+    def _json_path(self):
+        return self.directory / "checkpoint.json"
+
+    def _path(self, name):
+        return self.directory / name
+
+    def exists(self):
+        return self._json_path.exists()
+
+    def start(self, plan, store, settings):
+        """
+        Starts a new record, replacing any previous one
+
+        :param plan: ScanPlan of the scan
+        :param store: SpectrogramStore the scan appends to, rows it already
+            holds are recorded
+        :param settings: dict of the Scan settings, JSON serializable
+        """
+        self.clear()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._record = {
+            "started": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "n_pixels": store.raw.shape[1],
+            "dtype": store.dtype.str,
+            "n_completed": 0,
+            "settings": settings,
+        }
+        np.save(self._path("ambient.npy"), store.ambient)
+        for name in ("raw.bin", "saturated.bin", "T_fs.bin"):
+            open(self._path(name), "wb").close()
+
+        for T_fs, row, saturated in zip(store.T_fs, store.raw, store.saturated):
+            self._append(T_fs, row, saturated)
+        self.update(plan)
+
+    def _append(self, T_fs, row, saturated):
+        with open(self._path("raw.bin"), "ab") as file:
+            file.write(np.ascontiguousarray(row, dtype=self._record["dtype"]).tobytes())
+        with open(self._path("saturated.bin"), "ab") as file:
+            file.write(np.ascontiguousarray(saturated, dtype=bool).tobytes())
+        with open(self._path("T_fs.bin"), "ab") as file:
+            file.write(np.float64(T_fs).tobytes())
+        self._record["n_completed"] += 1
+
+    def add_point(self, plan, T_fs, row, saturated):
+        """
+        Records one completed point, call after it is stored
+        """
+        self._append(T_fs, row, saturated)
+        self.update(plan)
+
+    def update(self, plan):
+        """
+        Writes the plan (whose targets may have been extended) and the
+        number of completed points
+        """
+        with open(self._path("plan.pkl"), "wb") as file:
+            pickle.dump(plan, file)
+
+        self._record["updated"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        tmp_path = self._json_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as file:
+            json.dump(self._record, file, indent=2)
+        os.replace(tmp_path, self._json_path)
+
+    def load(self):
+        """
+        :return state: CheckpointState of the recorded scan, the record is
+            continued by add_point()
+        """
+        with open(self._json_path, "r") as file:
+            self._record = json.load(file)
+        with open(self._path("plan.pkl"), "rb") as file:
+            plan = pickle.load(file)
+
+        n = self._record["n_completed"]
+        n_pixels = self._record["n_pixels"]
+        dtype = np.dtype(self._record["dtype"])
+        raw = np.fromfile(self._path("raw.bin"), dtype=dtype, count=n * n_pixels)
+        saturated = np.fromfile(self._path("saturated.bin"), dtype=bool, count=n * n_pixels)
+        T_fs = np.fromfile(self._path("T_fs.bin"), dtype=np.float64, count=n)
+
+        store = SpectrogramStore(n_pixels, dtype=dtype, ambient=np.load(self._path("ambient.npy")),
+                                 capacity=max(2 * n, 1))
+        for T, row, mask in zip(T_fs, raw.reshape(n, n_pixels), saturated.reshape(n, n_pixels)):
+            store.append(T, row, mask)
+
+        # drop whatever was appended after the last consistent record
+        for name, size in (("raw.bin", n * n_pixels * dtype.itemsize),
+                           ("saturated.bin", n * n_pixels), ("T_fs.bin", n * 8)):
+            with open(self._path(name), "ab") as file:
+                file.truncate(size)
+
+        return CheckpointState(plan, store, n, self._record["settings"])
+
+    def clear(self):
+        """
+        Deletes the record, once the scan is complete
+        """
+        for name in ("checkpoint.json", "plan.pkl", "ambient.npy", "raw.bin", "saturated.bin", "T_fs.bin"):
+            self._path(name).unlink(missing_ok=True)
+        self._record = None
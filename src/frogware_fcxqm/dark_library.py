@@ -0,0 +1,118 @@
+"""Dark/ambient spectra for each integration time, kept between sessions"""
+
+from pathlib import Path
+import numpy as np
+
+from .dtypes import precise_dtype
+
+
+class DarkLibrary:
+    """
+    Averaged ambient (dark) spectra keyed by integration time. Frames are
+    averaged online, so any number of them can be taken without storing
+    them, and each average is saved to its own file in directory so that
+    the library survives restarts.
+    """
+
+    # frames read at once by acquire(), only these are held in memory
+    chunk_frames = 16
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+
+        # integration time in microseconds -> [mean spectrum, number of frames]
+        self._darks = {}
+        self.load()
+
+    @staticmethod
+    def _key(integration_time_micros):
+        return int(round(integration_time_micros))
+
+    def _path(self, key):
+        return self.directory / f"dark_{key}us.npz"
+
+    def load(self):
+        if not self.directory.is_dir():
+            return
+        for path in self.directory.glob("dark_*us.npz"):
+            with np.load(path) as data:
+                key = int(data["integration_time_micros"])
+                self._darks[key] = [data["mean"], int(data["count"])]
+
+    def save(self, integration_time_micros):
+        key = self._key(integration_time_micros)
+        mean, count = self._darks[key]
+        self.directory.mkdir(parents=True, exist_ok=True)
+        np.savez(self._path(key), mean=mean, count=count,
+                 integration_time_micros=key)
+
+    def reset(self, integration_time_micros):
+        """
+        Forgets the average for this integration time, so that the next
+        frames start a new one
+        """
+        self._darks.pop(self._key(integration_time_micros), None)
+
+    def add_frame(self, integration_time_micros, intensities):
+        """
+        Adds one frame to the running average for its integration time
+        """
+        key = self._key(integration_time_micros)
+        intensities = np.asarray(intensities, dtype=float)
+        if key not in self._darks or len(self._darks[key][0]) != len(intensities):
+            self._darks[key] = [intensities.copy(), 1]
+            return
+
+        entry = self._darks[key]
+        entry[1] += 1
+        entry[0] += (intensities - entry[0]) / entry[1]
+
+    def acquire(self, spectrometer, n_frames):
+        """
+        Replaces the average for the current integration time of spectrometer
+        with a new one over n_frames, and saves it
+
+        :return mean: the new average spectrum
+        """
+        integration_time_micros = spectrometer.integration_time_micros
+
+        # a running sum over chunks of frames read into the same buffer, so
+        # that the memory does not grow with n_frames
+        chunk = np.empty((min(self.chunk_frames, n_frames), len(spectrometer.wavelengths())),
+                         dtype=spectrometer.counts_dtype)
+        total = np.zeros(chunk.shape[1], dtype=precise_dtype)
+        remaining = n_frames
+        while remaining > 0:
+            frames = spectrometer.read_frames(min(len(chunk), remaining), out=chunk)
+            total += frames.sum(axis=0, dtype=precise_dtype)
+            remaining -= len(frames)
+
+        self._darks[self._key(integration_time_micros)] = [total / n_frames, n_frames]
+        self.save(integration_time_micros)
+        return self.get(integration_time_micros)
+
+    def get(self, integration_time_micros):
+        """
+        :return mean: the average spectrum for this integration time. If it
+            was not measured, it is interpolated linearly (per pixel) from
+            the measured integration times that bracket it. None if neither
+            is possible.
+        """
+        key = self._key(integration_time_micros)
+        if key in self._darks:
+            return self._darks[key][0]
+
+        keys = np.array(sorted(self._darks))
+        below, above = keys[keys < key], keys[keys > key]
+        if len(below) == 0 or len(above) == 0:
+            return None
+
+        lo, hi = below[-1], above[0]
+        dark_lo, dark_hi = self._darks[lo][0], self._darks[hi][0]
+        if len(dark_lo) != len(dark_hi):
+            return None
+        weight = (key - lo) / (hi - lo)
+        return dark_lo * (1 - weight) + dark_hi * weight
+
+    def integration_times_micros(self):
+        return sorted(self._darks)
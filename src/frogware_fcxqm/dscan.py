@@ -0,0 +1,117 @@
+"""Dispersion scans (d-scan): second harmonic spectra versus glass insertion"""
+
+import numpy as np
+
+from .hardware_comms.utilities import T_fs_to_dist_um
+from .scan_planner import ScanPlan
+from .scan_core import Scan
+
+
+class DScanResult:
+    """
+    Second harmonic spectra measured by a DScan, ordered by insertion.
+
+    insertion_mm: glass insertion of every row in mm, from the measured
+        stage positions, relative to zero_insertion_um
+    wavelengths: wavelength axis of the rows
+    rows: background subtracted spectra, one per insertion
+    scan_result: ScanResult of the underlying stage scan, with the rows as
+        measured
+    """
+
+    def __init__(self, insertion_mm, wavelengths, rows, scan_result=None, metadata=None):
+        self.insertion_mm = insertion_mm
+        self.wavelengths = wavelengths
+        self.rows = rows
+        self.scan_result = scan_result
+        self.metadata = {} if metadata is None else metadata
+
+    def to_array(self):
+        """
+        :return data: the rows with the insertions in the first column and
+            the wavelengths in the first row, the format of a saved
+            spectrogram
+        """
+        top_row = np.hstack((np.array([np.nan]), self.wavelengths))
+        return np.vstack((top_row, np.hstack((self.insertion_mm[:, np.newaxis], self.rows))))
+
+    def save(self, filename):
+        """
+        Saves the d-scan to filename (.txt), and the rows as measured next to
+        it (_raw.npz)
+        """
+        header = "\n".join(f"{key}: {value}" for key, value in self.metadata.items())
+        np.savetxt(filename, self.to_array(), fmt="%.8g", header=header)
+        if self.scan_result is not None:
+            self.scan_result.store.save(filename[:-4] + "_raw.npz", self.wavelengths)
+
+    @classmethod
+    def load(cls, filename):
+        data = np.loadtxt(filename)
+        return cls(data[1:, 0], data[0, 1:], data[1:, 1:])
+
+
+class DScan:
+    """
+    Records second harmonic spectra while a glass wedge is inserted into
+    the beam, with the LinearMotor of the wedge stage and the spectrometer
+    after the SHG crystal. The stage is moved, settled and read exactly as
+    for a spectrogram (see Scan), only the axis is glass insertion instead
+    of delay.
+    """
+
+    def __init__(self, motor, spectrometer, start_mm, end_mm, step_mm, zero_insertion_um,
+                 insertion_mm_per_um, **scan_kwargs):
+        """
+        :param motor: LinearMotor moving the wedge, with travel limits set
+        :param spectrometer: Spectrometer reading the second harmonic
+        :param start_mm, end_mm, step_mm: insertion range and step in mm,
+            relative to zero_insertion_um
+        :param zero_insertion_um: stage position of zero insertion in micron
+        :param insertion_mm_per_um: glass insertion per micron of stage
+            travel, e.g. tan(wedge angle) * 1e-3 for a wedge moved across the
+            beam (negative if insertion decreases with position)
+        :param scan_kwargs: passed on to the Scan, e.g. ambient
+        """
+        self.motor = motor
+        self.insertion_mm_per_um = insertion_mm_per_um
+        self.zero_insertion_um = zero_insertion_um
+
+        plan = ScanPlan(zero_insertion_um + start_mm / insertion_mm_per_um,
+                        zero_insertion_um + end_mm / insertion_mm_per_um,
+                        step_mm / insertion_mm_per_um,
+                        zero_insertion_um,
+                        travel_limits_um=motor.travel_limits_um)
+        self.scan = Scan(motor, spectrometer, plan.starting_near(motor.pos_um()), **scan_kwargs)
+
+    def stop(self):
+        """
+        Ends the scan before the next move, can be called from another thread
+        """
+        self.scan.stop()
+
+    def run(self, callback=None, position_callback=None):
+        """
+        :param callback: optional function called with every ScanPoint
+        :param position_callback: optional function called with every stage
+            position reading while moving
+        :return result: DScanResult
+        """
+        result = self.scan.run(callback=callback, position_callback=position_callback)
+
+        # the scan tags the rows with the delay of the measured position,
+        # relative to the "T0" of the plan, the zero insertion
+        store = result.store
+        insertion_mm = T_fs_to_dist_um(store.T_fs) * self.insertion_mm_per_um
+        order = np.argsort(insertion_mm, kind="stable")
+
+        metadata = dict(result.metadata)
+        metadata["plan"] = "DScan"
+        metadata.pop("max_delay_error_fs", None)
+        metadata["zero_insertion_um"] = self.zero_insertion_um
+        metadata["insertion_mm_per_um"] = self.insertion_mm_per_um
+        dscan = DScanResult(insertion_mm[order], result.wavelengths, store.subtracted()[order],
+                            scan_result=result, metadata=metadata)
+        if result.error is not None:
+            dscan.metadata["error"] = result.error
+        return dscan
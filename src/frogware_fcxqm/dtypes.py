@@ -0,0 +1,33 @@
+"""dtypes of spectra along the acquisition pipeline. Spectrometer counts are
+kept as integers, processing buffers in single precision, and double
+precision is only used where the math needs it. Change these to trade
+memory for precision."""
+
+import numpy as np
+
+# background subtraction, display, resampling and HDR merging
+processing_dtype = np.float32
+
+# fits, integrals over the spectrum and retrieval
+precise_dtype = np.float64
+
+
+def counts_dtype(max_counts):
+    """
+    :param max_counts: detector full scale in counts
+    :return dtype: smallest unsigned integer dtype that holds max_counts
+    """
+    return np.min_scalar_type(int(max_counts))
+
+
+def to_counts(intensities, dtype):
+    """
+    :param intensities: spectrum in counts, of any dtype
+    :param dtype: integer dtype from counts_dtype()
+    :return counts: intensities rounded and clipped to dtype
+    """
+    intensities = np.asarray(intensities)
+    if intensities.dtype == dtype:
+        return intensities
+    limits = np.iinfo(dtype)
+    return np.clip(np.rint(intensities), limits.min, limits.max).astype(dtype)
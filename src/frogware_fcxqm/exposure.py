@@ -0,0 +1,129 @@
+"""Automatic choice of the spectrometer integration time"""
+
+import numpy as np
+
+from .hardware_comms.device_interfaces import Spectrometer, LinearMotor
+from .saturation import saturation_fraction
+
+
+def peak_fraction(spectrometer: Spectrometer, n_frames=1):
+    """
+    :return fraction: median over n_frames of the largest pixel value, as a
+        fraction of the detector full scale
+    """
+    peaks = spectrometer.read_frames(n_frames).max(axis=1)
+    return float(np.median(peaks)) / spectrometer.max_counts
+
+
+def auto_exposure(spectrometer: Spectrometer, target_fraction=0.7, tolerance=0.1, n_frames=3,
+                  max_iterations=12, callback=None):
+    """
+    Searches the integration time that puts the peak of the spectrum at
+    target_fraction of full scale. Unsaturated frames predict the
+    integration time from the linear response, saturated frames bisect
+    (geometrically) between the shortest saturated and longest unsaturated
+    integration time tried.
+
+    :param spectrometer: Spectrometer, the integration time is left at the
+        result
+    :param target_fraction: peak level to reach, as a fraction of full scale
+    :param tolerance: accepted relative deviation from target_fraction
+    :param n_frames: frames averaged (median) per integration time
+    :param max_iterations: maximum number of integration times tried
+    :param callback: optional function called with (integration time in
+        microseconds, peak fraction) after each try
+    :return (integration_time_micros, fraction): the integration time set,
+        and the peak fraction measured with it
+    """
+    lower_us, upper_us = spectrometer.integration_time_micros_limit
+    time_us = spectrometer.integration_time_micros
+
+    for _ in range(max_iterations):
+        spectrometer.integration_time_micros = time_us
+        fraction = peak_fraction(spectrometer, n_frames)
+        if callback is not None:
+            callback((time_us, fraction))
+
+        if abs(fraction - target_fraction) <= tolerance * target_fraction:
+            break
+
+        if fraction >= saturation_fraction:
+            upper_us = time_us
+            next_us = np.sqrt(lower_us * upper_us)
+        else:
+            if fraction < target_fraction:
+                lower_us = time_us
+            else:
+                upper_us = time_us
+            next_us = time_us * target_fraction / max(fraction, 1e-6)
+            # stay inside the bracket found so far
+            if not (lower_us < next_us < upper_us):
+                next_us = np.sqrt(lower_us * upper_us)
+
+        next_us = float(np.clip(next_us, *spectrometer.integration_time_micros_limit))
+        if next_us == time_us:
+            break
+        time_us = next_us
+
+    return time_us, fraction
+
+
+def auto_exposure_at(motor: LinearMotor, spectrometer: Spectrometer, position_um, callback=None,
+                     **kwargs):
+    """
+    Runs auto_exposure() with the stage at position_um, normally T0 where
+    the signal peaks, so that the exposure neither saturates at the peak nor
+    leaves the trace underexposed. The stage is moved back to where it was
+    afterwards, also if the search fails.
+
+    :param motor: LinearMotor of the delay stage
+    :param position_um: stage position to expose at, in micron
+    :param kwargs: passed on to auto_exposure()
+    :return (integration_time_micros, fraction): see auto_exposure()
+    """
+    start_um = motor.pos_um()
+    motor.move_to_um(position_um)
+    motor.wait_until_settled(position_um)
+    try:
+        return auto_exposure(spectrometer, callback=callback, **kwargs)
+    finally:
+        motor.move_to_um(start_um)
+        motor.wait_until_settled(start_um)
+
+
+def expose_in_range(spectrometer: Spectrometer, low_fraction=0.1, high_fraction=0.9, target_fraction=0.6,
+                    max_integration_time_micros=None, max_tries=3):
+    """
+    Reads a spectrum, and re-reads it at a corrected integration time while
+    its peak is outside of [low_fraction, high_fraction] of full scale. Used
+    to adapt the exposure per delay point of a spectrogram.
+
+    :param spectrometer: Spectrometer, the integration time is left at the
+        one the spectrum was read with
+    :param max_integration_time_micros: longest integration time to use,
+        so that the wings of a trace don't take the upper hardware limit
+    :return (intensities, integration_time_micros): the last spectrum read
+        and the integration time it was read with
+    """
+    lower_us, upper_us = spectrometer.integration_time_micros_limit
+    if max_integration_time_micros is not None:
+        upper_us = min(upper_us, max_integration_time_micros)
+
+    for i in range(max_tries):
+        time_us = spectrometer.integration_time_micros
+        intensities = spectrometer.intensities()
+        fraction = np.max(intensities) / spectrometer.max_counts
+
+        if low_fraction <= fraction <= high_fraction or i == max_tries - 1:
+            break
+
+        if fraction >= saturation_fraction:
+            next_us = time_us / 4
+        else:
+            next_us = time_us * target_fraction / max(fraction, 1e-6)
+        next_us = float(np.clip(next_us, lower_us, upper_us))
+        if next_us == time_us:
+            break
+        spectrometer.integration_time_micros = next_us
+
+    return intensities, time_us
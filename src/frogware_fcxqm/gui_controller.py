@@ -8,13 +8,30 @@ import scipy.integrate as scint
 import matplotlib.pyplot as plt
 import numpy as np
 
-from .runnables import UpdateMotorPositionRunnable, UpdateSpectrumRunnable, Signal
+from .runnables import UpdateMotorPositionRunnable, UpdateSpectrumRunnable, TaskRunnable, Signal
 from .window import Ui_MainWindow
 from . import plottablefunctions as plotf
 from .error import ErrorWindow, raise_error
-from .hardware_comms.device_interfaces import LinearMotor, Spectrometer, SpectrometerAverageException, StageOutOfBoundsException, SpectrometerIntegrationException, DeviceCommsException
+from .hardware_comms.device_interfaces import LinearMotor, Spectrometer, SpectrometerAverageException, StageOutOfBoundsException, StageNotSettledException, SpectrometerIntegrationException, DeviceCommsException
 from .hardware_comms.utilities import T_fs_to_dist_um, dist_um_to_T_fs
 from .hardware_comms.connect_devices import connect_devices
+from .scan_planner import ScanPlan
+from .t0_finder import find_T0, search_points, coarse_step_for_pulse
+from .exposure import auto_exposure_at
+from .saturation import saturation_mask
+from .dark_library import DarkLibrary
+from .spectrogram_store import SpectrogramStore
+from .dtypes import processing_dtype
+from .adaptive_sampling import AdaptiveScanPlan
+from .auto_range import AutoRangeScanPlan
+from .scan_core import Scan, scan_motion_params
+from .multi_pass import MultiPassScan
+from .scan_queue import ScanQueue, DONE, FAILED
+from .checkpoint import ScanCheckpoint
+from .backlash import measure_direction_offsets
+from .retrieval.fields import PulseField
+from .retrieval.xfrog import retrieve_xfrog
+from .retrieval.ptychography import retrieve_frog, load_spectrogram
 
 
 # will be used later on for any continuous update of the display that lasts more
@@ -22,8 +39,38 @@ from .hardware_comms.connect_devices import connect_devices
 pool = qtc.QThreadPool.globalInstance()
 
 # global variables
-tol_um = 0.1  # 100 nm
 edge_limit_buffer_mm = 0.0  # 1 um
+# searched on each side of the current T0, the uncertainty of T0 expected
+# after realigning; every coarse step is one move, settle and read
+T0_search_span_um = 300.0
+# shortest pulse (FWHM) the coarse step of the T0 search is fine enough for
+T0_search_pulse_fwhm_fs = 50.0
+# longest integration time used when adapting the exposure per point, as a
+# multiple of the integration time set at the start of the spectrogram
+adaptive_exposure_max_factor = 10.0
+# integration times of an HDR spectrogram point, as multiples of the
+# integration time in the settings table
+hdr_exposure_ladder = (1.0, 10.0)
+# a spectrogram with "Abort on Saturation" checked stops at the first point
+# with more saturated pixels than this
+max_saturated_pixels = 0
+# number of frames averaged by "Set Ambient"
+ambient_frames = 20
+# read the spectrometer in a separate process, so that plotting does not
+# stall the acquisition
+spectrometer_in_process = False
+# iterations of the XFROG retrieval
+xfrog_iterations = 200
+# passes over the delays of the (ptychographic) FROG retrieval
+frog_retrieval_iterations = 100
+# a spectrogram is measured in this many passes over the delay range, which
+# are aligned for drift and averaged (plain scans only)
+spectrogram_passes = 1
+# start each spectrogram from the end of its range the stage is closer to,
+# instead of moving back to the start position first
+alternate_scan_direction = True
+# largest drift corrected between two passes in fs, any if None
+max_pass_shift_fs = None
 
 
 
@@ -62,7 +109,7 @@ class MainWindow(qt.QMainWindow, Ui_MainWindow):
 
     def connect_motor_spectrometer(self):
         try:
-            self.motor, self.spectrometer = connect_devices()
+            self.motor, self.spectrometer = connect_devices(spectrometer_in_process)
 
         except DeviceCommsException as e:
             raise_error(self.error_window, e.message)
@@ -102,6 +149,7 @@ class MainWindow(qt.QMainWindow, Ui_MainWindow):
     def update_hardware_from_table_int_time(self):
         self.spectrometer.integration_time_micros = float(
             self.tableWidget.item(0, 0).text()) * 1e3
+        self.frog_land.update_ambient_for_exposure()
 
     def update_hardware_from_table_scans_to_avg(self):
         self.spectrometer.scans_to_avg = int(
@@ -188,7 +236,7 @@ class MainWindow(qt.QMainWindow, Ui_MainWindow):
         return final
 
     def save_spectrogram(self):
-        if self.frog_land.spectrogram_array is None:
+        if self.frog_land.scan_result is None:
             raise_error(self.error_window,
                         "No spectrogram has been collected yet")
             return
@@ -205,8 +253,9 @@ class MainWindow(qt.QMainWindow, Ui_MainWindow):
                 return
             filename += ".txt"
 
-        final = self.format_data_to_save()
-        np.savetxt(filename, final)
+        # the spectrogram, the rows as measured with the ambient (for
+        # reprocessing), and per row information next to it
+        self.frog_land.scan_result.save(filename)
 
     def plot_intensity_autocorrelation(self):
         if self.frog_land.spectrogram_array is None:
@@ -273,6 +322,18 @@ class FrogLand:
             self.main_window.gv_Spectrogram,
         )
         self.actionStop = self.main_window.actionStop
+        self.actionAdaptiveSampling = self.main_window.actionAdaptiveSampling
+        self.actionAutoRange = self.main_window.actionAutoRange
+        self.actionFindT0 = self.main_window.actionFindT0
+        self.actionAutoExposure = self.main_window.actionAutoExposure
+        self.actionAdaptiveExposure = self.main_window.actionAdaptiveExposure
+        self.actionHDR = self.main_window.actionHDR
+        self.actionAbortOnSaturation = self.main_window.actionAbortOnSaturation
+        self.actionRunQueue = self.main_window.actionRunQueue
+        self.actionResumeSpectrogram = self.main_window.actionResumeSpectrogram
+        self.actionMeasureBacklash = self.main_window.actionMeasureBacklash
+        self.actionXFROG = self.main_window.actionXFROG
+        self.actionFROGRetrieval = self.main_window.actionFROGRetrieval
         self.btn_set_ambient = self.main_window.btn_set_ambient
         self.btn_zero_ambient = self.main_window.btn_zero_ambient
 
@@ -280,6 +341,10 @@ class FrogLand:
         self.curve = plotf.create_curve()
         self.plot1d_window.plotwidget.addItem(self.curve)
 
+        # saturated pixels are highlighted on top of the curve
+        self.saturation_scatter = plotf.create_scatter()
+        self.plot1d_window.plotwidget.addItem(self.saturation_scatter)
+
         # initialize the step size and position, 0 is arbitrary
         self._step_size_fs = 0
         self._move_to_pos_fs = 0
@@ -331,6 +396,8 @@ class FrogLand:
         self.cont_update_runnable_exists = threading.Event()
         self.cont_update_loop_exited = threading.Event()
         self.motor_runnable_exists = threading.Event()
+        # set by the stop action to end a running T0 search
+        self.T0_search_stop_event = threading.Event()
 
         # Error Popup Window
         self.error_window = ErrorWindow()
@@ -341,16 +408,42 @@ class FrogLand:
 
         self.spectrogram_array = None
         self.Taxis_fs = None
+        self.spectrogram_store = None
+        self.scan_result = None
+        self.scan_queue = None
         self.spectrogram_now_running = False
+        self.scan_plan = None
+
+        # set while a spectrogram, scan queue, T0 search, ... drives the
+        # stage and spectrometer from the thread pool, see
+        # disconnect_for_spectrogram()
+        self.hardware_task_running = False
+
+        # settings of the last spectrogram collection, saved with the data,
+        # and arrays saved to separate files next to it
+        self.scan_metadata = {}
+        self.scan_arrays = {}
+
+        # the calibration does not change while connected, every spectrum
+        # shares this (read only) array
+        self.wl_axis = self.spectrometer.wavelengths()
+        self.ambient_intensity = np.zeros(len(self.wl_axis), dtype=processing_dtype)
 
-        self.ambient_intensity = np.zeros(len(self.spectrometer.wavelengths()))
-        self.intensities = np.zeros(len(self.spectrometer.wavelengths()))
-        self.bckgnd_subtrd = np.zeros(len(self.spectrometer.wavelengths()))
+        # averaged ambient spectra for each integration time, the one for the
+        # current integration time is subtracted unless the ambient is zeroed
+        self.dark_library = DarkLibrary(self.motor.datapath / "darks")
+
+        # record of the running spectrogram, to resume it once interrupted
+        self.checkpoint = ScanCheckpoint(self.motor.datapath / "checkpoint")
+        self.subtract_ambient = True
+        self._ambient_frames_left = 0
+        self.intensities = np.zeros(len(self.wl_axis), dtype=processing_dtype)
+        self.bckgnd_subtrd = np.zeros(len(self.wl_axis), dtype=processing_dtype)
 
     # I have create_runnable and connect_runnable defined separately because
     # every time the pool finishes it deletes the instance, so it needs to be
     # re-initialized every time
-    def create_runnable(self, string):
+    def create_runnable(self, string, target_um=None):
         if string == "spectrum":
             # set the continuous update spectrum flag to true
             # other parts of the program will need to check that
@@ -379,6 +472,7 @@ class FrogLand:
             self.runnable_update_motor = UpdateMotorPositionRunnable(
                 motor=self.motor,
                 event_to_clear=self.motor_runnable_exists,
+                target_um=target_um,
             )
 
             # I don't know if this is necessary, but in case the old memory
@@ -417,6 +511,9 @@ class FrogLand:
             # when finished moving, update the current position one more time
             self.runnable_update_motor.finished.connect(self.motor_finished)
 
+            # report a stage that does not settle at its target
+            self.runnable_update_motor.error.connect(self.motor_error)
+
     def connect(self):
         # if the start continuous update button is pressed start the
         # continuous update
@@ -452,6 +549,26 @@ class FrogLand:
 
         # connect the set T0 button
         self.btn_setT0.clicked.connect(self.set_T0)
+        self.actionFindT0.triggered.connect(self.find_T0)
+        self.actionStop.triggered.connect(self.T0_search_stop_event.set)
+
+        # connect the auto exposure action
+        self.actionAutoExposure.triggered.connect(self.run_auto_exposure)
+
+        # connect the backlash measurement
+        self.actionMeasureBacklash.triggered.connect(self.measure_backlash)
+
+        # connect the XFROG retrieval
+        self.actionXFROG.triggered.connect(self.run_xfrog_retrieval)
+
+        # connect the FROG retrieval
+        self.actionFROGRetrieval.triggered.connect(self.run_frog_retrieval)
+
+        # connect the resume action
+        self.actionResumeSpectrogram.triggered.connect(self.resume_spectrogram)
+
+        # connect the scan queue action (runs or stops the queue)
+        self.actionRunQueue.triggered.connect(self.run_scan_queue)
 
         # connect the home stage button
         self.btn_home_stage.clicked.connect(self.home_stage)
@@ -478,6 +595,9 @@ class FrogLand:
         self.spectrogram_collection_instance.signal.finished.connect(
             self.spectrogram_finished
         )
+        self.spectrogram_collection_instance.position_signal.progress.connect(
+            self.update_current_pos
+        )
         self.actionStop.triggered.connect(
             self.spectrogram_collection_instance.stop)
 
@@ -498,6 +618,8 @@ class FrogLand:
     and re-connect them later."""
 
     def disconnect_for_spectrogram(self):
+        self.hardware_task_running = True
+
         # if the start continuous update button is pressed start the
         # continuous update
         self.btn_start.clicked.disconnect(self.start_continuous_update)
@@ -518,6 +640,8 @@ class FrogLand:
             self.collect_spectrogram)
 
     def reconnect_for_spectrogram(self):
+        self.hardware_task_running = False
+
         # if the start continuous update button is pressed start the
         # continuous update
         self.btn_start.clicked.connect(self.start_continuous_update)
@@ -536,6 +660,14 @@ class FrogLand:
         # connect the collect spectrogram button
         self.btn_collect_spectrogram.clicked.connect(self.collect_spectrogram)
 
+    def hardware_busy(self):
+        # every action that hands the stage and spectrometer to the thread
+        # pool checks this first, one task at a time
+        if self.hardware_task_running:
+            raise_error(self.error_window, "stop the running task first")
+            return True
+        return False
+
     def stop_all_runnables(self):
         if self.motor_runnable_exists.is_set():
             self.stop_motor()
@@ -766,8 +898,7 @@ class FrogLand:
         spectrum = self.spectrometer.spectrum()
         self.plot_update(spectrum)
         lims = np.array([0, max(spectrum[1])])
-        self.plot1d_window.format_to_xy_data(
-            self.spectrometer.wavelengths(), lims)
+        self.plot1d_window.format_to_xy_data(self.wl_axis, lims)
 
         self.btn_start.setText("Stop \n Continuous Update")
 
@@ -787,23 +918,71 @@ class FrogLand:
         self.cont_update_loop_exited.wait()
         self.btn_start.setText("Start \n Continuous Update")
 
-    def plot_update(self, X):
+        # an ambient average that was still being taken is abandoned
+        self._ambient_frames_left = 0
+
+    def plot_update(self, X, saturated=None):
         # the signal should emit wavelengths and intensities, the spectrogram
         # signal will emit also an integer which we ignore here
         wavelengths, intensities, *_ = X
         self.intensities[:] = intensities[:]
+        if self._ambient_frames_left > 0:
+            self.add_ambient_frame(intensities)
         # set the data to the new spectrum
-        self.bckgnd_subtrd = intensities - self.ambient_intensity
-        self.bckgnd_subtrd = np.where(
-            self.bckgnd_subtrd > 0.0, self.bckgnd_subtrd, 0.0)
+        np.subtract(intensities, self.ambient_intensity,
+                    out=self.bckgnd_subtrd, dtype=processing_dtype)
+        np.maximum(self.bckgnd_subtrd, 0.0, out=self.bckgnd_subtrd)
         self.curve.setData(x=wavelengths, y=self.bckgnd_subtrd)
 
+        # the spectrogram passes the mask it found on the raw counts, the
+        # continuous update spectrum is raw counts
+        if saturated is None:
+            saturated = saturation_mask(
+                intensities, self.spectrometer.max_counts)
+        self.saturation_scatter.setData(
+            x=wavelengths[saturated], y=self.bckgnd_subtrd[saturated])
+
     def set_ambient(self):
-        self.ambient_intensity[:] = self.intensities[:]
+        self.subtract_ambient = True
+        integration_time_micros = self.spectrometer.integration_time_micros
+
+        # while the continuous update is running, the next frames it reads
+        # are averaged (see add_ambient_frame), otherwise read them here
+        if self.cont_update_runnable_exists.is_set():
+            self.dark_library.reset(integration_time_micros)
+            self._ambient_frames_left = ambient_frames
+            return
+
+        self.dark_library.acquire(self.spectrometer, ambient_frames)
+        self.update_ambient_for_exposure()
+
+    def add_ambient_frame(self, intensities):
+        integration_time_micros = self.spectrometer.integration_time_micros
+        self.dark_library.add_frame(integration_time_micros, intensities)
+
+        self._ambient_frames_left -= 1
+        if self._ambient_frames_left == 0:
+            self.dark_library.save(integration_time_micros)
+            self.update_ambient_for_exposure()
 
     def zero_ambient(self):
+        self.subtract_ambient = False
+        self._ambient_frames_left = 0
         self.ambient_intensity[:] = 0.0
 
+    def ambient_for(self, integration_time_micros):
+        if not self.subtract_ambient:
+            return None
+        return self.dark_library.get(integration_time_micros)
+
+    # called whenever the integration time changes
+    def update_ambient_for_exposure(self):
+        ambient = self.ambient_for(self.spectrometer.integration_time_micros)
+        if ambient is None or len(ambient) != len(self.ambient_intensity):
+            self.ambient_intensity[:] = 0.0
+        else:
+            self.ambient_intensity[:] = ambient
+
     def step_right(self, *args, step_size_um=False, ignore_spectrogram=False):
         # if step_size_um is not specified, then step according
         # to the step size in the first tab
@@ -821,8 +1000,9 @@ class FrogLand:
             return
         # TODO I don't understand this one yet
         try:
+            target_um = self.motor.pos_um() + step_size_um
             self.motor.move_by_um(step_size_um)
-            self.create_runnable("motor")
+            self.create_runnable("motor", target_um=target_um)
             self.connect_runnable("motor")
             pool.start(self.runnable_update_motor)
         except StageOutOfBoundsException as e:
@@ -841,8 +1021,9 @@ class FrogLand:
             self.stop_motor()
             return
 
-        # Weird idiosyncracy of pyqt
-        if target_um == False:
+        # Weird idiosyncracy of pyqt (the clicked signal passes False, which
+        # should not be confused with a target of 0 um)
+        if target_um is False:
             target_um = self.move_to_pos_um
 
         try:
@@ -850,7 +1031,7 @@ class FrogLand:
 
         # create a runnable instance and connect the relevant signals and
         # slots
-            self.create_runnable("motor")
+            self.create_runnable("motor", target_um=target_um)
             self.connect_runnable("motor")
             pool.start(self.runnable_update_motor)
         except StageOutOfBoundsException as e:
@@ -893,6 +1074,14 @@ class FrogLand:
         self.btn_move_to_pos.setText("move to position")
         self.btn_home_stage.setText("home stage")
 
+    # connected to the motor runnable's error signal, emitted when the stage
+    # stays out of tolerance of its target after all retries. A running
+    # spectrogram is stopped first, so that the finished signal that follows
+    # ends the collection instead of stepping on.
+    def motor_error(self, e):
+        self.spectrogram_collection_instance.stop()
+        raise_error(self.error_window, getattr(e, "message", str(e)))
+
     def set_T0(self, *args, T0_um=None):
         if T0_um is None:
             # read the motor position
@@ -919,6 +1108,314 @@ class FrogLand:
         self.update_startpos_from_le_fs()
         self.update_endpos_from_le_fs()
 
+    def find_T0(self):
+        # if motor is currently moving, just stop the motor.
+        if self.motor_runnable_exists.is_set():
+            self.stop_motor()
+            return
+
+        if self.hardware_busy():
+            return
+
+        # the search needs the spectrometer
+        if self.cont_update_runnable_exists.is_set():
+            self.stop_continuous_update()
+
+        lower_um, upper_um = self.motor.travel_limits_um
+        search_range_um = (max(self.T0_um - T0_search_span_um, lower_um),
+                           min(self.T0_um + T0_search_span_um, upper_um))
+
+        # at least the exposure and the settle dwell per point, moves not
+        # included
+        coarse_step_um = coarse_step_for_pulse(T0_search_pulse_fwhm_fs)
+        n_points = search_points(search_range_um, coarse_step_um)
+        seconds_per_point = self.spectrometer.integration_time_micros * 1e-6 + self.motor.settle_dwell_s
+        print("T0 search over", n_points, "points, at least",
+              "%.0f" % (n_points * seconds_per_point), "s")
+
+        self.runnable_find_T0 = TaskRunnable(
+            find_T0,
+            self.motor,
+            self.spectrometer,
+            exceptions=(StageNotSettledException, StageOutOfBoundsException),
+            search_range_um=search_range_um,
+            coarse_step_um=coarse_step_um,
+            ambient=self.ambient_intensity.copy(),
+            stop_event=self.T0_search_stop_event,
+        )
+        self.runnable_find_T0.progress.connect(self.update_current_pos)
+        self.runnable_find_T0.error.connect(self.motor_error)
+        self.runnable_find_T0.finished.connect(self.find_T0_finished)
+
+        # keep the motor buttons away from the stage during the search
+        self.disconnect_for_spectrogram()
+        self.actionFindT0.setEnabled(False)
+        self.T0_search_stop_event.clear()
+        pool.start(self.runnable_find_T0)
+
+    def find_T0_finished(self, result):
+        self.reconnect_for_spectrogram()
+        self.actionFindT0.setEnabled(True)
+        self.update_current_pos(self.motor.pos_um())
+
+        if result is None:
+            if self.T0_search_stop_event.is_set():
+                print("T0 search stopped, T0 unchanged")
+            return
+
+        print("T0 search:", result)
+        if not result.confident:
+            raise_error(self.error_window,
+                        "T0 search did not find a clear signal peak "
+                        f"(signal to noise {result.snr:.1f}), T0 unchanged")
+            return
+
+        self.set_T0(T0_um=result.T0_um)
+
+    def measure_backlash(self):
+        if self.hardware_busy():
+            return
+
+        if self.motor_runnable_exists.is_set():
+            raise_error(self.error_window, "wait for the stage to stop first")
+            return
+
+        if self.cont_update_runnable_exists.is_set():
+            self.stop_continuous_update()
+
+        # a forward and a backward scan over the spectrogram range
+        try:
+            plan = ScanPlan(self.start_pos_um, self.end_pos_um, self.step_size_um_spectrogram,
+                            self.T0_um, travel_limits_um=self.motor.travel_limits_um)
+        except (StageOutOfBoundsException, ValueError) as e:
+            raise_error(self.error_window, getattr(e, "message", str(e)))
+            return
+
+        self.runnable_backlash = TaskRunnable(
+            measure_direction_offsets,
+            self.motor,
+            self.spectrometer,
+            plan,
+            exceptions=(StageNotSettledException, StageOutOfBoundsException),
+            ambient=self.ambient_intensity.copy(),
+        )
+        self.runnable_backlash.progress.connect(
+            lambda point: self.update_current_pos(point.pos_um))
+        self.runnable_backlash.error.connect(self.motor_error)
+        self.runnable_backlash.finished.connect(self.measure_backlash_finished)
+
+        self.disconnect_for_spectrogram()
+        self.actionMeasureBacklash.setEnabled(False)
+        pool.start(self.runnable_backlash)
+
+    def measure_backlash_finished(self, offsets_um):
+        self.reconnect_for_spectrogram()
+        self.actionMeasureBacklash.setEnabled(True)
+        self.update_current_pos(self.motor.pos_um())
+
+        if offsets_um is None:
+            return
+
+        # for this session, set direction_offsets_um in connect_devices()
+        # to keep it
+        self.motor.direction_offsets_um = offsets_um
+        print("direction offsets set to", offsets_um, "um")
+
+    def run_xfrog_retrieval(self):
+        if self.spectrogram_array is None:
+            raise_error(self.error_window, "No spectrogram has been collected yet")
+            return
+
+        # the gate is a pulse characterized before, e.g. saved from a FROG or
+        # d-scan retrieval (see PulseField)
+        filename, _ = qt.QFileDialog.getOpenFileName(
+            self.main_window, "Open Gate Field", "", "Pulse field (*.txt)")
+        if filename == "":
+            return
+
+        try:
+            gate = PulseField.load(filename)
+        except (OSError, ValueError) as e:
+            raise_error(self.error_window, str(e))
+            return
+
+        self.runnable_xfrog = TaskRunnable(
+            retrieve_xfrog,
+            self.Taxis_fs.copy(),
+            self.wl_axis.copy(),
+            self.spectrogram_array.copy(),
+            gate,
+            exceptions=(ValueError,),
+            iterations=xfrog_iterations,
+        )
+        self.runnable_xfrog.error.connect(
+            lambda e: raise_error(self.error_window, str(e)))
+        self.runnable_xfrog.finished.connect(self.xfrog_retrieval_finished)
+
+        self.actionXFROG.setEnabled(False)
+        pool.start(self.runnable_xfrog)
+
+    def xfrog_retrieval_finished(self, result):
+        self.actionXFROG.setEnabled(True)
+        if result is not None:
+            self.show_retrieved_pulse(result, "XFROG retrieval")
+
+    def run_frog_retrieval(self):
+        # a saved spectrogram, the _raw.npz keeps the delays as measured
+        filename, _ = qt.QFileDialog.getOpenFileName(
+            self.main_window, "Open Spectrogram", "", "Spectrogram (*.txt *.npz)")
+        if filename == "":
+            return
+
+        try:
+            T_fs, wavelengths_nm, rows = load_spectrogram(filename)
+        except (OSError, ValueError, KeyError) as e:
+            raise_error(self.error_window, str(e))
+            return
+
+        self.runnable_frog = TaskRunnable(
+            retrieve_frog,
+            T_fs,
+            wavelengths_nm,
+            rows,
+            exceptions=(ValueError,),
+            iterations=frog_retrieval_iterations,
+        )
+        self.runnable_frog.error.connect(
+            lambda e: raise_error(self.error_window, str(e)))
+        self.runnable_frog.finished.connect(self.frog_retrieval_finished)
+
+        self.actionFROGRetrieval.setEnabled(False)
+        pool.start(self.runnable_frog)
+
+    def frog_retrieval_finished(self, result):
+        self.actionFROGRetrieval.setEnabled(True)
+        if result is not None:
+            self.show_retrieved_pulse(result, "FROG retrieval")
+
+    def show_retrieved_pulse(self, result, title):
+        pulse = result.pulse()
+        fig, (ax_t, ax_trace) = plt.subplots(1, 2, num=title)
+        ax_t.plot(pulse.t_fs, pulse.intensity / np.max(pulse.intensity))
+        ax_t.set_xlabel("t (fs)")
+        ax_phase = ax_t.twinx()
+        ax_phase.plot(pulse.t_fs, np.unwrap(np.angle(pulse.field)), "C1")
+        ax_phase.set_ylabel("phase (rad)")
+        ax_trace.plot(result.errors)
+        ax_trace.set_xlabel("iteration")
+        ax_trace.set_ylabel("trace error")
+        fig.show()
+
+        # the retrieved pulse can in turn be the gate of another XFROG
+        filename, _ = qt.QFileDialog.getSaveFileName(self.main_window, "Save Retrieved Field")
+        if filename != "":
+            pulse.save(filename)
+
+    def run_auto_exposure(self):
+        if self.hardware_busy():
+            return
+
+        if self.motor_runnable_exists.is_set():
+            raise_error(self.error_window, "wait for the stage to stop first")
+            return
+
+        if self.cont_update_runnable_exists.is_set():
+            self.stop_continuous_update()
+
+        # sets the exposure at T0, the peak of the trace (see "Find T0"), and
+        # moves the stage back afterwards
+        self.runnable_auto_exposure = TaskRunnable(
+            auto_exposure_at,
+            self.motor,
+            self.spectrometer,
+            self.T0_um,
+            exceptions=(SpectrometerIntegrationException, StageNotSettledException,
+                        StageOutOfBoundsException),
+        )
+        self.runnable_auto_exposure.error.connect(self.show_error)
+        self.runnable_auto_exposure.finished.connect(
+            self.auto_exposure_finished)
+
+        # keep the motor buttons away from the stage meanwhile
+        self.disconnect_for_spectrogram()
+        self.actionAutoExposure.setEnabled(False)
+        pool.start(self.runnable_auto_exposure)
+
+    def show_error(self, e):
+        # unexpected exceptions from a TaskRunnable have no message
+        raise_error(self.error_window, getattr(e, "message", str(e)))
+
+    def auto_exposure_finished(self, result):
+        self.reconnect_for_spectrogram()
+        self.actionAutoExposure.setEnabled(True)
+        self.update_current_pos(self.motor.pos_um())
+        self.main_window.update_table_from_hardware_int_time()
+
+        if result is not None:
+            integration_time_micros, fraction = result
+            print("auto exposure:", "%.1f" % (integration_time_micros * 1e-3),
+                  "ms, peak at", "%.0f" % (fraction * 100), "% of full scale")
+
+    def run_scan_queue(self):
+        # the action toggles, a second click stops the queue
+        if self.scan_queue is not None:
+            self.scan_queue.stop()
+            return
+
+        if self.hardware_busy():
+            return
+
+        if self.motor_runnable_exists.is_set():
+            raise_error(self.error_window, "wait for the stage to stop first")
+            return
+
+        filename, _ = qt.QFileDialog.getOpenFileName(
+            self.main_window, "Open Scan Queue", "", "Scan queue (*.json)")
+        if filename == "":
+            return
+
+        try:
+            self.scan_queue = ScanQueue.load(
+                self.motor, self.spectrometer, filename,
+                dark_library=self.dark_library if self.subtract_ambient else None)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            raise_error(self.error_window, f"could not read the scan queue: {e}")
+            return
+
+        if self.cont_update_runnable_exists.is_set():
+            self.stop_continuous_update()
+
+        self.runnable_scan_queue = TaskRunnable(
+            self.scan_queue.run,
+            exceptions=(DeviceCommsException,),
+            position_callback=self.spectrogram_collection_instance.position_signal.progress.emit,
+        )
+        self.runnable_scan_queue.progress.connect(self.scan_queue_progress)
+        self.runnable_scan_queue.error.connect(self.show_error)
+        self.runnable_scan_queue.finished.connect(self.scan_queue_finished)
+
+        # keep the motor buttons away from the stage while the queue runs
+        self.disconnect_for_spectrogram()
+        self.actionRunQueue.setText("Stop Scan Queue")
+        pool.start(self.runnable_scan_queue)
+
+    def scan_queue_progress(self, point):
+        self.plot_update((self.wl_axis, point.intensities), saturated=point.saturated)
+
+    def scan_queue_finished(self, items):
+        items = self.scan_queue.items
+        self.scan_queue = None
+        self.reconnect_for_spectrogram()
+        self.actionRunQueue.setText("Run Scan Queue")
+        self.update_current_pos(self.motor.pos_um())
+        self.main_window.update_table_from_hardware_int_time()
+
+        n_done = sum(item.status == DONE for item in items)
+        print("scan queue:", n_done, "of", len(items), "done")
+        for item in items:
+            if item.status == FAILED:
+                print("  ", item.name, "failed:", item.error)
+
     def home_stage(self):
         # if motor is currently moving, just stop the motor.
         if self.motor_runnable_exists.is_set():
@@ -952,57 +1449,184 @@ class FrogLand:
         if self.cont_update_runnable_exists.is_set():
             self.stop_continuous_update()
 
-        self.move_to_pos(self.start_pos_um)
-        self.runnable_update_motor.finished.connect(self._check_if_at_start)
+        # plan and validate every point before the stage moves
+        try:
+            self.scan_plan = self.create_scan_plan()
+        except (StageOutOfBoundsException, ValueError) as e:
+            raise_error(self.error_window, getattr(e, "message", str(e)))
+            return
+
+        if spectrogram_passes > 1 and type(self.scan_plan).extend is not ScanPlan.extend:
+            raise_error(self.error_window, "multiple passes need a fixed delay grid, "
+                                           "turn off adaptive sampling and auto range")
+            return
+
+        duration_s = spectrogram_passes * self.scan_plan.estimate_duration_s(
+            self.spectrometer.integration_time_micros * 1e-6,
+            motion_params=scan_motion_params(self.motor, self.scan_plan.step_um),
+            settle_s=self.motor.settle_dwell_s,
+        )
+        print(self.scan_plan.n_points, "points planned, estimated",
+              "%.1f" % duration_s, "s")
+
+        # the scan moves to the first target itself
+        self._prep_spectrogram()
+        self._start_spectrogram_collection()
+
+    def create_scan_plan(self):
+        # the auto range scan starts at T0 and finds its own end points
+        if self.actionAutoRange.isChecked():
+            return AutoRangeScanPlan(
+                self.T0_um,
+                self.step_size_um_spectrogram,
+                self.motor.travel_limits_um,
+            )
+
+        if self.actionAdaptiveSampling.isChecked():
+            plan_type = AdaptiveScanPlan
+        else:
+            plan_type = ScanPlan
+
+        plan = plan_type(
+            self.start_pos_um,
+            self.end_pos_um,
+            self.step_size_um_spectrogram,
+            self.T0_um,
+            travel_limits_um=self.motor.travel_limits_um,
+        )
+        # the rows are stored at their delay, whichever way the scan goes
+        if alternate_scan_direction:
+            plan = plan.starting_near(self.motor.pos_um())
+        return plan
 
-    def spectrogram_finished(self):
+    def spectrogram_finished(self, result):
         self.spectrogram_now_running = False
         self.btn_collect_spectrogram.setText("Collect \n Spectrogram")
         self.reconnect_for_spectrogram()
+        self.update_current_pos(self.motor.pos_um())
 
-    def _start_spectrogram_collection(self):
+        # the result holds the same rows as the store used for display
+        self.scan_result = result
+        self.spectrogram_store = result.store
+        self.scan_metadata = result.metadata
+        self.scan_arrays = result.arrays
+
+        # report the range found by an auto range scan, and use it as the
+        # start and end position of the next scan
+        if "signal_start_fs" in self.scan_metadata:
+            print("signal found from", "%.1f" % self.scan_metadata["signal_start_fs"],
+                  "fs to", "%.1f" % self.scan_metadata["signal_end_fs"], "fs")
+            self.start_pos_fs = self.scan_metadata["signal_start_fs"]
+            self.end_pos_fs = self.scan_metadata["signal_end_fs"]
+
+        # the passes of a multi-pass scan are replaced by their average
+        if "n_passes" in self.scan_metadata and len(self.spectrogram_store) > 0:
+            print("drift between passes:", "%.2f" % self.scan_metadata.get("drift_rms_fs", 0.0),
+                  "fs rms")
+            self.Taxis_fs, self.spectrogram_array = result.spectrogram()
+            self._setup_2dplot()
+            self.plot2d_window.plotwidget.plot_image(self.spectrogram_array)
+
+    def _start_spectrogram_collection(self, scan=None):
         self.spectrogram_now_running = True
-        self.spectrogram_collection_instance.start()
+        self.spectrogram_collection_instance.start(scan)
 
-    def _check_if_at_start(self):
-        if abs(self.curr_mot_pos_um - self.start_pos_um) > tol_um:
+    def resume_spectrogram(self):
+        if self.hardware_busy():
             return
 
-        else:
-            self._prep_spectrogram()
-            self._start_spectrogram_collection()
+        if self.motor_runnable_exists.is_set():
+            raise_error(self.error_window, "wait for the stage to stop first")
+            return
+
+        if not self.checkpoint.exists():
+            raise_error(self.error_window, "there is no interrupted spectrogram to resume")
+            return
+
+        if self.cont_update_runnable_exists.is_set():
+            self.stop_continuous_update()
 
-    def _prep_spectrogram(self):
+        # the devices are reconnected and T0 is verified by the scan itself,
+        # on the thread pool
+        state = self.checkpoint.load()
+        print("resuming the spectrogram at point", state.n_completed + 1,
+              "of", state.plan.n_points)
+        self.scan_plan = state.plan
+        scan = Scan.from_checkpoint(
+            self.motor,
+            self.spectrometer,
+            state,
+            checkpoint=self.checkpoint,
+            dark_library=self.dark_library if self.subtract_ambient else None,
+        )
+
+        # the rows measured so far are shown, the scan appends to its own
+        self._prep_spectrogram(store=state.store.copy())
+        self._start_spectrogram_collection(scan)
+
+    def _prep_spectrogram(self, store=None):
         if np.all(self.intensities == 0):
             X = self.spectrometer.spectrum()
             self.plot_update(X)
             lims = np.array([0, max(self.intensities)])
-            self.plot1d_window.format_to_xy_data(
-                self.spectrometer.wavelengths(), lims)
+            self.plot1d_window.format_to_xy_data(self.wl_axis, lims)
 
         self.btn_collect_spectrogram.setText("Stop \n Collection")
 
-        self.Taxis_fs_list = []
-        self.spectrogram_array_list = []
+        if store is None:
+            store = SpectrogramStore(
+                len(self.intensities),
+                dtype=self.spectrogram_dtype(),
+                ambient=self.ambient_intensity,
+            )
+        self.spectrogram_store = store
 
         self.plot2d_window.plotwidget.set_cmap("jet")
 
+    def spectrogram_dtype(self):
+        # rows that are spectrometer counts are stored as integers, rows
+        # rescaled by HDR or per point exposure need floats
+        if self.actionHDR.isChecked() or self.actionAdaptiveExposure.isChecked():
+            return processing_dtype
+        return self.spectrometer.counts_dtype
+
+    # rows in the order they were measured, the plan decides how they map
+    # onto the (uniform) axis that is displayed and saved
+    @property
+    def Taxis_fs_sampled(self):
+        return self.spectrogram_store.T_fs
+
+    @property
+    def spectrogram_array_sampled(self):
+        return self.spectrogram_store.subtracted()
+
+    @property
+    def saturation_mask_sampled(self):
+        return self.spectrogram_store.saturated
+
     def _setup_2dplot(self):
-        self.wl_axis = self.spectrometer.wavelengths()
         self.plot2d_window.plotwidget.scale_axes(
             x=self.Taxis_fs, y=self.wl_axis, format="xy"
         )
         self.plot2d_window.format_to_xy_data(self.Taxis_fs, self.wl_axis)
 
-    def update_spectrogram_plot(self, X):
-        self.plot_update(X)
-        wavelengths, intensities, n, pos_fs = X
+    def update_spectrogram_plot(self, point):
+        print("point", point.n + 1, "of", point.n_points)
+        self.plot_update((self.wl_axis, point.intensities), saturated=point.saturated)
+
+        # each pass of a multi-pass scan is shown on its own
+        if point.n == 0 and len(self.spectrogram_store) > 0:
+            self.spectrogram_store = SpectrogramStore(
+                len(self.intensities),
+                dtype=self.spectrogram_store.dtype,
+                ambient=self.spectrogram_store.ambient,
+            )
 
-        self.Taxis_fs_list.append(pos_fs)
-        self.spectrogram_array_list.append(self.bckgnd_subtrd)
+        # a copy for display, the scan appends to its own store in its thread
+        self.spectrogram_store.append(point.T_fs, point.intensities, point.saturated)
 
-        self.Taxis_fs = np.array(self.Taxis_fs_list)
-        self.spectrogram_array = np.array(self.spectrogram_array_list)
+        self.Taxis_fs, self.spectrogram_array = self.scan_plan.resample(
+            self.Taxis_fs_sampled, self.spectrogram_array_sampled)
 
         self._setup_2dplot()
 
@@ -1010,14 +1634,21 @@ class FrogLand:
 
 
 class CollectSpectrogram:
+    """
+    Runs a Scan (see scan_core.py) with the settings of the GUI on the
+    thread pool. Its points are passed on through signal.progress for
+    display, and its ScanResult through signal.finished.
+    """
+
     def __init__(self, frogland: FrogLand):
         self.frogland = frogland
         self.motor = frogland.motor
         self.spectrometer = frogland.spectrometer
 
         self.signal = Signal()
-        self.n = 0
-        self._stop = False
+        # stage readings while moving between points
+        self.position_signal = Signal()
+        self.scan = None
 
     def connect_signals(self):
         self.frogland.btn_collect_spectrogram.clicked.connect(self.stop)
@@ -1036,91 +1667,77 @@ class CollectSpectrogram:
         self.frogland.btn_start.clicked.disconnect(self.stop)
 
     @property
-    def step_um(self):
-        return self.frogland.step_size_um_spectrogram
-
-    @property
-    def end_pos_um(self):
-        return self.frogland.end_pos_um
-
-    @property
-    def end_pos_fs(self):
-        return self.frogland.end_pos_fs
+    def plan(self):
+        return self.frogland.scan_plan
 
     def stop(self):
-        if self.frogland.spectrogram_now_running:
-            self._stop = True
+        if self.frogland.spectrogram_now_running and self.scan is not None:
+            self.scan.stop()
 
         else:
             return
 
-    def start(self):
-        # re-initialize the spectrogram collection index
-        self.n = 0
+    def create_scan(self):
+        frogland = self.frogland
+        if frogland.actionHDR.isChecked():
+            ladder = hdr_exposure_ladder
+        else:
+            ladder = None
+        if frogland.actionAdaptiveExposure.isChecked():
+            max_factor = adaptive_exposure_max_factor
+        else:
+            max_factor = None
+        if frogland.actionAbortOnSaturation.isChecked():
+            max_saturated = max_saturated_pixels
+        else:
+            max_saturated = None
+
+        settings = dict(
+            ambient=frogland.ambient_intensity.copy(),
+            dark_library=frogland.dark_library if frogland.subtract_ambient else None,
+            hdr_exposure_ladder=ladder,
+            adaptive_exposure_max_factor=max_factor,
+            max_saturated_pixels=max_saturated,
+        )
+        if spectrogram_passes > 1:
+            return MultiPassScan(self.motor, self.spectrometer, self.plan, spectrogram_passes,
+                                 max_shift_fs=max_pass_shift_fs, **settings)
+
+        return Scan(self.motor, self.spectrometer, self.plan,
+                    checkpoint=frogland.checkpoint, **settings)
 
+    def start(self, scan=None):
         self.frogland.disconnect_for_spectrogram()
         self.connect_signals()
 
+        # a new scan with the settings of the GUI, unless one is resumed
+        if scan is None:
+            scan = self.create_scan()
+        self.scan = scan
+        self.runnable_scan = TaskRunnable(
+            self.scan.run,
+            exceptions=(StageNotSettledException, StageOutOfBoundsException,
+                        SpectrometerIntegrationException, DeviceCommsException),
+            position_callback=self.position_signal.progress.emit,
+        )
+        self.runnable_scan.progress.connect(self.signal.progress.emit)
+        self.runnable_scan.error.connect(self.frogland.show_error)
+        self.runnable_scan.finished.connect(self.finish)
+
         # begin the collection
-        self.step_one()
-
-    def emit_data(self, pos_um):
-        # collect spectrum
-        wavelengths, intensities = self.spectrometer.spectrum()
-
-        """trying to average without detector saturation. Doesn't really help """
-        # __________________________________________________________
-        # N = 10
-        # Intensities = np.zeros((N, len(intensities)))
-        # Intensities[0] = intensities
-        #
-        # for i in range(1, N - 1, 1):
-        #     Intensities[i] = self.spectrometer.get_spectrum()[1]
-        #
-        # intensities = np.mean(Intensities, 0)
-        # __________________________________________________________
-
-        pos_fs = dist_um_to_T_fs(pos_um - self.motor.T0_um)
-        self.signal.progress.emit((wavelengths, intensities, self.n, pos_fs))
-
-    def step_one(self):
-        # check the stop flag, if it is true,
-        # toggle it back to false and return
-        if self._stop:
-            self._stop = False
-            self.disconnect_signals()
-            self.signal.finished.emit(None)
-            return
+        pool.start(self.runnable_scan)
 
-        # if we are not at the end of the spectrogram range
-        # then collect a spectrum and step the motor
-        else:
-            pos_um = self.frogland.curr_mot_pos_um
-
-            pos_fs = dist_um_to_T_fs(pos_um - self.motor.T0_um)
-            print("point", self.n + 1, ", ",
-                  self.end_pos_fs - pos_fs, "fs remaining")
-
-            self.emit_data(pos_um)
-
-            if np.round(pos_um, 3) <= np.round(self.end_pos_um, 3):
-                # step the motor
-                self.frogland.step_right(
-                    step_size_um=self.step_um, ignore_spectrogram=True
-                )
-                # connect motor finished flag to step_two
-                self.frogland.runnable_update_motor.finished.connect(
-                    self.step_two)
-
-            # otherwise, flag that the spectrogram collection is done
-            else:
-                self.disconnect_signals()
-                self.signal.finished.emit(None)
-
-    def step_two(self):
-        # increment spectrogram collection index, and iterate again
-        self.n += 1
-        self.step_one()
+    def finish(self, result):
+        # the result is also kept when the scan raised
+        result = self.scan.result
+        self.disconnect_signals()
+        self.signal.finished.emit(result)
+
+        if self.frogland.checkpoint.exists():
+            print("spectrogram interrupted, \"Resume Spectrogram\" continues it")
+
+        if result.error is not None:
+            raise_error(self.frogland.error_window, result.error)
 
 
 if __name__ == "__main__":
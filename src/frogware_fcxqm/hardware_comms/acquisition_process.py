@@ -0,0 +1,335 @@
+import time
+import queue
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .device_interfaces import Spectrometer, SpectrometerIntegrationException, \
+    SpectrometerAverageException, DeviceCommsException
+
+'''
+Reads the spectrometer in a separate process, so that the timing of the
+acquisition does not depend on the GUI (plotting and processing hold the
+GIL for long stretches once the spectrogram gets large).
+
+The acquisition process owns the Spectrometer and reads frames continuously
+into a FrameRing, a ring buffer in shared memory. ProcessSpectrometer
+implements the Spectrometer interface on top of the ring in the GUI process,
+so the rest of the program does not know the difference.
+'''
+
+# header counters of the ring, each one is written by one process only:
+# frames published and frames dropped by the producer, frames released by
+# the consumer
+_WRITTEN, _DROPPED, _READ = range(3)
+
+
+class FrameRing:
+    '''
+    Ring buffer of spectra in shared memory with one writing and one reading
+    process. Each slot holds a frame, its sequence number, the time its read
+    was started (time.monotonic(), which is system wide) and the integration
+    time it was taken with.
+
+    A frame returned by read() is a view into the ring and stays valid until
+    the next call to read(): the slot is only released to the producer then,
+    so the reader needs no copy. When the ring is full the producer keeps
+    reading the spectrometer at its own pace and counts the frames it could
+    not store as dropped.
+
+    capacity: number of slots
+    n_pixels: pixels per frame
+    dtype: dtype of the frames
+    name: name of an existing ring to attach to, a new one is created if None
+    '''
+
+    def __init__(self, capacity: int, n_pixels: int, dtype, name: str = None):
+        self.capacity = capacity
+        self.n_pixels = n_pixels
+        self.dtype = np.dtype(dtype)
+
+        meta_bytes = 8 * (3 + 3 * capacity)
+        size = meta_bytes + capacity * n_pixels * self.dtype.itemsize
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+
+        buf = self.shm.buf
+        self._header = np.ndarray(3, dtype=np.int64, buffer=buf)
+        self.seq = np.ndarray(capacity, dtype=np.int64, buffer=buf, offset=8 * 3)
+        self.t_start = np.ndarray(capacity, dtype=np.float64, buffer=buf,
+                                  offset=8 * (3 + capacity))
+        self.integration_time_micros = np.ndarray(capacity, dtype=np.int64, buffer=buf,
+                                                  offset=8 * (3 + 2 * capacity))
+        self.frames = np.ndarray((capacity, n_pixels), dtype=self.dtype, buffer=buf,
+                                 offset=meta_bytes)
+        if name is None:
+            self._header[:] = 0
+
+        self._held = False
+        self._scratch = None
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def frames_written(self) -> int:
+        return int(self._header[_WRITTEN])
+
+    @property
+    def frames_dropped(self) -> int:
+        return int(self._header[_DROPPED])
+
+    '''
+    Producer side: reads one frame from spectrometer straight into the next
+    free slot and publishes it. If the ring is full the frame is read into a
+    scratch buffer and counted as dropped.
+
+    spectrometer: Spectrometer to read
+    integration_time_micros: integration time the frame is taken with
+    '''
+
+    def write(self, spectrometer: Spectrometer, integration_time_micros: int) -> None:
+        written = self._header[_WRITTEN]
+        t_start = time.monotonic()
+        if written - self._header[_READ] >= self.capacity:
+            if self._scratch is None:
+                self._scratch = np.empty((1, self.n_pixels), dtype=self.dtype)
+            spectrometer.read_frames(1, out=self._scratch)
+            self._header[_DROPPED] += 1
+            return
+
+        slot = written % self.capacity
+        spectrometer.read_frames(1, out=self.frames[slot:slot + 1])
+        self.seq[slot] = written
+        self.t_start[slot] = t_start
+        self.integration_time_micros[slot] = integration_time_micros
+        # publish only once the slot is complete
+        self._header[_WRITTEN] = written + 1
+
+    '''
+    Consumer side: waits for the oldest unread frame that was started at or
+    after not_before and taken with integration_time_micros. Older frames
+    are released without being returned.
+
+    not_before: time.monotonic() the frame read must have started at, or None
+    integration_time_micros: required integration time, or None for any
+    timeout_s: how long to wait for such a frame
+
+    returns: (sequence number, frame view)
+
+    raises: TimeoutError if no such frame arrived within timeout_s
+    '''
+
+    def read(self, not_before: float = None, integration_time_micros: int = None,
+             timeout_s: float = 10.0) -> tuple[int, np.ndarray]:
+        self.release()
+        deadline = time.monotonic() + timeout_s
+        while True:
+            read = self._header[_READ]
+            if read < self._header[_WRITTEN]:
+                slot = read % self.capacity
+                if ((not_before is None or self.t_start[slot] >= not_before) and
+                        (integration_time_micros is None or
+                         self.integration_time_micros[slot] == integration_time_micros)):
+                    self._held = True
+                    return int(self.seq[slot]), self.frames[slot]
+                self._header[_READ] = read + 1
+                continue
+
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"no frame within {timeout_s} s")
+            time.sleep(1e-4)
+
+    '''
+    Releases the frame returned by the last read() to the producer.
+    '''
+
+    def release(self) -> None:
+        if self._held:
+            self._header[_READ] += 1
+            self._held = False
+
+    def close(self) -> None:
+        # the views must go before the mapping can be closed
+        del self._header, self.seq, self.t_start, self.integration_time_micros, self.frames
+        try:
+            self.shm.close()
+        except BufferError:
+            # a frame returned by read() is still referenced, the mapping
+            # goes with it
+            pass
+
+    def unlink(self) -> None:
+        self.shm.unlink()
+
+
+def _acquire(connect, capacity, conn, commands, stop):
+    '''
+    Body of the acquisition process. Settings sent over commands as
+    (attribute, value) pairs are applied between frames.
+    '''
+    try:
+        spectrometer = connect()
+    except Exception as e:
+        conn.send(getattr(e, "message", str(e)))
+        return
+
+    wavelengths = np.array(spectrometer.wavelengths())
+    ring = FrameRing(capacity, len(wavelengths), spectrometer.counts_dtype)
+    conn.send({
+        "name": ring.name,
+        "dtype": ring.dtype.str,
+        "wavelengths": wavelengths,
+        "max_counts": spectrometer.max_counts,
+        "integration_time_micros": spectrometer.integration_time_micros,
+        "integration_time_micros_limit": tuple(spectrometer.integration_time_micros_limit),
+        "scans_to_avg": getattr(spectrometer, "_scans_to_avg", 1),
+    })
+
+    try:
+        while not stop.is_set():
+            while True:
+                try:
+                    attribute, value = commands.get_nowait()
+                except queue.Empty:
+                    break
+                setattr(spectrometer, attribute, value)
+            ring.write(spectrometer, int(round(spectrometer.integration_time_micros)))
+    finally:
+        spectrometer.close()
+        ring.close()
+        ring.unlink()
+
+
+class ProcessSpectrometer(Spectrometer):
+    '''
+    Spectrometer read by a separate acquisition process. Every call to
+    intensities() returns a frame whose read started after the call (and
+    after the last change of integration time), the same as reading the
+    spectrometer directly. The frame is copied out of the shared memory ring,
+    since the slot is handed back to the producer on the next read while the
+    frame may still be in use (e.g. emitted to the GUI thread).
+
+    Integration times are whole microseconds here: the ring stores them as
+    integers, and frames are matched to the integration time by equality.
+
+    connect: picklable function (module level) that connects and returns the
+    Spectrometer, called in the acquisition process
+    capacity: number of frames in the ring
+    timeout_s: how long to wait for the connection and for each frame
+    '''
+
+    def __init__(self, connect, capacity: int = 64, timeout_s: float = 10.0):
+        self.timeout_s = timeout_s
+        # spawn, so that the child does not inherit the Qt state of the GUI
+        ctx = mp.get_context("spawn")
+        self._commands = ctx.Queue()
+        self._stop = ctx.Event()
+        conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_acquire, args=(connect, capacity, child_conn, self._commands, self._stop),
+            daemon=True)
+        self.process.start()
+
+        if not conn.poll(timeout_s):
+            self.process.terminate()
+            raise DeviceCommsException("Acquisition process did not respond")
+        info = conn.recv()
+        if isinstance(info, str):
+            self.process.join()
+            raise DeviceCommsException(info)
+
+        self._wavelengths = info["wavelengths"]
+        self._wavelengths.setflags(write=False)
+        self._max_counts = info["max_counts"]
+        self._integration_time_micros = int(round(info["integration_time_micros"]))
+        self._integration_time_micros_limit = info["integration_time_micros_limit"]
+        self._scans_to_avg = info["scans_to_avg"]
+        self.ring = FrameRing(capacity, len(self._wavelengths), info["dtype"], name=info["name"])
+
+    @property
+    def max_counts(self):
+        return self._max_counts
+
+    @property
+    def frames_dropped(self) -> int:
+        return self.ring.frames_dropped
+
+    @property
+    def frames_written(self) -> int:
+        return self.ring.frames_written
+
+    def _read(self, not_before):
+        try:
+            return self.ring.read(not_before, self._integration_time_micros,
+                                  timeout_s=self.timeout_s + self._integration_time_micros * 1e-6)[1]
+        except TimeoutError:
+            raise DeviceCommsException("Acquisition process stopped delivering frames")
+
+    def intensities(self):
+        frame = self._read(time.monotonic()).copy()
+        self.ring.release()
+        return frame
+
+    def read_frames(self, n, out=None):
+        if out is None:
+            out = np.empty((n, len(self._wavelengths)), dtype=self.ring.dtype)
+        elif len(out) < n:
+            raise ValueError(f"out holds {len(out)} frames, {n} requested")
+
+        # consecutive frames, all started after the call
+        not_before = time.monotonic()
+        for i in range(n):
+            out[i] = self._read(not_before)
+            not_before = None
+        self.ring.release()
+        return out[:n]
+
+    def wavelengths(self):
+        return self._wavelengths
+
+    def spectrum(self):
+        return self._wavelengths, self.intensities()
+
+    @property
+    def integration_time_micros(self):
+        return self._integration_time_micros
+
+    @integration_time_micros.setter
+    def integration_time_micros(self, value):
+        # the same integer is stored with the frames in the ring, so that a
+        # non-integral value (auto exposure, HDR ladders) still matches them
+        value = int(round(value))
+        if not (self._integration_time_micros_limit[0] <= value <= self._integration_time_micros_limit[1]):
+            raise SpectrometerIntegrationException(
+                '''Integration time exceeds limits''')
+        self._commands.put(("integration_time_micros", value))
+        self._integration_time_micros = value
+
+    @property
+    def scans_to_avg(self):
+        return self._scans_to_avg
+
+    @scans_to_avg.setter
+    def scans_to_avg(self, N: int):
+        if N <= 0:
+            raise SpectrometerAverageException(
+                "Spectrometer must average at least 1 scan")
+        self._commands.put(("scans_to_avg", N))
+        self._scans_to_avg = N
+
+    @property
+    def integration_time_micros_limit(self):
+        return self._integration_time_micros_limit
+
+    def close(self):
+        self.ring.release()
+        self._stop.set()
+        self.process.join(self.timeout_s)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.ring.close()
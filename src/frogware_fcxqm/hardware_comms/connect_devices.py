@@ -4,10 +4,36 @@ from seabreeze.spectrometers import Spectrometer as ooSpec
 from .device_interfaces import LinearMotor, Spectrometer, DeviceCommsException
 from .kinesis import ThorlabsKinesisMotor
 from .ocean import OceanOpticsSpectrometer
+from .acquisition_process import ProcessSpectrometer
+
+'''
+Create and initialize desired subclass of Spectrometer. Module level so that
+it can be run in the acquisition process.
+
+returns: the fully initialized spectrometer
+
+raises: DeviceCommsException if there is a failure in the
+connection/initialization
+'''
+
+
+def connect_spectrometer() -> Spectrometer:
+    try:
+        spectrometer = OceanOpticsSpectrometer(ooSpec.from_first_available())
+    except:
+        raise DeviceCommsException('Spectrometer did not connect')
+
+    spectrometer.integration_time_micros = 30000
+    spectrometer.scans_to_avg = 1
+    return spectrometer
+
 
 '''
 Create and initialize desired subclass of LinearMotor and Spectrometer
 
+spectrometer_in_process: read the spectrometer in a separate acquisition
+process (see acquisition_process.py)
+
 returns: tuple of the fully initialized motor and spectrometer devices 
 
 raises: DeviceCommsException if there is a failure in the
@@ -15,19 +41,50 @@ connection/initialization of either device
 '''
 
 
-def connect_devices() -> tuple[LinearMotor, Spectrometer]:
+def connect_devices(spectrometer_in_process: bool = False) -> tuple[LinearMotor, Spectrometer]:
     try:
         motor = ThorlabsKinesisMotor(list_kinesis_devices()[0][0])
     except:
         raise DeviceCommsException('Motor did not connect')
 
-    try:
-        spectrometer = OceanOpticsSpectrometer(ooSpec.from_first_available())
-    except:
-        raise DeviceCommsException('Spectrometer did not connect')
+    if spectrometer_in_process:
+        spectrometer = ProcessSpectrometer(connect_spectrometer)
+    else:
+        spectrometer = connect_spectrometer()
 
-    spectrometer.integration_time_micros = 30000
-    spectrometer.scans_to_avg = 1
     motor.travel_limits_um = (0, 2e4)
+    motor.settle_tol_um = 0.1
+    motor.settle_dwell_s = 0.02
+    motor.scan_acceleration_um_s2 = 4e3  # Z8 series max acceleration
 
     return motor, spectrometer
+
+
+'''
+Create and initialize the LinearMotors of further stages, e.g. for
+spectrograms as a function of a wedge or compressor position (see
+..nd_scan.py). The first Kinesis device is the delay stage of
+connect_devices(), the others are returned here.
+
+returns: list of the fully initialized motors, in the order Kinesis lists
+them
+
+raises: DeviceCommsException if there is a failure in the
+connection/initialization of any of them
+'''
+
+
+def connect_parameter_motors() -> list[LinearMotor]:
+    motors = []
+    for serial_no, _ in list_kinesis_devices()[1:]:
+        try:
+            motor = ThorlabsKinesisMotor(serial_no)
+        except:
+            raise DeviceCommsException(f'Motor {serial_no} did not connect')
+
+        motor.travel_limits_um = (0, 2.5e4)
+        motor.settle_tol_um = 0.5
+        motor.settle_dwell_s = 0.05
+        motors.append(motor)
+
+    return motors
@@ -4,6 +4,8 @@ from platformdirs import user_data_path
 from pathlib import Path
 
 from .utilities import T_fs_to_dist_um, dist_um_to_T_fs
+from .settle import SettleDetector, SETTLED, STALLED
+from ..dtypes import counts_dtype
 
 '''
 Abstract class for linear motors. Implement this with a subclass for
@@ -12,6 +14,24 @@ new motor devices.
 
 
 class LinearMotor(ABC):
+    # settle detection used by wait_until_settled(), the defaults can be
+    # overridden per instance in .connect_devices.connect_devices()
+    settle_tol_um = 0.1  # 100 nm
+    settle_dwell_s = 0.02
+    settle_timeout_s = 5.0
+    settle_retries = 2
+
+    # acceleration used for the short steps of a scan, see
+    # .utilities.short_step_motion_params(). None keeps the controller's
+    # acceleration.
+    scan_acceleration_um_s2 = None
+
+    # offset of the actual stage position from the reading after a move in
+    # the forward (increasing position) and backward direction, in microns.
+    # Backlash between the encoder and the stage shows up as a difference
+    # of the two, see ..backlash.measure_direction_offsets().
+    direction_offsets_um = (0.0, 0.0)
+
     '''
     Software limits for the stage
 
@@ -87,6 +107,18 @@ class LinearMotor(ABC):
     def pos_fs(self) -> float:
         return dist_um_to_T_fs(self.pos_um - self.T0_um)
 
+    '''
+    Offset of the actual stage position from pos_um() after a move in the
+    given direction, from direction_offsets_um.
+
+    direction: sign of the last move, positive for forward
+    returns: offset to add to the reading, in microns
+    '''
+
+    def direction_offset_um(self, direction: float) -> float:
+        forward_um, backward_um = self.direction_offsets_um
+        return backward_um if direction < 0 else forward_um
+
     '''
     Move the relative position of the stage (micron units).
 
@@ -162,6 +194,89 @@ class LinearMotor(ABC):
     def stop(self, blocking=True) -> None:
         pass
 
+    '''
+    Blocks until the encoder readings have stayed within settle_tol_um of
+    the target for settle_dwell_s. If the stage stops outside the tolerance,
+    or does not settle within settle_timeout_s after the controller stops
+    reporting motion, the move to the target is re-issued up to
+    settle_retries times. The travel itself may take any time.
+
+    A stop requested by the user (stop_event set, e.g. from the GUI thread)
+    stops the stage from this loop, so that the port is only written from one
+    thread, and returns where the stage stopped. The move is not re-issued.
+
+    target_um: target position of the move in progress, in microns
+    callback: optional function called with every position reading
+    stop_event: optional threading.Event that ends the wait early
+    returns: the settled position (or where it was stopped), in microns
+    raises: StageNotSettledException if the stage is still outside the
+    tolerance after all retries
+    '''
+
+    def wait_until_settled(self, target_um: float, callback=None, stop_event=None) -> float:
+        detector = SettleDetector(
+            target_um, self.settle_tol_um, self.settle_dwell_s)
+
+        pos_um = self.pos_um()
+        for attempt in range(self.settle_retries + 1):
+            if stop_event is not None and stop_event.is_set():
+                break
+            if attempt > 0:
+                self.stop(blocking=True)
+                self.move_to_um(target_um)
+                detector.reset()
+
+            while detector.elapsed_s() < self.settle_timeout_s:
+                if stop_event is not None and stop_event.is_set():
+                    break
+                pos_um = self.pos_um()
+                if callback is not None:
+                    callback(pos_um)
+
+                state = detector.update(pos_um, self.is_in_motion())
+                if state == SETTLED:
+                    return pos_um
+                if state == STALLED:
+                    break
+
+        if stop_event is not None and stop_event.is_set():
+            self.stop(blocking=True)
+            return self.pos_um()
+
+        raise StageNotSettledException(
+            f"Stage did not settle within {self.settle_tol_um} um of "
+            f"{target_um} um (last read {pos_um} um)")
+
+    '''
+    Velocity profile used for moves.
+
+    returns: (max velocity in um/s, acceleration in um/s^2), or None if the
+    backend does not support reading it
+    '''
+    @property
+    def motion_params(self) -> tuple[float, float]:
+        return None
+
+    '''
+    Sets the velocity profile used for moves. Backends that do not support
+    this ignore it.
+
+    params: listlike containing (max velocity in um/s, acceleration in um/s^2)
+    '''
+    @motion_params.setter
+    def motion_params(self, params: tuple[float, float]) -> None:
+        pass
+
+    '''
+    Re-opens the connection to the device after the link dropped, keeping
+    its settings. Backends that cannot lose their link need not override
+    this.
+
+    raises: DeviceCommsException if the device cannot be reached
+    '''
+    def reconnect(self) -> None:
+        pass
+
     '''
     Closes the backend to avoid hanging processes.
     '''
@@ -201,18 +316,54 @@ Abstract class for spectrometers
 
 
 class Spectrometer(ABC):
+    # full scale of the detector in counts, override for backends that are
+    # not 16 bit
+    max_counts = 65535
+
+    '''
+    Integer dtype that holds the counts of one pixel
+
+    returns: numpy dtype
+    '''
+    @property
+    def counts_dtype(self):
+        return counts_dtype(self.max_counts)
 
     '''
     The intensities read by each pixel in the spectrometer (in arbitrary units).
 
-    returns: NDArray of floats corresponding to the intensity in arbitrary units
+    returns: NDArray corresponding to the intensity in arbitrary units, of
+    dtype counts_dtype for backends that report integer counts
     '''
     @abstractmethod
-    def intensities(self) -> np.ndarray[np.float64]:
+    def intensities(self) -> np.ndarray:
         pass
 
     '''
-    Returns the wavelength bins (in nanometers).
+    Reads n consecutive spectra into one array. Backends that can read
+    several frames with less overhead than calling intensities() in a loop
+    should override this.
+
+    n: number of frames to read
+    out: optional (n, pixels) array to fill in place, allocated with dtype
+    counts_dtype if None
+
+    returns: (n, pixels) NDArray, out if it was given
+    '''
+    def read_frames(self, n: int, out: np.ndarray = None) -> np.ndarray:
+        if out is None:
+            out = np.empty((n, len(self.wavelengths())), dtype=self.counts_dtype)
+        elif len(out) < n:
+            raise ValueError(f"out holds {len(out)} frames, {n} requested")
+
+        for i in range(n):
+            out[i] = self.intensities()
+        return out[:n]
+
+    '''
+    Returns the wavelength bins (in nanometers). The calibration does not
+    change while connected, so implementations should read it once and
+    return the same read only array on every call.
     
     returns: NDArray of floats enumarating the wavelength bins in nanometers'''
     @abstractmethod
@@ -220,14 +371,14 @@ class Spectrometer(ABC):
         pass
 
     '''
-    Returns a 2-D list of the wavelengths (0) and intensities (1)
+    Returns the wavelengths (0) and intensities (1)
 
-    returns: 2DArray where,
-            [0] = wavelengths
-            [1] = intensities
+    returns: pair where,
+            [0] = wavelengths, the array returned by wavelengths()
+            [1] = intensities, as returned by intensities()
     '''
     @abstractmethod
-    def spectrum(self) -> np.ndarray[np.float64]:
+    def spectrum(self) -> tuple[np.ndarray, np.ndarray]:
         pass
 
     '''
@@ -281,6 +432,16 @@ class Spectrometer(ABC):
     def integration_time_micros_limit(self) -> tuple[int, int]:
         pass
 
+    '''
+    Re-opens the connection to the device after the link dropped, keeping
+    its settings. Backends that cannot lose their link need not override
+    this.
+
+    raises: DeviceCommsException if the device cannot be reached
+    '''
+    def reconnect(self) -> None:
+        pass
+
     '''
     Closes the backend to avoid hanging processes.
     '''
@@ -294,6 +455,11 @@ class StageOutOfBoundsException(Exception):
         self.message = message
 
 
+class StageNotSettledException(Exception):
+    def __init__(self, message):
+        self.message = message
+
+
 class StageLimitsNotSetException(Exception):
     def __init__(self, message):
         self.message = message
@@ -1,7 +1,8 @@
 from pylablib.devices.Thorlabs import KinesisMotor
 from pylablib.devices.Thorlabs.base import ThorlabsError
 
-from .device_interfaces import LinearMotor, StageOutOfBoundsException, StageNotCalibratedException
+from .device_interfaces import LinearMotor, StageOutOfBoundsException, StageNotCalibratedException, \
+    DeviceCommsException
 '''
 Class for all Thorlabs linear motors which 
 use the Kinesis software stack
@@ -71,5 +72,31 @@ class ThorlabsKinesisMotor(LinearMotor):
         except ThorlabsError:
             pass
 
+    @property
+    def motion_params(self):
+        # default units are (m/s) and (m/s^2)
+        try:
+            params = self.motor.get_velocity_parameters(scale=True)
+        except ThorlabsError:
+            return None
+        return 1e6 * params.max_velocity, 1e6 * params.acceleration
+
+    @motion_params.setter
+    def motion_params(self, params):
+        max_velocity_um_s, acceleration_um_s2 = params
+        try:
+            self.motor.setup_velocity(acceleration=acceleration_um_s2 * 1e-6,
+                                      max_velocity=max_velocity_um_s * 1e-6,
+                                      scale=True)
+        except ThorlabsError:
+            pass
+
+    def reconnect(self) -> None:
+        try:
+            self.motor.close()
+            self.motor.open()
+        except ThorlabsError:
+            raise DeviceCommsException('Motor did not reconnect')
+
     def close(self) -> None:
         self.motor.close()
@@ -1,5 +1,8 @@
-from .device_interfaces import Spectrometer, SpectrometerIntegrationException, SpectrometerAverageException
-from seabreeze.spectrometers import Spectrometer as ooSpec
+from .device_interfaces import Spectrometer, SpectrometerIntegrationException, SpectrometerAverageException, \
+    DeviceCommsException
+from ..dtypes import to_counts
+import numpy as np
+from seabreeze.spectrometers import Spectrometer as ooSpec, SeaBreezeError
 import seabreeze
 seabreeze.use('cseabreeze')
 
@@ -7,15 +10,37 @@ seabreeze.use('cseabreeze')
 class OceanOpticsSpectrometer(Spectrometer):
     def __init__(self, spectrometer: ooSpec):
         self.spectrometer = spectrometer
+        self._wavelengths = None
 
     def intensities(self):
-        return self.spectrometer.intensities()
+        # seabreeze reports the (integer) counts as float64
+        return to_counts(self.spectrometer.intensities(), self.counts_dtype)
+
+    def read_frames(self, n, out=None):
+        if out is None:
+            out = np.empty((n, len(self.wavelengths())), dtype=self.counts_dtype)
+        elif len(out) < n:
+            raise ValueError(f"out holds {len(out)} frames, {n} requested")
+
+        # seabreeze has no call that reads several frames at once, so this is
+        # the loop of the base class; it only saves the dispatch through
+        # intensities(). Integer buffers get the frames rounded and clipped,
+        # so that an out of range float64 value cannot wrap around.
+        read = self.spectrometer.intensities
+        integer = np.issubdtype(out.dtype, np.integer)
+        for i in range(n):
+            out[i] = to_counts(read(), out.dtype) if integer else read()
+        return out[:n]
 
     def wavelengths(self):
-        return self.spectrometer.wavelengths()
+        # the calibration is read once per connection
+        if self._wavelengths is None:
+            self._wavelengths = self.spectrometer.wavelengths()
+            self._wavelengths.setflags(write=False)
+        return self._wavelengths
 
     def spectrum(self):
-        return self.spectrometer.spectrum()
+        return self.wavelengths(), self.intensities()
 
     @property
     def integration_time_micros(self):
@@ -50,10 +75,24 @@ class OceanOpticsSpectrometer(Spectrometer):
             #self._scans_to_avg = N
             #self.spectrometer.f.spectrum_processing.set_scans_to_average(N)
 
+    @property
+    def max_counts(self):
+        return self.spectrometer.max_intensity
+
     @property
     def integration_time_micros_limit(self):
         return self.spectrometer.integration_time_micros_limits
 
+    def reconnect(self):
+        try:
+            self.spectrometer.close()
+            self.spectrometer.open()
+        except SeaBreezeError:
+            raise DeviceCommsException('Spectrometer did not reconnect')
+        # the device comes back with its defaults
+        if getattr(self, "_integration_time_micros", None) is not None:
+            self.spectrometer.integration_time_micros(self._integration_time_micros)
+
     def close(self):
         self.spectrometer.close()
 
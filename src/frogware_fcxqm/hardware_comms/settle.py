@@ -0,0 +1,92 @@
+import time
+
+'''
+States reported by SettleDetector.update()
+'''
+MOVING = "moving"
+SETTLED = "settled"
+STALLED = "stalled"
+
+
+class SettleDetector:
+    '''
+    Decides when a stage has arrived at a target from a stream of encoder
+    readings, instead of waiting for the controller's own (conservative)
+    settling window to report that motion is over.
+
+    The stage is "settled" once consecutive readings have stayed within
+    tol_um of the target for at least dwell_s. It is "stalled" if the
+    controller reports no motion while the readings stay outside the
+    tolerance for stall_s, which means the move has to be re-issued.
+
+    target_um: target position, in microns
+    tol_um: allowed distance from the target, in microns
+    dwell_s: time the readings must stay within tolerance, in seconds
+    stall_s: time the stage may sit outside the tolerance without moving
+    before being reported as stalled, in seconds
+    '''
+
+    def __init__(self, target_um: float, tol_um: float, dwell_s: float, stall_s: float = 0.05):
+        self.target_um = target_um
+        self.tol_um = tol_um
+        self.dwell_s = dwell_s
+        self.stall_s = stall_s
+        self.reset()
+
+    def reset(self) -> None:
+        self._t_in_tol = None
+        self._t_stalled = None
+        self._n_in_tol = 0
+        self.t_start = time.perf_counter()
+        # last time the controller reported motion, the settle time counts
+        # from there
+        self._t_moving = self.t_start
+
+    '''
+    Feed one encoder reading to the detector.
+
+    pos_um: stage position read from the encoder, in microns
+    in_motion: whether the controller reports the stage as moving
+    t: time stamp of the reading in seconds, defaults to time.perf_counter()
+
+    returns: MOVING, SETTLED or STALLED
+    '''
+
+    def update(self, pos_um: float, in_motion: bool, t: float = None) -> str:
+        if t is None:
+            t = time.perf_counter()
+        if in_motion:
+            self._t_moving = max(self._t_moving, t)
+
+        if abs(pos_um - self.target_um) <= self.tol_um:
+            self._t_stalled = None
+            if self._t_in_tol is None:
+                self._t_in_tol = t
+            self._n_in_tol += 1
+
+            # require at least two consecutive readings, so that a single
+            # reading on the way through the target does not count
+            if self._n_in_tol >= 2 and t - self._t_in_tol >= self.dwell_s:
+                return SETTLED
+            return MOVING
+
+        self._t_in_tol = None
+        self._n_in_tol = 0
+
+        if in_motion:
+            self._t_stalled = None
+            return MOVING
+
+        if self._t_stalled is None:
+            self._t_stalled = t
+        if t - self._t_stalled >= self.stall_s:
+            return STALLED
+        return MOVING
+
+    '''
+    Time since the controller last reported motion (or since the reset), so
+    that a long move is not mistaken for one that does not settle.
+    '''
+
+    def elapsed_s(self) -> float:
+        return time.perf_counter() - self._t_moving
@@ -1,3 +1,4 @@
+import numpy as np
 from scipy.constants import c as C_MKS
 
 
@@ -15,3 +16,38 @@ def T_fs_to_dist_um(value_fs):
     :return value_um: delta x in micron
     """
     return (C_MKS * value_fs / 2) * 1e-9
+
+
+def move_time_s(dist_um, max_velocity_um_s, acceleration_um_s2):
+    """
+    :param dist_um: length of the move in micron
+    :param max_velocity_um_s: max velocity of the profile in micron/s
+    :param acceleration_um_s2: acceleration of the profile in micron/s^2
+    :return time_s: duration of a trapezoidal (or triangular, for short
+        moves) velocity profile in seconds
+    """
+    dist_um = np.abs(dist_um)
+    # distance needed to reach max velocity and stop again
+    ramp_um = max_velocity_um_s**2 / acceleration_um_s2
+    return np.where(
+        dist_um < ramp_um,
+        2 * np.sqrt(dist_um / acceleration_um_s2),
+        dist_um / max_velocity_um_s + max_velocity_um_s / acceleration_um_s2,
+    )
+
+
+def short_step_motion_params(step_um, max_velocity_um_s, acceleration_um_s2):
+    """
+    Velocity profile for repeated short steps. A step much shorter than the
+    ramp of a long-travel profile never reaches max velocity, so its
+    duration is set by the acceleration alone. The velocity is capped at the
+    peak of the triangular profile of one step, which keeps the same move
+    time while limiting overshoot.
+
+    :param step_um: step size in micron
+    :param max_velocity_um_s: max velocity allowed in micron/s
+    :param acceleration_um_s2: acceleration to use in micron/s^2
+    :return (max_velocity_um_s, acceleration_um_s2):
+    """
+    peak_velocity_um_s = np.sqrt(abs(step_um) * acceleration_um_s2)
+    return min(max_velocity_um_s, peak_velocity_um_s), acceleration_um_s2
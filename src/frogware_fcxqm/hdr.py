@@ -0,0 +1,73 @@
+"""High dynamic range spectra merged from several integration times"""
+
+import numpy as np
+
+from .hardware_comms.device_interfaces import Spectrometer
+from .saturation import saturation_fraction
+from .dtypes import processing_dtype
+
+
+def read_exposure_ladder(spectrometer: Spectrometer, integration_times_micros):
+    """
+    Reads one spectrum per integration time, and restores the integration
+    time the spectrometer was set to.
+
+    :param spectrometer: Spectrometer
+    :param integration_times_micros: integration times in microseconds
+    :return frames: 2D array with one spectrum per integration time
+    """
+    original_us = spectrometer.integration_time_micros
+    frames = np.empty((len(integration_times_micros), len(spectrometer.wavelengths())),
+                      dtype=processing_dtype)
+    try:
+        # copied right away, the spectrometer may reuse its buffer
+        for i, time_us in enumerate(integration_times_micros):
+            spectrometer.integration_time_micros = time_us
+            frames[i] = spectrometer.intensities()
+    finally:
+        spectrometer.integration_time_micros = original_us
+    return frames
+
+
+def merge_exposures(frames, integration_times_micros, max_counts, reference_time_micros=None, offset=0.0,
+                    darks=None):
+    """
+    Merges spectra taken at different integration times into one spectrum
+    on the scale of reference_time_micros. Each pixel is the average of the
+    frames in which it is not saturated, rescaled by the ratio of
+    integration times and weighted by the integration time (longer
+    exposures have the better signal to noise). Pixels that are saturated
+    in every frame are taken from the shortest exposure.
+
+    :param frames: 2D array with one spectrum per integration time
+    :param integration_times_micros: integration time of each frame
+    :param max_counts: detector full scale in counts
+    :param reference_time_micros: integration time the result is scaled
+        to, defaults to the shortest one
+    :param offset: baseline that does not scale with the integration time
+        (scalar or per pixel), it is removed before rescaling and added back
+    :param darks: optional dark spectrum of every frame (one row per frame),
+        removed before rescaling instead of offset. offset is still added
+        back, the merged spectrum keeps the dark of the reference time.
+    :return (merged, saturated): the merged spectrum, and a boolean mask of
+        the pixels that are saturated even in the shortest exposure
+    """
+    frames = np.asarray(frames, dtype=processing_dtype)
+    times = np.asarray(integration_times_micros, dtype=processing_dtype)[:, np.newaxis]
+    if reference_time_micros is None:
+        reference_time_micros = np.min(times)
+
+    valid = frames < saturation_fraction * max_counts
+    if darks is None:
+        darks = offset
+    scaled = (frames - darks) * (reference_time_micros / times)
+
+    weights = valid * times
+    total_weight = np.sum(weights, axis=0)
+    merged = np.sum(weights * scaled, axis=0) / np.where(total_weight > 0, total_weight, 1.0)
+
+    saturated = total_weight == 0
+    shortest = scaled[np.argmin(times[:, 0])]
+    merged = np.where(saturated, shortest, merged) + offset
+
+    return merged, saturated
@@ -0,0 +1,245 @@
+"""Repeated passes over the same delay grid, aligned for drift and averaged"""
+
+import time
+
+import numpy as np
+
+from .scan_planner import ScanPlan
+from .scan_core import Scan, ScanResult
+from .spectrogram_store import SpectrogramStore
+from .resampling import resample_to_uniform
+from .dtypes import processing_dtype, precise_dtype
+
+
+def estimate_delay_shift(marginal, reference, step_fs, max_shift_fs=None):
+    """
+    Delay shift of a delay marginal with respect to a reference on the same
+    uniform grid, from the peak of their cross correlation. The peak is
+    refined to a fraction of a step with a parabola through its neighbours.
+
+    :param marginal: delay marginal (spectrogram integrated over wavelength)
+    :param reference: reference marginal at the same delays
+    :param step_fs: step of the delay grid in femtoseconds
+    :param max_shift_fs: largest shift considered, any if None
+    :return shift_fs: shift such that marginal(T) ~ reference(T - shift_fs)
+    """
+    # without the baseline, the overlap of the pedestals does not pull the
+    # peak towards zero shift
+    marginal = np.asarray(marginal, dtype=precise_dtype)
+    reference = np.asarray(reference, dtype=precise_dtype)
+    marginal = marginal - np.median(marginal)
+    reference = reference - np.median(reference)
+
+    n = len(marginal)
+    correlation = np.correlate(marginal, reference, mode="full")
+    lags = np.arange(-(n - 1), n)
+    if max_shift_fs is not None:
+        max_lag = int(np.floor(max_shift_fs / step_fs))
+        inside = np.abs(lags) <= max_lag
+        correlation, lags = correlation[inside], lags[inside]
+
+    i = int(np.argmax(correlation))
+    lag = float(lags[i])
+    if 0 < i < len(correlation) - 1:
+        left, center, right = correlation[i - 1:i + 2]
+        curvature = left - 2 * center + right
+        if curvature < 0:
+            lag += 0.5 * (left - right) / curvature
+    return lag * step_fs
+
+
+class MultiPassResult(ScanResult):
+    """
+    ScanResult of a MultiPassScan. store holds the combined spectrogram on
+    the delay grid of the plan, passes the ScanResult of every pass as
+    measured.
+
+    drift: per pass, the time since the start of the scan in seconds (the
+        middle of the pass) and the delay shift that was corrected in
+        femtoseconds. Also saved as the "drift" array.
+    """
+
+    def __init__(self, plan: ScanPlan, wavelengths, store: SpectrogramStore):
+        super().__init__(plan, wavelengths, store)
+        self.passes = []
+        self.drift = np.empty((0, 2))
+
+    def save(self, filename):
+        """
+        Saves the combined spectrogram as ScanResult.save() does, and the
+        rows of each pass as measured (_pass<k>_raw.npz)
+        """
+        super().save(filename)
+        for k, result in enumerate(self.passes):
+            result.store.save(filename[:-4] + f"_pass{k + 1}_raw.npz", self.wavelengths)
+
+
+class MultiPassScan:
+    """
+    Measures the spectrogram of a uniform ScanPlan in n_passes faster
+    passes instead of one slow one. The passes alternate in direction
+    (starting from the end the stage is closer to), so that no time is lost
+    moving back to the start. Drift of the delay between the passes
+    (pointing, timing) is measured by cross correlating the delay marginal
+    of each pass with the mean of the passes before, and the passes are
+    shifted by it before they are averaged. The drift over
+    time is reported with the result.
+
+    Used the same way as a Scan, the points of every pass are passed on as
+    they are measured. The passes are not checkpointed.
+    """
+
+    def __init__(self, motor, spectrometer, plan: ScanPlan, n_passes, max_shift_fs=None,
+                 **scan_kwargs):
+        """
+        :param motor: LinearMotor with T0 and travel limits set
+        :param spectrometer: Spectrometer set to the integration time of a pass
+        :param plan: ScanPlan of one pass, plans that add targets as they go
+            are not supported
+        :param n_passes: number of passes
+        :param max_shift_fs: largest drift corrected between two passes, any
+            if None
+        :param scan_kwargs: passed on to the Scan of every pass
+        """
+        if type(plan).extend is not ScanPlan.extend:
+            raise ValueError(f"{type(plan).__name__} chooses its points as it goes, "
+                             "multiple passes need a fixed delay grid")
+        if n_passes < 1:
+            raise ValueError("at least one pass is needed")
+        scan_kwargs.pop("checkpoint", None)
+
+        self.motor = motor
+        self.spectrometer = spectrometer
+        self.plan = plan
+        self.n_passes = n_passes
+        self.max_shift_fs = max_shift_fs
+        self.scan_kwargs = scan_kwargs
+
+        self.wavelengths = spectrometer.wavelengths()
+        self.grid_fs = np.sort(plan.targets_fs)
+        self.step_fs = abs(self.grid_fs[1] - self.grid_fs[0]) if len(self.grid_fs) > 1 else 1.0
+
+        # running sums of the aligned passes on the grid, and the number of
+        # passes that cover each delay
+        self._sum = np.zeros((len(self.grid_fs), len(self.wavelengths)), dtype=precise_dtype)
+        self._count = np.zeros(len(self.grid_fs), dtype=int)
+        self._ambient = None
+        self._shifts_fs = []
+        self._times_s = []
+
+        self.result = MultiPassResult(plan, self.wavelengths, self._combined_store())
+        self.scan = None
+        self._stop = False
+
+    def stop(self):
+        """
+        Ends the scan before the next move, can be called from another thread
+        """
+        self._stop = True
+        if self.scan is not None:
+            self.scan.stop()
+
+    def run(self, callback=None, position_callback=None):
+        """
+        :param callback: optional function called with every ScanPoint
+        :param position_callback: optional function called with every stage
+            position reading while moving
+        :return result: MultiPassResult
+        """
+        for point in self.points(position_callback):
+            if callback is not None:
+                callback(point)
+        return self.result
+
+    def __iter__(self):
+        return self.points()
+
+    def points(self, position_callback=None):
+        """
+        Generator of the ScanPoints of all passes, measured as they are
+        requested
+        """
+        t_start = time.monotonic()
+        first_plan = self.plan.starting_near(self.motor.pos_um())
+        try:
+            for k in range(self.n_passes):
+                if self._stop:
+                    break
+                print("pass", k + 1, "of", self.n_passes)
+
+                # every other pass goes backwards, from where the last one ended
+                plan = first_plan if k % 2 == 0 else first_plan.reversed()
+                self.scan = Scan(self.motor, self.spectrometer, plan, **self.scan_kwargs)
+                t_pass_start = time.monotonic() - t_start
+                try:
+                    yield from self.scan.points(position_callback)
+                finally:
+                    result = self.scan.result
+                    self.scan = None
+                    self.result.passes.append(result)
+                    self.result.error = result.error
+
+                # an incomplete pass would bias the drift estimate
+                if result.error is not None or result.n_points < plan.n_points:
+                    break
+                self._add_pass(result, (t_pass_start + time.monotonic() - t_start) / 2)
+        finally:
+            self._report()
+
+    def _add_pass(self, result, time_s):
+        store = result.store
+        if self._ambient is None:
+            self._ambient = store.ambient
+
+        # marginal of the pass on the grid, compared with the mean so far,
+        # both ambient subtracted as the rows of a SpectrogramStore are
+        rows = resample_to_uniform(store.T_fs, store.subtracted(), self.grid_fs)
+        shift_fs = 0.0
+        if np.any(self._count > 0):
+            covered = self._count > 0
+            mean = self._sum[covered] / self._count[covered, np.newaxis] - self._ambient
+            reference = np.zeros(len(self.grid_fs))
+            reference[covered] = np.sum(np.maximum(mean, 0.0), axis=1)
+            shift_fs = estimate_delay_shift(np.sum(rows, axis=1, dtype=precise_dtype),
+                                            reference, self.step_fs, self.max_shift_fs)
+            print("pass", len(self._shifts_fs) + 1, "drifted by", "%.2f" % shift_fs, "fs")
+
+        # the rows at their corrected delays, only where the pass covers the
+        # grid (not held at its edge spectrum)
+        T_fs = store.T_fs - shift_fs
+        covered = (self.grid_fs >= np.min(T_fs)) & (self.grid_fs <= np.max(T_fs))
+        self._sum[covered] += resample_to_uniform(T_fs, store.raw, self.grid_fs[covered])
+        self._count[covered] += 1
+
+        self._shifts_fs.append(shift_fs)
+        self._times_s.append(time_s)
+        self.result.store = self._combined_store()
+
+    def _combined_store(self):
+        # the mean of the passes, not ambient subtracted, so that the
+        # result can be reprocessed like the one of a single scan
+        store = SpectrogramStore(len(self.wavelengths), dtype=processing_dtype,
+                                 ambient=self._ambient,
+                                 capacity=max(len(self.grid_fs), 1))
+        for T_fs, row_sum, count in zip(self.grid_fs, self._sum, self._count):
+            if count > 0:
+                store.append(T_fs, row_sum / count)
+        return store
+
+    def _report(self):
+        metadata = self.result.metadata
+        if len(self.result.passes) > 0:
+            metadata.update(self.result.passes[-1].metadata)
+        metadata["n_points"] = self.result.n_points
+        metadata["n_passes"] = len(self._shifts_fs)
+        if len(self._shifts_fs) == 0:
+            return
+
+        times_s = np.array(self._times_s)
+        shifts_fs = np.array(self._shifts_fs)
+        self.result.drift = np.column_stack((times_s, shifts_fs))
+        self.result.arrays["drift"] = self.result.drift
+        metadata["drift_rms_fs"] = float(np.std(shifts_fs))
+        if len(shifts_fs) > 1:
+            rate_fs_s = np.polyfit(times_s, shifts_fs, 1)[0]
+            metadata["drift_fs_per_min"] = float(60 * rate_fs_s)
@@ -0,0 +1,360 @@
+"""Spectrograms as a function of further stage positions (data cubes)"""
+
+import json
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import repeat
+from pathlib import Path
+
+import numpy as np
+
+from .scan_planner import ScanPlan
+from .scan_core import Scan, row_dtype
+from .resampling import resample_to_uniform
+from .dtypes import processing_dtype
+
+
+class ParameterAxis:
+    """
+    A stage that is stepped between spectrograms, e.g. a wedge insertion or
+    a compressor position.
+
+    motor: LinearMotor of the axis
+    positions_um: absolute stage positions in micron
+    name: used in the saved cube
+    """
+
+    def __init__(self, motor, positions_um, name):
+        self.motor = motor
+        self.positions_um = np.asarray(positions_um, dtype=float)
+        self.name = name
+
+        lower_um, upper_um = motor.travel_limits_um
+        if np.any((self.positions_um < lower_um) | (self.positions_um > upper_um)):
+            raise ValueError(f"positions of axis {name} exceed the software limits "
+                             f"({lower_um} um, {upper_um} um)")
+
+    def __len__(self):
+        return len(self.positions_um)
+
+
+def nested_indices(shape):
+    """
+    :return indices: every index of shape, the last axis varying fastest
+    """
+    return list(np.ndindex(*shape))
+
+
+def snake_indices(shape):
+    """
+    :return indices: every index of shape, in an order where consecutive
+        indices differ by one step of one axis (the inner axes reverse
+        direction instead of returning to their start)
+    """
+    if len(shape) == 0:
+        return [()]
+    inner = snake_indices(shape[1:])
+    indices = []
+    for i in range(shape[0]):
+        # the reverse of a snake path is a snake path too
+        for index in (inner if i % 2 == 0 else inner[::-1]):
+            indices.append((i,) + index)
+    return indices
+
+
+orders = {"nested": nested_indices, "snake": snake_indices}
+
+
+class CubeStore:
+    """
+    Spectrogram rows of an N-D scan on disk, memory mapped, so that cubes
+    larger than the memory can be written as they are measured and read
+    slice by slice. A slice is the spectrogram at one index of the
+    parameter axes, the files are:
+
+    rows.npy: (*shape, n_delays, n_pixels) rows as measured, not background
+        subtracted, each on the planned delay it was targeted at
+    T_fs.npy: (*shape, n_delays) delays the rows were measured at
+    positions_um.npy: (*shape, n_axes) stage readings of the parameter axes
+    filled.npy: (*shape) True for the complete slices
+    grid_fs.npy, wavelengths.npy, ambient.npy, and cube.json with the axes
+    """
+
+    def __init__(self, directory, mode="r"):
+        """
+        Opens an existing cube, see create() for a new one.
+
+        :param directory: directory of the cube
+        :param mode: "r" to read, "r+" to write
+        """
+        self.directory = Path(directory)
+        with open(self.directory / "cube.json", "r") as file:
+            self.info = json.load(file)
+
+        def load(name):
+            return np.lib.format.open_memmap(self.directory / name, mode=mode)
+
+        self.rows = load("rows.npy")
+        self.T_fs = load("T_fs.npy")
+        self.positions_um = load("positions_um.npy")
+        self.filled = load("filled.npy")
+        self.grid_fs = np.load(self.directory / "grid_fs.npy")
+        self.wavelengths = np.load(self.directory / "wavelengths.npy")
+        self.ambient = np.load(self.directory / "ambient.npy")
+
+    @classmethod
+    def create(cls, directory, axes, grid_fs, wavelengths, dtype, ambient=None):
+        """
+        :param directory: directory of the cube, created if needed
+        :param axes: list of ParameterAxis
+        :param grid_fs: planned delays of each spectrogram in femtoseconds
+        :param wavelengths: wavelength axis of the rows
+        :param dtype: dtype of the rows
+        :param ambient: background spectrum of the rows, zeros if None
+        :return cube: CubeStore opened for writing
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        shape = tuple(len(axis) for axis in axes)
+        n_delays, n_pixels = len(grid_fs), len(wavelengths)
+        if ambient is None:
+            ambient = np.zeros(n_pixels)
+
+        def create(name, dtype, shape, fill):
+            array = np.lib.format.open_memmap(directory / name, mode="w+", dtype=dtype,
+                                              shape=shape)
+            array[...] = fill
+            array.flush()
+
+        create("rows.npy", dtype, shape + (n_delays, n_pixels), 0)
+        create("T_fs.npy", np.float64, shape + (n_delays,), np.nan)
+        create("positions_um.npy", np.float64, shape + (len(axes),), np.nan)
+        create("filled.npy", bool, shape, False)
+        np.save(directory / "grid_fs.npy", np.asarray(grid_fs, dtype=float))
+        np.save(directory / "wavelengths.npy", np.asarray(wavelengths))
+        np.save(directory / "ambient.npy", np.asarray(ambient, dtype=processing_dtype))
+
+        info = {"axes": [{"name": axis.name, "positions_um": axis.positions_um.tolist()}
+                         for axis in axes]}
+        with open(directory / "cube.json", "w") as file:
+            json.dump(info, file, indent=2)
+        return cls(directory, mode="r+")
+
+    @property
+    def shape(self):
+        return self.filled.shape
+
+    @property
+    def axis_names(self):
+        return [axis["name"] for axis in self.info["axes"]]
+
+    @property
+    def axis_positions_um(self):
+        return [np.array(axis["positions_um"]) for axis in self.info["axes"]]
+
+    def flush(self):
+        for array in (self.rows, self.T_fs, self.positions_um, self.filled):
+            array.flush()
+
+    def spectrogram(self, index):
+        """
+        :param index: index tuple of the parameter axes
+        :return (T_fs, rows): the slice at index, background subtracted and
+            interpolated from the measured delays onto grid_fs
+        """
+        rows = np.subtract(self.rows[index], self.ambient, dtype=processing_dtype)
+        np.maximum(rows, 0.0, out=rows)
+        T_fs = self.T_fs[index]
+        measured = np.isfinite(T_fs)
+        if not np.any(measured):
+            return self.grid_fs, rows
+        return self.grid_fs, resample_to_uniform(T_fs[measured], rows[measured], self.grid_fs)
+
+    def map_slices(self, function, workers=None):
+        """
+        Applies function to every complete slice, in parallel processes that
+        each map the cube themselves (nothing but the results is copied
+        between processes).
+
+        :param function: module level function(T_fs, rows, wavelengths),
+            called with the slices as spectrogram() returns them
+        :param workers: number of processes, os.cpu_count() if None, 1 runs
+            in this process
+        :return results: dict of the results by index tuple
+        """
+        return self._for_slices(partial(_map_slice, function=function), workers)
+
+    def resampled(self, workers=None):
+        """
+        Background subtracts and resamples every complete slice onto grid_fs,
+        in parallel, into spectrogram.npy next to the cube.
+
+        :param workers: see map_slices()
+        :return cube: (*shape, n_delays, n_pixels) memory mapped array, zero
+            for incomplete slices
+        """
+        path = self.directory / "spectrogram.npy"
+        out = np.lib.format.open_memmap(path, mode="w+", dtype=processing_dtype,
+                                        shape=self.shape + self.rows.shape[-2:])
+        out[...] = 0
+        out.flush()
+        del out
+
+        # each slice is written by the process that computed it
+        self._for_slices(_resample_slice, workers)
+        return np.lib.format.open_memmap(path, mode="r")
+
+    def _for_slices(self, worker, workers):
+        # worker(directory, index) is run for every complete slice
+        indices = [index for index in np.ndindex(*self.shape) if self.filled[index]]
+        directory = str(self.directory)
+        if workers == 1:
+            return {index: worker(directory, index) for index in indices}
+
+        n_workers = workers or mp.cpu_count()
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=mp.get_context("spawn")) as pool:
+            results = pool.map(worker, repeat(directory), indices,
+                               chunksize=max(len(indices) // (4 * n_workers), 1))
+            return dict(zip(indices, results))
+
+
+def _map_slice(directory, index, function):
+    cube = CubeStore(directory)
+    T_fs, rows = cube.spectrogram(index)
+    return function(T_fs, rows, cube.wavelengths)
+
+
+def _resample_slice(directory, index):
+    T_fs, rows = CubeStore(directory).spectrogram(index)
+    out = np.lib.format.open_memmap(Path(directory) / "spectrogram.npy", mode="r+")
+    out[index] = rows
+    out.flush()
+
+
+class NDScan:
+    """
+    Spectrograms over a grid of parameter stage positions. At every index
+    of the parameter axes, the axes that change are moved and settled and
+    a Scan of the delay plan is run; its rows are streamed into a CubeStore
+    as they are measured. The delay scans alternate direction, and with
+    order "snake" so do the parameter axes, so no stage returns to its
+    start between slices.
+
+    Complete slices are marked in the cube. Running an NDScan on the
+    directory of an interrupted cube continues with the missing slices.
+    """
+
+    def __init__(self, motor, spectrometer, plan: ScanPlan, axes, directory, order="snake",
+                 **scan_kwargs):
+        """
+        :param motor: LinearMotor of the delay, with T0 and travel limits set
+        :param spectrometer: Spectrometer set to the integration time of the scan
+        :param plan: ScanPlan of the delay scan at every index, with a fixed
+            grid of targets
+        :param axes: list of ParameterAxis, outermost first
+        :param directory: directory of the CubeStore
+        :param order: "nested" or "snake", see orders
+        :param scan_kwargs: passed on to every Scan
+        """
+        if type(plan).extend is not ScanPlan.extend:
+            raise ValueError(f"{type(plan).__name__} chooses its points as it goes, "
+                             "a cube needs a fixed delay grid")
+        if order not in orders:
+            raise ValueError(f"unknown order {order}, use one of {', '.join(orders)}")
+        scan_kwargs.pop("checkpoint", None)
+
+        self.motor = motor
+        self.spectrometer = spectrometer
+        self.plan = plan
+        self.axes = axes
+        self.order = order
+        self.scan_kwargs = scan_kwargs
+        self.grid_fs = np.sort(plan.targets_fs)
+
+        directory = Path(directory)
+        if (directory / "cube.json").exists():
+            self.cube = CubeStore(directory, mode="r+")
+            if self.cube.shape != tuple(len(axis) for axis in axes) or \
+                    len(self.cube.grid_fs) != len(self.grid_fs):
+                raise ValueError(f"the cube in {directory} was measured with other axes")
+        else:
+            dtype = row_dtype(spectrometer, scan_kwargs.get("hdr_exposure_ladder"),
+                              scan_kwargs.get("adaptive_exposure_max_factor"))
+            self.cube = CubeStore.create(directory, axes, self.grid_fs,
+                                         spectrometer.wavelengths(), dtype,
+                                         ambient=scan_kwargs.get("ambient"))
+
+        # side each axis was last moved onto its target from, 0 until this
+        # scan moves it
+        self._directions = [0.0] * len(axes)
+        self.scan = None
+        self._stop = False
+
+    @property
+    def indices(self):
+        return orders[self.order](self.cube.shape)
+
+    def stop(self):
+        """
+        Ends the scan before the next move, can be called from another thread
+        """
+        self._stop = True
+        if self.scan is not None:
+            self.scan.stop()
+
+    def run(self, callback=None, position_callback=None):
+        """
+        :param callback: optional function called with the index tuple and
+            every ScanPoint
+        :param position_callback: optional function called with every stage
+            position reading of the delay stage while moving
+        :return cube: the CubeStore
+        """
+        remaining = [index for index in self.indices if not self.cube.filled[index]]
+        print(len(remaining), "of", self.cube.filled.size, "spectrograms to measure")
+        for index in remaining:
+            if self._stop:
+                break
+            self._move_axes(index)
+            if not self._scan_slice(index, callback, position_callback):
+                break
+        return self.cube
+
+    def _move_axes(self, index):
+        for i, (axis, j) in enumerate(zip(self.axes, index)):
+            target_um = axis.positions_um[j]
+            pos_um = axis.motor.pos_um()
+            # an axis that stays put keeps the backlash of its last move, one
+            # that was never moved has no known direction and no offset
+            if abs(pos_um - target_um) > axis.motor.settle_tol_um:
+                self._directions[i] = np.sign(target_um - pos_um)
+                axis.motor.move_to_um(target_um)
+            pos_um = axis.motor.wait_until_settled(target_um)
+            offset_um = 0.0
+            if self._directions[i] != 0:
+                offset_um = axis.motor.direction_offset_um(self._directions[i])
+            self.cube.positions_um[index + (i,)] = pos_um + offset_um
+
+    def _scan_slice(self, index, callback, position_callback):
+        # returns False if the slice was not completed
+        plan = self.plan.starting_near(self.motor.pos_um())
+        # position of each target on the sorted grid
+        rank = np.searchsorted(self.grid_fs, plan.targets_fs)
+
+        self.scan = Scan(self.motor, self.spectrometer, plan, **self.scan_kwargs)
+        try:
+            for point in self.scan.points(position_callback):
+                k = rank[point.n]
+                self.cube.rows[index + (k,)] = point.intensities
+                self.cube.T_fs[index + (k,)] = point.T_fs
+                if callback is not None:
+                    callback(index, point)
+            result = self.scan.result
+        finally:
+            self.scan = None
+
+        complete = result.error is None and result.n_points == plan.n_points
+        self.cube.filled[index] = complete
+        self.cube.flush()
+        return complete
@@ -50,6 +50,12 @@ def create_curve(color="b", width=2, x=None, y=None):
     return curve
 
 
+def create_scatter(color="r", size=6):
+    scatter = pg.PlotDataItem(pen=None, symbol="o", symbolSize=size,
+                              symbolPen=None, symbolBrush=color)
+    return scatter
+
+
 class PlotWindow:
     def __init__(self, le_wl_ll, le_wl_ul, le_ll, le_ul, plotwidget):
         le_wl_ll: qt.QLineEdit
@@ -0,0 +1,44 @@
+"""Resampling of spectrogram rows measured at arbitrary delays"""
+
+import numpy as np
+
+from .dtypes import processing_dtype
+
+
+def resample_to_uniform(T_fs, rows, T_uniform_fs):
+    """
+    Linearly interpolates the rows of a spectrogram sampled at arbitrary
+    delays onto a uniform delay grid, for all wavelengths at once.
+
+    :param T_fs: delays of the rows in femtoseconds, in any order, rows at
+        the same delay are allowed
+    :param rows: 2D array with one spectrum per delay
+    :param T_uniform_fs: delay grid to interpolate onto, rows outside the
+        sampled range are held at the first/last sampled spectrum
+    :return resampled: 2D array with one spectrum per T_uniform_fs
+    """
+    T_fs = np.asarray(T_fs, dtype=float)
+    rows = np.asarray(rows)
+    T_uniform_fs = np.asarray(T_uniform_fs, dtype=float)
+    if np.any(np.diff(T_fs) < 0):
+        order = np.argsort(T_fs, kind="stable")
+        T_fs, rows = T_fs[order], rows[order]
+    if len(T_fs) == 1:
+        return np.repeat(rows, len(T_uniform_fs), axis=0)
+
+    idx = np.clip(np.searchsorted(T_fs, T_uniform_fs), 1, len(T_fs) - 1)
+    T_lo, T_hi = T_fs[idx - 1], T_fs[idx]
+    width = T_hi - T_lo
+    weight = np.divide(T_uniform_fs - T_lo, width, out=np.zeros(len(idx)), where=width > 0)
+    np.clip(weight, 0.0, 1.0, out=weight)
+
+    # interpolate in the precision of the rows (at least processing_dtype),
+    # the delays themselves need double precision. lo + w (hi - lo) in
+    # place, with one temporary the size of the output.
+    dtype = np.result_type(rows.dtype, processing_dtype)
+    resampled = rows[idx - 1].astype(dtype)
+    step = rows[idx].astype(dtype)
+    step -= resampled
+    step *= weight.astype(dtype)[:, np.newaxis]
+    resampled += step
+    return resampled
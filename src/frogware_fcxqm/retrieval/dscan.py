@@ -0,0 +1,178 @@
+"""Retrieval of the spectral phase from a dispersion scan (d-scan)"""
+
+import numpy as np
+import scipy.fft as fft
+
+from .grids import FrequencyGrid
+from .sellmeier import dispersion_phase
+from .fields import PulseField
+
+
+class DScanRetrievalResult:
+    """
+    Outcome of DScanRetrieval.run(). Arrays are in FFT order, see
+    FrequencyGrid.
+
+    grid: FrequencyGrid of the field
+    field: complex spectral field, the measured amplitude with the
+        retrieved phase
+    insertion_mm: glass insertions of the trace
+    trace: the measured trace on the grid (second harmonic), one row per
+        insertion
+    model: the trace of the retrieved field, scaled by mu
+    mu: per frequency scale of the model onto the measurement (spectral
+        response of the setup)
+    errors: trace error of every iteration
+    """
+
+    def __init__(self, grid, field, insertion_mm, trace, model, mu, errors, material):
+        self.grid = grid
+        self.field = field
+        self.insertion_mm = insertion_mm
+        self.trace = trace
+        self.model = model
+        self.mu = mu
+        self.errors = errors
+        self.material = material
+
+    @property
+    def error(self):
+        return self.errors[-1] if len(self.errors) > 0 else np.nan
+
+    @property
+    def phase(self):
+        """spectral phase in rad, unwrapped from the carrier"""
+        phase = np.fft.fftshift(np.angle(self.field))
+        center = self.grid.n // 2
+        phase = np.unwrap(phase)
+        return np.fft.ifftshift(phase - phase[center])
+
+    def field_t(self, insertion_mm=0.0):
+        """
+        :param insertion_mm: glass insertion, relative to the zero of the scan
+        :return field_t: complex temporal field after insertion_mm of glass
+        """
+        phase = dispersion_phase(self.material, self.grid.omega0, self.grid.d_omega, self.grid.n)
+        return fft.ifft(self.field * np.exp(1j * insertion_mm * phase))
+
+    def pulse(self, insertion_mm=0.0):
+        """
+        :return pulse: PulseField after insertion_mm of glass, e.g. to be
+            saved as the gate of an XFROG measurement
+        """
+        return PulseField(np.fft.fftshift(self.grid.t_fs),
+                          np.fft.fftshift(self.field_t(insertion_mm)),
+                          self.grid.wavelengths_nm()[0])
+
+    def best_insertion_mm(self):
+        """
+        :return insertion_mm: insertion with the highest peak intensity, the
+            shortest pulse
+        """
+        peaks = [np.max(np.abs(self.field_t(z))**2) for z in self.insertion_mm]
+        return self.insertion_mm[int(np.argmax(peaks))]
+
+
+class DScanRetrieval:
+    """
+    Iterative d-scan retrieval (after Miranda et al., Opt. Express 25, 4,
+    2017). The field at every insertion is computed at once (one batched FFT
+    per step over all insertions), its second harmonic amplitude is replaced
+    by the measured one, and the corrected fields are propagated back
+    through the glass and averaged. The spectral amplitude is the measured
+    fundamental spectrum throughout, only the phase is retrieved.
+
+    The glass dispersion comes from the cached Sellmeier model (see
+    sellmeier.dispersion_phase()), so repeated retrievals on the same grid
+    do not recompute it.
+    """
+
+    def __init__(self, insertion_mm, wavelengths_nm, trace, fundamental_wavelengths_nm,
+                 fundamental_spectrum, material="BK7", grid=None, n=512):
+        """
+        :param insertion_mm: glass insertion of every row of the trace in mm
+        :param wavelengths_nm: wavelength axis of the trace in nm
+        :param trace: 2D array with one second harmonic spectrum per insertion,
+            background subtracted
+        :param fundamental_wavelengths_nm: wavelength axis of the fundamental
+            spectrum in nm
+        :param fundamental_spectrum: spectrum of the pulse
+        :param material: key of sellmeier.materials, the glass of the wedges
+        :param grid: FrequencyGrid, centered on the fundamental spectrum with
+            n points if None
+        """
+        if grid is None:
+            grid = FrequencyGrid.from_spectrum(fundamental_wavelengths_nm, fundamental_spectrum, n=n)
+        self.grid = grid
+        self.material = material
+        self.insertion_mm = np.asarray(insertion_mm, dtype=float)
+
+        self.amplitude = np.sqrt(grid.interpolate(fundamental_wavelengths_nm, fundamental_spectrum))
+        self.trace = grid.interpolate(wavelengths_nm, trace, harmonic=2)
+        self.trace /= np.max(self.trace)
+
+        # transfer function of every insertion, fixed for the retrieval
+        phase = dispersion_phase(material, grid.omega0, grid.d_omega, grid.n)
+        self.propagator = np.exp(1j * np.outer(self.insertion_mm, phase))
+
+        self.field = self.amplitude.astype(complex)
+        self.mu = np.ones(grid.n)
+        self.errors = []
+
+    def run(self, iterations=300, step=0.5, initial_phase=None):
+        """
+        :param iterations: number of iterations
+        :param step: relaxation of the time domain update, between 0 and 1
+        :param initial_phase: spectral phase to start from (FFT order), flat
+            if None
+        :return result: DScanRetrievalResult with the field of the lowest
+            error
+        """
+        if initial_phase is not None:
+            self.field = self.amplitude * np.exp(1j * np.asarray(initial_phase))
+
+        trace = self.trace
+        trace_norm = np.sqrt(np.sum(trace**2))
+        best_error, best_field = np.inf, self.field
+        fields_w = np.empty(self.propagator.shape, dtype=complex)
+        for _ in range(iterations):
+            # all insertions at once
+            np.multiply(self.field, self.propagator, out=fields_w)
+            fields_t = fft.ifft(fields_w, axis=-1, overwrite_x=False, workers=-1)
+            shg_t = fields_t**2
+            shg_w = fft.fft(shg_t, axis=-1, workers=-1)
+            model = np.abs(shg_w)**2
+
+            # least squares scale of the model at every frequency
+            norm = np.sum(model**2, axis=0)
+            self.mu = np.divide(np.sum(trace * model, axis=0), norm,
+                                out=np.zeros(self.grid.n), where=norm > 0)
+            error = np.sqrt(np.sum((trace - self.mu * model)**2)) / trace_norm
+            self.errors.append(error)
+            if error < best_error:
+                best_error, best_field = error, self.field
+
+            # measured amplitude, model phase
+            target = np.divide(trace, self.mu, out=np.zeros_like(trace), where=self.mu > 0)
+            shg_w *= np.sqrt(target) / np.maximum(np.abs(shg_w), 1e-12 * np.max(np.abs(shg_w)))
+            shg_t_new = fft.ifft(shg_w, axis=-1, workers=-1)
+
+            # gradient step of |E^2 - S|^2 on the field of every insertion
+            scale = np.max(np.abs(fields_t)**2, axis=-1, keepdims=True)
+            fields_t += step * np.conj(fields_t) * (shg_t_new - shg_t) / scale
+
+            # back through the glass, averaged, with the measured amplitude
+            fields_w = fft.fft(fields_t, axis=-1, workers=-1)
+            fields_w *= np.conj(self.propagator)
+            self.field = self.amplitude * np.exp(1j * np.angle(np.mean(fields_w, axis=0)))
+
+        model = self.model(best_field)
+        return DScanRetrievalResult(self.grid, best_field, self.insertion_mm, self.trace, model,
+                                    self.mu, np.array(self.errors), self.material)
+
+    def model(self, field):
+        """
+        :return model: the d-scan trace of field, scaled by mu
+        """
+        shg_t = fft.ifft(field * self.propagator, axis=-1, workers=-1)**2
+        return self.mu * np.abs(fft.fft(shg_t, axis=-1, workers=-1))**2
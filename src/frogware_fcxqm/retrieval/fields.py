@@ -0,0 +1,65 @@
+"""Complex pulse fields, as retrieved and as used for a known gate"""
+
+import numpy as np
+
+from .grids import C_NM_FS
+
+
+class PulseField:
+    """
+    Complex envelope of a pulse in time.
+
+    t_fs: sorted time axis in fs
+    field: complex envelope at t_fs, relative to the carrier
+    carrier_wavelength_nm: vacuum wavelength of the carrier in nm
+    """
+
+    def __init__(self, t_fs, field, carrier_wavelength_nm):
+        order = np.argsort(t_fs)
+        self.t_fs = np.asarray(t_fs, dtype=float)[order]
+        self.field = np.asarray(field, dtype=complex)[order]
+        self.carrier_wavelength_nm = float(carrier_wavelength_nm)
+
+    @property
+    def omega0(self):
+        """carrier angular frequency in rad/fs"""
+        return 2 * np.pi * C_NM_FS / self.carrier_wavelength_nm
+
+    @property
+    def intensity(self):
+        return np.abs(self.field)**2
+
+    def fwhm_fs(self):
+        """
+        :return fwhm_fs: full width at half maximum of the intensity
+        """
+        intensity = self.intensity
+        above = self.t_fs[intensity >= np.max(intensity) / 2]
+        return above[-1] - above[0]
+
+    def on(self, t_fs):
+        """
+        :param t_fs: time axis in fs, in any order
+        :return field: the envelope interpolated onto t_fs (real and
+            imaginary part), zero outside of the stored range
+        """
+        real = np.interp(t_fs, self.t_fs, self.field.real, left=0.0, right=0.0)
+        imag = np.interp(t_fs, self.t_fs, self.field.imag, left=0.0, right=0.0)
+        return real + 1j * imag
+
+    def save(self, filename):
+        """
+        Saves the field as columns of time (fs), real and imaginary part,
+        with the carrier wavelength in the header
+        """
+        np.savetxt(filename, np.column_stack((self.t_fs, self.field.real, self.field.imag)),
+                   fmt="%.10g", header=f"carrier_wavelength_nm: {self.carrier_wavelength_nm}")
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "r") as file:
+            header = file.readline()
+        if not header.startswith("# carrier_wavelength_nm:"):
+            raise ValueError(f"{filename} is not a saved pulse field")
+        t_fs, real, imag = np.loadtxt(filename).T
+        return cls(t_fs, real + 1j * imag, float(header.split(":")[1]))
@@ -0,0 +1,134 @@
+"""Frequency and time grids of the pulse retrievals"""
+
+import numpy as np
+
+from ..resampling import resample_to_uniform
+
+# speed of light in nm/fs
+C_NM_FS = 299.792458
+
+
+class FrequencyGrid:
+    """
+    Equally spaced angular frequencies around a carrier, and the time axis
+    of their FFT. Fields are kept in FFT order (zero frequency/time first)
+    during the retrievals, use np.fft.fftshift for display.
+
+    n: number of points
+    omega0: carrier angular frequency in rad/fs
+    d_omega: spacing in rad/fs
+    """
+
+    def __init__(self, n, omega0, d_omega):
+        self.n = int(n)
+        self.omega0 = float(omega0)
+        self.d_omega = float(d_omega)
+
+    @classmethod
+    def from_spectrum(cls, wavelengths_nm, spectrum, n=512, span_factor=4.0, threshold=1e-3):
+        """
+        Grid centered on a spectrum, spanning span_factor times its width
+        (where it is above threshold times the peak), so that the second
+        harmonic of the envelope fits on the grid as well.
+
+        :param wavelengths_nm: wavelengths of the spectrum in nm
+        :param spectrum: spectral intensity
+        :param n: number of points, a power of 2 is fastest
+        """
+        omega = 2 * np.pi * C_NM_FS / np.asarray(wavelengths_nm, dtype=float)
+        spectrum = np.clip(np.asarray(spectrum, dtype=float), 0, None)
+        significant = omega[spectrum >= threshold * np.max(spectrum)]
+
+        # carrier at the center of mass, so the group delay stays small
+        omega0 = np.sum(omega * spectrum) / np.sum(spectrum)
+        width = 2 * max(np.max(significant) - omega0, omega0 - np.min(significant))
+        return cls(n, omega0, span_factor * width / n)
+
+    @property
+    def omega(self):
+        """angular frequency relative to omega0 in rad/fs, FFT order"""
+        return self.d_omega * np.fft.fftfreq(self.n, 1 / self.n)
+
+    @property
+    def dt_fs(self):
+        return 2 * np.pi / (self.n * self.d_omega)
+
+    @property
+    def t_fs(self):
+        """time in fs, FFT order"""
+        return self.dt_fs * np.fft.fftfreq(self.n, 1 / self.n)
+
+    def wavelengths_nm(self, harmonic=1):
+        """
+        :return wavelengths_nm: vacuum wavelengths of the grid points around
+            harmonic times the carrier, FFT order (nan for omega <= 0)
+        """
+        omega = harmonic * self.omega0 + self.omega
+        with np.errstate(divide="ignore"):
+            return np.where(omega > 0, 2 * np.pi * C_NM_FS / omega, np.nan)
+
+    def interpolate(self, wavelengths_nm, rows, harmonic=1):
+        """
+        Spectra over wavelength onto the grid around harmonic times the
+        carrier, as spectral densities over frequency (with the Jacobian
+        lambda^2), zero outside the measured range.
+
+        :param wavelengths_nm: wavelength axis of the rows in nm
+        :param rows: 1D spectrum or 2D array with one spectrum per row
+        :return rows: the spectra on the grid, FFT order
+        """
+        rows = np.asarray(rows, dtype=float)
+        single = rows.ndim == 1
+        rows = np.atleast_2d(rows)
+        wavelengths_nm = np.asarray(wavelengths_nm, dtype=float)
+
+        omega = 2 * np.pi * C_NM_FS / wavelengths_nm
+        density = rows * wavelengths_nm**2
+        grid_omega = harmonic * self.omega0 + self.omega
+        # the same interpolation for every row, along the frequency axis
+        out = resample_to_uniform(omega, density.T, grid_omega).T
+        out[:, (grid_omega < np.min(omega)) | (grid_omega > np.max(omega))] = 0.0
+        np.maximum(out, 0.0, out=out)
+        return out[0] if single else out
+
+    def bin(self, wavelengths_nm, rows, harmonic=1):
+        """
+        Spectra over wavelength onto the grid around harmonic times the
+        carrier, as spectral densities over frequency, by averaging the
+        pixels that fall into each grid cell. Unlike interpolate(), the noise
+        of a spectrometer with many more pixels than the grid is averaged
+        down instead of sampled. Cells between pixels (a grid finer than the
+        spectrometer) are interpolated.
+
+        :param wavelengths_nm: wavelength axis of the rows in nm
+        :param rows: 2D array with one spectrum per row
+        :return rows, measured: the spectra on the grid (FFT order), and
+            which grid points the spectrometer covers
+        """
+        rows = np.atleast_2d(np.asarray(rows, dtype=float))
+        wavelengths_nm = np.asarray(wavelengths_nm, dtype=float)
+        omega = 2 * np.pi * C_NM_FS / wavelengths_nm
+        order = np.argsort(omega)
+
+        # cell of every pixel, counted from the lowest frequency of the grid
+        cell = np.round((omega[order] - harmonic * self.omega0) / self.d_omega).astype(int)
+        cell += self.n // 2
+        inside = (cell >= 0) & (cell < self.n)
+        cell = cell[inside]
+        density = (rows * wavelengths_nm**2)[:, order[inside]]
+
+        out = np.zeros((len(rows), self.n))
+        measured = np.zeros(self.n, dtype=bool)
+        if len(cell) > 0:
+            starts = np.flatnonzero(np.r_[True, np.diff(cell) > 0])
+            counts = np.diff(np.r_[starts, len(cell)])
+            filled = cell[starts]
+            out[:, filled] = np.add.reduceat(density, starts, axis=1) / counts
+            measured[filled[0]:filled[-1] + 1] = True
+
+            gaps = np.flatnonzero(measured)
+            gaps = gaps[~np.isin(gaps, filled)]
+            if len(gaps) > 0:
+                out[:, gaps] = resample_to_uniform(filled, out[:, filled].T, gaps).T
+        np.maximum(out, 0.0, out=out)
+        return np.fft.ifftshift(out, axes=-1), np.fft.ifftshift(measured)
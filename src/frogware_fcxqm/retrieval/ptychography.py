@@ -0,0 +1,241 @@
+"""Ptychographic retrieval of a pulse from its SHG FROG spectrogram"""
+
+import numpy as np
+import scipy.fft as fft
+
+from .grids import FrequencyGrid
+from .fields import PulseField
+from ..spectrogram_store import SpectrogramStore
+
+
+def load_spectrogram(filename):
+    """
+    Loads a saved spectrogram: either the .txt of ScanResult.save(), on the
+    delay grid of the plan, or the _raw.npz next to it, with the rows at
+    the delays they were measured at.
+
+    :return T_fs, wavelengths_nm, rows: delays, wavelength axis and the
+        background subtracted rows
+    """
+    if filename.lower().endswith(".npz"):
+        store = SpectrogramStore.load(filename)
+        with np.load(filename) as data:
+            if "wavelengths" not in data:
+                raise ValueError(f"{filename} was saved without its wavelength axis")
+            wavelengths_nm = data["wavelengths"]
+        return store.T_fs, wavelengths_nm, store.subtracted()
+
+    data = np.loadtxt(filename)
+    return data[1:, 0], data[0, 1:], data[1:, 1:]
+
+
+class PtychographicResult:
+    """
+    Outcome of PtychographicRetrieval.run(). Arrays are in FFT order, see
+    FrequencyGrid.
+
+    grid: FrequencyGrid of the pulse (the trace is around twice its
+        carrier)
+    field: complex envelope of the pulse on grid.t_fs
+    T_fs: delays of the trace, as measured
+    trace: the measured trace on the grid, one row per delay
+    measured: grid points covered by the spectrometer
+    model: the trace of the retrieved field, scaled onto the measurement
+    errors: trace error after every pass over the delays
+    """
+
+    def __init__(self, grid, field, T_fs, trace, measured, model, errors):
+        self.grid = grid
+        self.field = field
+        self.T_fs = T_fs
+        self.trace = trace
+        self.measured = measured
+        self.model = model
+        self.errors = errors
+
+    @property
+    def error(self):
+        return np.min(self.errors) if len(self.errors) > 0 else np.nan
+
+    def pulse(self):
+        """
+        :return pulse: PulseField of the retrieved pulse
+        """
+        return PulseField(np.fft.fftshift(self.grid.t_fs), np.fft.fftshift(self.field),
+                          self.grid.wavelengths_nm()[0])
+
+
+class PtychographicRetrieval:
+    """
+    Ptychographic (ePIE) retrieval of an SHG FROG trace (after Sidorenko et
+    al., Optica 3, 1320, 2016). The signal at delay T is the pulse gated by
+    its own delayed copy, psi(t, T) = E(t) E(t - T). Delays are visited in a
+    random order; at each, the measured amplitude is imposed on the signal,
+    and the difference to the old signal updates both the pulse as object
+    and its delayed copy as probe.
+
+    The rows are used at their delays as measured, uniform or not, since
+    the probe is shifted by a Fourier phase. Only the wavelength axis is
+    put onto the frequency grid (see FrequencyGrid.bin()), there is no
+    square delay/frequency grid as for PCGPA. Grid points outside the
+    spectrometer range are not constrained.
+
+    Delays are updated in batches of batch_size, with one batched FFT per
+    step for the whole batch; batch_size=1 is the sequential ePIE.
+    """
+
+    def __init__(self, T_fs, wavelengths_nm, spectrogram, grid=None, n=256, seed=None):
+        """
+        :param T_fs: delay of every row of the spectrogram in fs
+        :param wavelengths_nm: wavelength axis of the spectrogram in nm
+        :param spectrogram: 2D array with one second harmonic spectrum per
+            delay, background subtracted
+        :param grid: FrequencyGrid of the pulse, half the frequency of the
+            trace, derived from the trace with n points if None (more if
+            the time window would not hold the delays)
+        :param seed: seed of the random delay order and initial phase
+        """
+        T_fs = np.asarray(T_fs, dtype=float)
+        spectrogram = np.asarray(spectrogram, dtype=float)
+        if grid is None:
+            # above the noise floor of the marginal, which spans the whole
+            # spectrometer
+            shg = FrequencyGrid.from_spectrum(wavelengths_nm, np.sum(spectrogram, axis=0), n=n,
+                                              span_factor=2.0, threshold=1e-2)
+            grid = FrequencyGrid(shg.n, shg.omega0 / 2, shg.d_omega)
+            # finer in frequency, over the same span, until the time window
+            # holds twice the delay range
+            factor = 2 * np.ptp(T_fs) / (grid.n * grid.dt_fs)
+            if factor > 1:
+                n = grid.n * 2**int(np.ceil(np.log2(factor)))
+                grid = FrequencyGrid(n, grid.omega0, grid.d_omega * grid.n / n)
+        self.grid = grid
+        self.T_fs = T_fs
+
+        window_fs = grid.n * grid.dt_fs
+        if np.ptp(T_fs) > window_fs / 2:
+            raise ValueError(f"the delays span {np.ptp(T_fs):.0f} fs, more than half of the "
+                             f"{window_fs:.0f} fs time window of the grid, use a larger n")
+
+        self.trace, self.measured = grid.bin(wavelengths_nm, spectrogram, harmonic=2)
+        self.trace /= np.max(self.trace)
+
+        # delay of every row as a spectral phase, shifts the probe to T
+        self.shifts = np.exp(-1j * np.outer(T_fs, grid.omega))
+
+        self.rng = np.random.default_rng(seed)
+        self.field = self.initial_field()
+        self.errors = []
+
+    def initial_field(self):
+        """
+        :return field: the square root of the delay marginal (the intensity
+            autocorrelation) narrowed by sqrt(2), as for a Gaussian pulse,
+            with a small random phase
+        """
+        order = np.argsort(self.T_fs)
+        marginal = np.sum(self.trace, axis=1)[order]
+        center = np.sum(self.T_fs * np.sum(self.trace, axis=1)) / np.sum(marginal)
+        intensity = np.interp(np.sqrt(2) * self.grid.t_fs + center, self.T_fs[order], marginal,
+                              left=0.0, right=0.0)
+        phase = 0.1 * self.rng.standard_normal(self.grid.n)
+        return np.sqrt(intensity) * np.exp(1j * phase)
+
+    def run(self, iterations=100, batch_size=8, step=0.5, callback=None):
+        """
+        :param iterations: number of passes over all delays
+        :param batch_size: delays updated at once
+        :param step: ePIE step size of the first pass, between 0 and 1. It
+            decreases to a tenth of that by the last pass: large steps find
+            the pulse quickly, small ones average the noise of the trace.
+        :param callback: optional function called with the error after every
+            pass
+        :return result: PtychographicResult with the field of the lowest
+            error
+        """
+        n_delays = len(self.T_fs)
+        target = np.sqrt(self.trace)
+        measured = self.measured
+
+        steps = step * np.geomspace(1.0, 0.1, iterations)
+        best_error, best_field = np.inf, self.field
+        for step in steps:
+            mu = self._scale()
+            for batch in np.array_split(self.rng.permutation(n_delays),
+                                        max(n_delays // batch_size, 1)):
+                field = self.field
+                field_w = fft.fft(field)
+                probes = fft.ifft(field_w * self.shifts[batch], axis=-1, workers=-1)
+                signal = field * probes
+                signal_w = fft.fft(signal, axis=-1, workers=-1)
+
+                # measured amplitude, model phase, where it was measured
+                amplitude = np.abs(signal_w)
+                np.maximum(amplitude, 1e-12 * np.max(amplitude), out=amplitude)
+                signal_w[:, measured] *= target[batch][:, measured] / (np.sqrt(mu)
+                                                                      * amplitude[:, measured])
+                difference = fft.ifft(signal_w, axis=-1, workers=-1)
+                difference -= signal
+
+                # the pulse as object, seen through every probe of the batch
+                object_norm = np.max(np.sum(np.abs(probes)**2, axis=0))
+                object_step = np.sum(np.conj(probes) * difference, axis=0) / object_norm
+
+                # and as probe, the corrections shifted back from T to 0
+                probe_norm = len(batch) * np.max(np.abs(field)**2)
+                probe_w = fft.fft(np.conj(field) * difference, axis=-1, workers=-1)
+                probe_w *= np.conj(self.shifts[batch])
+                probe_step = fft.ifft(np.sum(probe_w, axis=0)) / probe_norm
+
+                self.field = field + step * (object_step + probe_step)
+
+            error = self._error(self.field)
+            self.errors.append(error)
+            if error < best_error:
+                best_error, best_field = error, self.field
+            if callback is not None:
+                callback(error)
+
+        return PtychographicResult(self.grid, best_field, self.T_fs, self.trace, measured,
+                                   self.model(best_field), np.array(self.errors))
+
+    def _unscaled_model(self, field):
+        probes = fft.ifft(fft.fft(field) * self.shifts, axis=-1, workers=-1)
+        return np.abs(fft.fft(field * probes, axis=-1, workers=-1))**2
+
+    def _scale(self, model=None):
+        # least squares scale of the model onto the measured grid points
+        if model is None:
+            model = self._unscaled_model(self.field)
+        model = model[:, self.measured]
+        return np.sum(self.trace[:, self.measured] * model) / np.sum(model**2)
+
+    def _error(self, field):
+        model = self._unscaled_model(field)
+        trace = self.trace[:, self.measured]
+        difference = self._scale(model) * model[:, self.measured] - trace
+        return np.sqrt(np.sum(difference**2) / np.sum(trace**2))
+
+    def model(self, field):
+        """
+        :return model: the SHG FROG trace of field, scaled onto the
+            measurement
+        """
+        model = self._unscaled_model(field)
+        return self._scale(model) * model
+
+
+def retrieve_frog(T_fs, wavelengths_nm, spectrogram, iterations=100, n=256, callback=None):
+    """
+    Runs a PtychographicRetrieval, for the thread pool of the GUI (see
+    TaskRunnable)
+
+    :param callback: optional function called with the error after every
+        pass over the delays
+    :return result: PtychographicResult
+    """
+    retrieval = PtychographicRetrieval(T_fs, wavelengths_nm, spectrogram, n=n)
+    result = retrieval.run(iterations, callback=callback)
+    print("FROG retrieval:", "%.4f" % result.error, "trace error,",
+          "%.1f" % result.pulse().fwhm_fs(), "fs FWHM")
+    return result
@@ -0,0 +1,72 @@
+"""Refractive index and dispersion of optical materials"""
+
+from functools import lru_cache
+
+import numpy as np
+
+from .grids import C_NM_FS
+
+# Sellmeier coefficients (B1, B2, B3, C1, C2, C3), n^2 = 1 + sum B l^2 / (l^2 - C)
+# with the wavelength l in micron and C in micron^2, and the wavelength range
+# in micron the fit is valid in
+materials = {
+    "BK7": ((1.03961212, 0.231792344, 1.01046945, 0.00600069867, 0.0200179144, 103.560653),
+            (0.3, 2.5)),
+    "fused silica": ((0.6961663, 0.4079426, 0.8974794, 0.0684043**2, 0.1162414**2, 9.896161**2),
+                     (0.21, 6.7)),
+    "CaF2": ((0.5675888, 0.4710914, 3.8484723, 0.050263605**2, 0.1003909**2, 34.649040**2),
+             (0.23, 9.7)),
+    "BaF2": ((0.643356, 0.506762, 3.8261, 0.057789**2, 0.10968**2, 46.3864**2),
+             (0.27, 10.3)),
+    "sapphire": ((1.4313493, 0.65054713, 5.3414021, 0.0726631**2, 0.1193242**2, 18.028251**2),
+                 (0.2, 5.0)),
+}
+
+
+def refractive_index(material, wavelength_um):
+    """
+    :param material: key of materials
+    :param wavelength_um: vacuum wavelength in micron
+    :return n: refractive index, nan outside the range of the fit
+    """
+    if material not in materials:
+        raise ValueError(f"unknown material {material}, use one of {', '.join(materials)}")
+    (b1, b2, b3, c1, c2, c3), (lower_um, upper_um) = materials[material]
+
+    l2 = np.asarray(wavelength_um, dtype=float)**2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        n2 = 1 + b1 * l2 / (l2 - c1) + b2 * l2 / (l2 - c2) + b3 * l2 / (l2 - c3)
+        n = np.sqrt(n2)
+    inside = (np.asarray(wavelength_um) >= lower_um) & (np.asarray(wavelength_um) <= upper_um)
+    return np.where(inside, n, np.nan)
+
+
+@lru_cache(maxsize=32)
+def dispersion_phase(material, omega0, d_omega, n):
+    """
+    Spectral phase of 1 mm of material on a FrequencyGrid, without the
+    constant and the group delay at the carrier (which only move the pulse).
+    Cached, since it depends on the grid only.
+
+    :param material: key of materials
+    :param omega0, d_omega, n: parameters of the FrequencyGrid
+    :return phase: read only array in rad/mm, in FFT order, 0 outside the
+        range of the Sellmeier fit
+    """
+    omega = omega0 + d_omega * np.fft.fftfreq(n, 1 / n)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        k = refractive_index(material, 2e-3 * np.pi * C_NM_FS / omega) * omega / C_NM_FS * 1e6
+
+    # k and its slope at the carrier, from the index at the neighbouring
+    # frequencies
+    h = 1e-3 * d_omega
+    k0, k_lo, k_hi = (refractive_index(material, 2e-3 * np.pi * C_NM_FS / w) * w / C_NM_FS * 1e6
+                      for w in (omega0, omega0 - h, omega0 + h))
+    if not np.isfinite(k0):
+        raise ValueError(f"the carrier is outside the range of the {material} Sellmeier fit")
+    k1 = (k_hi - k_lo) / (2 * h)
+
+    phase = k - k0 - k1 * (omega - omega0)
+    phase[~np.isfinite(phase)] = 0.0
+    phase.setflags(write=False)
+    return phase
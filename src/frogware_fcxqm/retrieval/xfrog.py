@@ -0,0 +1,201 @@
+"""Retrieval of a pulse from its cross-correlation FROG (XFROG) with a known gate"""
+
+import numpy as np
+import scipy.fft as fft
+
+from .grids import FrequencyGrid, C_NM_FS
+from .fields import PulseField
+
+
+class XFROGResult:
+    """
+    Outcome of XFROGRetrieval.run(). Arrays are in FFT order, see
+    FrequencyGrid.
+
+    grid: FrequencyGrid of the signal, around the sum frequency
+    field: complex envelope of the unknown pulse on grid.t_fs
+    carrier_wavelength_nm: carrier of the unknown pulse
+    T_fs: delays of the trace
+    trace: the measured trace on the grid, one row per delay
+    model: the trace of the retrieved field, scaled onto the measurement
+    errors: trace error of every iteration
+    """
+
+    def __init__(self, grid, field, carrier_wavelength_nm, T_fs, trace, model, errors):
+        self.grid = grid
+        self.field = field
+        self.carrier_wavelength_nm = carrier_wavelength_nm
+        self.T_fs = T_fs
+        self.trace = trace
+        self.model = model
+        self.errors = errors
+
+    @property
+    def error(self):
+        return np.min(self.errors) if len(self.errors) > 0 else np.nan
+
+    def pulse(self):
+        """
+        :return pulse: PulseField of the retrieved pulse, for display or to
+            be saved
+        """
+        return PulseField(np.fft.fftshift(self.grid.t_fs), np.fft.fftshift(self.field),
+                          self.carrier_wavelength_nm)
+
+
+class XFROGRetrieval:
+    """
+    Generalized projections for a sum frequency XFROG trace,
+    S(w, T) = |FT[E(t) G(t - T)]|^2, with the gate G known (e.g. retrieved
+    from a FROG or d-scan of the reference pulse). With G fixed the signal
+    is linear in E, so after the measured amplitude has been imposed on the
+    signal of every delay, the field that fits the corrected signals best is
+    found in closed form instead of by a gradient search:
+
+        E(t) = sum_T s(t, T) G*(t - T) / sum_T |G(t - T)|^2
+
+    All delays are handled at once, with one batched FFT each way per
+    iteration. Its results are copied into arrays that every iteration
+    reuses. The delays do not need to be evenly spaced, the gate is shifted
+    by a Fourier phase.
+    """
+
+    def __init__(self, T_fs, wavelengths_nm, spectrogram, gate: PulseField, grid=None, n=512):
+        """
+        :param T_fs: delay of every row of the spectrogram in fs
+        :param wavelengths_nm: wavelength axis of the spectrogram in nm
+        :param spectrogram: 2D array with one sum frequency spectrum per
+            delay, background subtracted
+        :param gate: PulseField of the known gate pulse
+        :param grid: FrequencyGrid of the signal, centered on the measured
+            signal with n points if None (more if the time window would not
+            hold the delays)
+        """
+        T_fs = np.asarray(T_fs, dtype=float)
+        spectrogram = np.asarray(spectrogram, dtype=float)
+        if grid is None:
+            grid = FrequencyGrid.from_spectrum(wavelengths_nm, np.sum(spectrogram, axis=0), n=n)
+            # finer in frequency, over the same span, until the time window
+            # holds twice the delay range
+            factor = 2 * np.ptp(T_fs) / (grid.n * grid.dt_fs)
+            if factor > 1:
+                n = grid.n * 2**int(np.ceil(np.log2(factor)))
+                grid = FrequencyGrid(n, grid.omega0, grid.d_omega * grid.n / n)
+        self.grid = grid
+        self.T_fs = T_fs
+        self.gate = gate
+
+        window_fs = grid.n * grid.dt_fs
+        if np.ptp(T_fs) > window_fs / 2:
+            raise ValueError(f"the delays span {np.ptp(T_fs):.0f} fs, more than half of the "
+                             f"{window_fs:.0f} fs time window of the grid, use a larger n")
+
+        # unknown pulse at the difference of the signal and gate carriers
+        omega0 = grid.omega0 - gate.omega0
+        if omega0 <= 0:
+            raise ValueError("the signal is not at the sum frequency of the gate and the pulse")
+        self.carrier_wavelength_nm = 2 * np.pi * C_NM_FS / omega0
+
+        self.trace = grid.interpolate(wavelengths_nm, spectrogram)
+        self.trace /= np.max(self.trace)
+
+        # the gate at every delay, G(t - T), fixed for the retrieval
+        gate_w = fft.fft(gate.on(grid.t_fs))
+        self.gates = fft.ifft(gate_w * np.exp(-1j * np.outer(T_fs, grid.omega)), axis=-1,
+                              workers=-1)
+        self.gate_norm = np.sum(np.abs(self.gates)**2, axis=0)
+        # where the gate hardly reaches, the trace says nothing about the
+        # field, it is left at zero instead of fitting the noise
+        self.gated = self.gate_norm > 1e-3 * np.max(self.gate_norm)
+
+        self.field = self.initial_field()
+        self.errors = []
+
+    def initial_field(self):
+        """
+        :return field: the delay marginal of the trace, which is roughly the
+            intensity of the pulse convolved with the gate, as a flat phase
+            envelope at the time of the pulse
+        """
+        order = np.argsort(self.T_fs)
+        marginal = np.sum(self.trace, axis=1)[order]
+        # the signal peaks where the pulse at t meets the gate at t - T
+        gate_intensity = self.gate.intensity
+        t_gate_fs = np.sum(self.gate.t_fs * gate_intensity) / np.sum(gate_intensity)
+        intensity = np.interp(self.grid.t_fs - t_gate_fs, self.T_fs[order], marginal,
+                              left=0.0, right=0.0)
+        return np.where(self.gated, np.sqrt(intensity), 0.0).astype(complex)
+
+    def run(self, iterations=200, callback=None):
+        """
+        :param iterations: number of iterations
+        :param callback: optional function called with the error of every
+            iteration
+        :return result: XFROGResult with the field of the lowest error
+        """
+        trace = self.trace
+        trace_norm = np.sqrt(np.sum(trace**2))
+
+        # reused by every iteration
+        signal = np.empty(self.gates.shape, dtype=complex)
+        amplitude = np.empty(self.gates.shape, dtype=float)
+        model = np.empty(self.gates.shape, dtype=float)
+        target = np.sqrt(trace)
+        gates_conj = np.conj(self.gates)
+
+        best_error, best_field = np.inf, self.field
+        for _ in range(iterations):
+            np.multiply(self.field, self.gates, out=signal)
+            signal[...] = fft.fft(signal, axis=-1, overwrite_x=True, workers=-1)
+            np.abs(signal, out=amplitude)
+            np.square(amplitude, out=model)
+
+            # least squares scale of the model onto the measurement
+            mu = np.sum(trace * model) / np.sum(model**2)
+            model *= mu
+            model -= trace
+            error = np.sqrt(np.sum(model**2)) / trace_norm
+            self.errors.append(error)
+            if error < best_error:
+                best_error, best_field = error, self.field
+            if callback is not None:
+                callback(error)
+
+            # measured amplitude, model phase
+            np.maximum(amplitude, 1e-12 * np.max(amplitude), out=amplitude)
+            np.divide(target, amplitude, out=amplitude)
+            amplitude /= np.sqrt(mu)
+            signal *= amplitude
+            signal[...] = fft.ifft(signal, axis=-1, overwrite_x=True, workers=-1)
+
+            # only the field is unknown, the best fit of all delays
+            signal *= gates_conj
+            self.field = np.divide(np.sum(signal, axis=0), self.gate_norm,
+                                   out=np.zeros(self.grid.n, dtype=complex), where=self.gated)
+
+        return XFROGResult(self.grid, best_field, self.carrier_wavelength_nm, self.T_fs,
+                           trace, self.model(best_field), np.array(self.errors))
+
+    def model(self, field):
+        """
+        :return model: the XFROG trace of field, scaled onto the measurement
+        """
+        model = np.abs(fft.fft(field * self.gates, axis=-1, workers=-1))**2
+        return model * np.sum(self.trace * model) / np.sum(model**2)
+
+
+def retrieve_xfrog(T_fs, wavelengths_nm, spectrogram, gate: PulseField, iterations=200,
+                   n=512, callback=None):
+    """
+    Runs an XFROGRetrieval, for the thread pool of the GUI (see
+    TaskRunnable)
+
+    :param callback: optional function called with the error of every
+        iteration
+    :return result: XFROGResult
+    """
+    retrieval = XFROGRetrieval(T_fs, wavelengths_nm, spectrogram, gate, n=n)
+    result = retrieval.run(iterations, callback=callback)
+    print("XFROG retrieval:", "%.4f" % result.error, "trace error,",
+          "%.1f" % result.pulse().fwhm_fs(), "fs FWHM")
+    return result
@@ -1,7 +1,8 @@
 import threading
+import traceback
 import PyQt5.QtCore as qtc
 
-from .hardware_comms.device_interfaces import Spectrometer, LinearMotor
+from .hardware_comms.device_interfaces import Spectrometer, LinearMotor, StageNotSettledException
 
 # Signal class to be used for Runnable
 
@@ -10,10 +11,11 @@ class Signal(qtc.QObject):
     started = qtc.pyqtSignal(object)
     progress = qtc.pyqtSignal(object)
     finished = qtc.pyqtSignal(object)
+    error = qtc.pyqtSignal(object)
 
 
 class UpdateMotorPositionRunnable(qtc.QRunnable):
-    def __init__(self, motor: LinearMotor, event_to_clear: threading.Event):
+    def __init__(self, motor: LinearMotor, event_to_clear: threading.Event, target_um=None):
         super().__init__()
 
         self.motor = motor
@@ -21,7 +23,14 @@ class UpdateMotorPositionRunnable(qtc.QRunnable):
         self.started = self.signal.started
         self.progress = self.signal.progress
         self.finished = self.signal.finished
+        self.error = self.signal.error
         self._stop_initiated = False
+        self._stop_event = threading.Event()
+
+        # if the target of the move is known, the move is finished once the
+        # stage has settled there, instead of when the controller stops
+        # reporting motion
+        self.target_um = target_um
 
         self.event_to_clear = event_to_clear
 
@@ -33,15 +42,28 @@ class UpdateMotorPositionRunnable(qtc.QRunnable):
     """
 
     def stop(self):
-        self._stop_initiated
+        self._stop_initiated = True
+        self._stop_event.set()
 
     def run(self):
 
+        if self.target_um is not None:
+            try:
+                self.motor.wait_until_settled(
+                    self.target_um, callback=self.progress.emit,
+                    stop_event=self._stop_event)
+            except StageNotSettledException as e:
+                self.error.emit(e)
+
         # TODO may be broken. May need to read location from hardware
-        while self.motor.is_in_motion():
-            pos = self.motor.pos_um()
-            self.progress.emit(pos)
-            # time.sleep(.001)
+        else:
+            while self.motor.is_in_motion():
+                if self._stop_event.is_set():
+                    self.motor.stop(blocking=True)
+                    break
+                pos = self.motor.pos_um()
+                self.progress.emit(pos)
+                # time.sleep(.001)
 
         # stop flag has been set to True, and the loop has terminated
         # clear the event
@@ -94,3 +116,42 @@ class UpdateSpectrumRunnable(qtc.QRunnable):
         # clear the event
         self.event_to_clear.clear()
         self.event_to_set.set()
+
+
+class TaskRunnable(qtc.QRunnable):
+    """
+    Runs a blocking hardware routine (T0 search, auto exposure, ...) off
+    the GUI thread. The routine is called as function(*args,
+    callback=progress.emit, **kwargs), and finished emits its return value.
+    If it raises, error emits the exception and finished emits None, so
+    that the GUI always leaves its running state. The given exceptions are
+    expected ones (the hardware refused), any other is also printed with
+    its traceback.
+    """
+
+    def __init__(self, function, *args, exceptions=(), **kwargs):
+        super().__init__()
+
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.exceptions = tuple(exceptions)
+
+        self.signal = Signal()
+        self.started = self.signal.started
+        self.progress = self.signal.progress
+        self.finished = self.signal.finished
+        self.error = self.signal.error
+
+    def run(self):
+        result = None
+        try:
+            result = self.function(
+                *self.args, callback=self.progress.emit, **self.kwargs)
+        except self.exceptions as e:
+            self.error.emit(e)
+        except Exception as e:
+            traceback.print_exc()
+            self.error.emit(e)
+        finally:
+            self.finished.emit(result)
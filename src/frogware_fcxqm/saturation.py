@@ -0,0 +1,25 @@
+"""Detection of saturated detector pixels"""
+
+import numpy as np
+
+# fraction of full scale above which a pixel is treated as saturated, the
+# signal no longer scales with the integration time there
+saturation_fraction = 0.98
+
+
+def saturation_mask(intensities, max_counts, fraction=saturation_fraction):
+    """
+    :param intensities: raw counts, a spectrum or a 2D array of spectra
+    :param max_counts: detector full scale in counts
+    :param fraction: fraction of full scale above which a pixel is saturated
+    :return mask: boolean array, True where a pixel is saturated
+    """
+    return np.asarray(intensities) >= fraction * max_counts
+
+
+def saturated_pixel_counts(mask):
+    """
+    :param mask: saturation mask of a spectrum or a 2D array of spectra
+    :return counts: number of saturated pixels of each spectrum
+    """
+    return np.count_nonzero(mask, axis=-1)
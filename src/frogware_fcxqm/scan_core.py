@@ -0,0 +1,547 @@
+"""Spectrogram acquisition without Qt, for scripts, notebooks and the GUI"""
+
+import numpy as np
+
+from .hardware_comms.device_interfaces import LinearMotor, Spectrometer
+from .hardware_comms.utilities import dist_um_to_T_fs, short_step_motion_params
+from .scan_planner import ScanPlan
+from .spectrogram_store import SpectrogramStore
+from .saturation import saturation_mask, saturated_pixel_counts
+from .exposure import expose_in_range
+from .hdr import read_exposure_ladder, merge_exposures
+from .t0_finder import find_T0
+from .dtypes import processing_dtype
+
+# range (on each side of the recorded T0) and step of the T0 search that
+# verifies T0 before a scan is resumed, in micron
+resume_T0_span_um = 100.0
+resume_T0_step_um = 2.0
+# moves longer than this many steps of the plan use the motion profile the
+# motor had before the scan instead of the short step profile
+long_move_steps = 4
+
+
+def scan_motion_params(motor, step_um, motion_params=None):
+    """
+    The controller defaults are tuned for long travel, the steps of a
+    spectrogram spend most of their time ramping up and down.
+
+    :param motor: LinearMotor
+    :param step_um: step of the scan in micron
+    :param motion_params: (max velocity in um/s, acceleration in um/s^2),
+        read from the motor if None
+    :return motion_params: motion profile for the steps of the scan, None if
+        the motor does not expose one
+    """
+    if motion_params is None:
+        motion_params = motor.motion_params
+    if motion_params is None:
+        return None
+
+    max_velocity_um_s, acceleration_um_s2 = motion_params
+    if motor.scan_acceleration_um_s2 is not None:
+        acceleration_um_s2 = motor.scan_acceleration_um_s2
+
+    return short_step_motion_params(step_um, max_velocity_um_s, acceleration_um_s2)
+
+
+def row_dtype(spectrometer, hdr_exposure_ladder=None, adaptive_exposure_max_factor=None):
+    """
+    :return dtype: dtype the rows of a scan with these settings are stored
+        with. Rows that are spectrometer counts are stored as integers, rows
+        rescaled by HDR or per point exposure need floats.
+    """
+    if hdr_exposure_ladder is not None or adaptive_exposure_max_factor is not None:
+        return processing_dtype
+    return spectrometer.counts_dtype
+
+
+class ScanPoint:
+    """
+    One measured row of a scan, passed to the progress callback.
+
+    n: index of the point, in the order measured
+    n_points: number of points planned so far
+    pos_um: stage position the row was measured at in micron
+    T_fs: delay of the row in femtoseconds
+    intensities: the row, before ambient subtraction
+    saturated: boolean mask of the saturated pixels of the raw counts
+    """
+
+    def __init__(self, n, n_points, pos_um, T_fs, intensities, saturated):
+        self.n = n
+        self.n_points = n_points
+        self.pos_um = pos_um
+        self.T_fs = T_fs
+        self.intensities = intensities
+        self.saturated = saturated
+
+
+class ScanResult:
+    """
+    Spectrogram measured by a Scan. The rows are kept as measured in store,
+    spectrogram() resamples them the way the plan displays and saves them.
+
+    metadata: dict of settings and findings, saved as header lines
+    arrays: dict of per row information, saved to separate files
+    error: message if the scan was aborted, None otherwise
+    """
+
+    def __init__(self, plan: ScanPlan, wavelengths, store: SpectrogramStore):
+        self.plan = plan
+        self.wavelengths = wavelengths
+        self.store = store
+        self.metadata = {"plan": type(plan).__name__}
+        self.arrays = {}
+        self.error = None
+
+    @property
+    def n_points(self):
+        return len(self.store)
+
+    def spectrogram(self):
+        """
+        :return (T_fs, rows): delay axis and ambient subtracted spectrogram
+        """
+        return self.plan.resample(self.store.T_fs, self.store.subtracted())
+
+    def to_array(self):
+        """
+        :return data: the spectrogram with the delays in the first column and
+            the wavelengths in the first row, the format of the saved file
+        """
+        T_fs, rows = self.spectrogram()
+        top_row = np.hstack((np.array([np.nan]), self.wavelengths))
+        return np.vstack((top_row, np.hstack((T_fs[:, np.newaxis], rows))))
+
+    def format_metadata(self):
+        # written as comment lines at the top of the saved file, so np.loadtxt
+        # still reads the data as before
+        return "\n".join(f"{key}: {value}" for key, value in self.metadata.items())
+
+    def save(self, filename):
+        """
+        Saves the spectrogram to filename (.txt), and next to it the rows as
+        measured with the ambient (_raw.npz, for reprocessing) and the per
+        row arrays (_<name>.txt)
+        """
+        np.savetxt(filename, self.to_array(), fmt="%.8g", header=self.format_metadata())
+
+        self.store.save(filename[:-4] + "_raw.npz", self.wavelengths)
+
+        for name, array in self.arrays.items():
+            np.savetxt(filename[:-4] + f"_{name}.txt", array, fmt="%.10g")
+
+
+class Scan:
+    """
+    Collects a spectrogram over the targets of a ScanPlan with any
+    LinearMotor/Spectrometer pair. The motor moves to each target, waits
+    until it has settled, and one row is read there.
+
+    Either run it to completion:
+
+        result = Scan(motor, spectrometer, plan).run(callback=print)
+
+    or iterate over the points as they are measured:
+
+        scan = Scan(motor, spectrometer, plan)
+        for point in scan:
+            ...
+        result = scan.result
+
+    The motion profile and integration time of the devices are restored
+    when the scan ends, also if it is stopped or fails.
+    """
+
+    def __init__(self, motor: LinearMotor, spectrometer: Spectrometer, plan: ScanPlan,
+                 ambient=None, dark_library=None, hdr_exposure_ladder=None,
+                 adaptive_exposure_max_factor=None, max_saturated_pixels=None,
+                 motion_params=None, checkpoint=None):
+        """
+        :param motor: LinearMotor with T0 and travel limits set
+        :param spectrometer: Spectrometer set to the integration time of the scan
+        :param plan: ScanPlan with the stage targets
+        :param ambient: background spectrum subtracted from the rows, zero if None
+        :param dark_library: DarkLibrary the ambient of other integration
+            times is taken from when the exposure is adapted per point, and
+            for the exposures of an HDR point
+        :param hdr_exposure_ladder: integration times of each point as
+            multiples of the current one, merged into one row (HDR)
+        :param adaptive_exposure_max_factor: if given, the exposure is adapted
+            per point up to this multiple of the current integration time
+        :param max_saturated_pixels: if given, the scan is aborted at the
+            first point with more saturated pixels than this
+        :param motion_params: (max velocity in um/s, acceleration in um/s^2)
+            of the moves of the scan, derived from the motor's own with
+            scan_motion_params() if None
+        :param checkpoint: optional ScanCheckpoint the scan is recorded in
+            as it runs, cleared once all points are measured
+        """
+        self.motor = motor
+        self.spectrometer = spectrometer
+        self.plan = plan
+        self.dark_library = dark_library
+        self.hdr_exposure_ladder = hdr_exposure_ladder
+        self.adaptive_exposure_max_factor = adaptive_exposure_max_factor
+        self.max_saturated_pixels = max_saturated_pixels
+        self.motion_params = motion_params
+        self.checkpoint = checkpoint
+
+        self.wavelengths = spectrometer.wavelengths()
+        if ambient is None:
+            ambient = np.zeros(len(self.wavelengths), dtype=processing_dtype)
+        self.ambient = ambient
+
+        dtype = row_dtype(spectrometer, hdr_exposure_ladder, adaptive_exposure_max_factor)
+        self.result = ScanResult(
+            plan, self.wavelengths,
+            SpectrogramStore(len(self.wavelengths), dtype=dtype, ambient=ambient))
+
+        self._stop = False
+        self._original_motion_params = None
+        self._scan_motion_params = None
+        self._active_motion_params = None
+        self._reference_integration_time_micros = None
+        self._row_integration_times = []
+        self._row_directions = []
+        self._row_positions = []
+
+        # index of the first point to measure, and the settings of the
+        # recorded scan if this one resumes it
+        self._first_index = 0
+        self._resumed_settings = None
+        self._position_callback = None
+
+    @classmethod
+    def from_checkpoint(cls, motor, spectrometer, state, checkpoint=None, dark_library=None):
+        """
+        Continues a recorded scan from the next point. When run, the devices
+        are reconnected, the recorded integration time is set, and T0 is
+        verified with a short search around the recorded one (the plan is
+        shifted if it moved).
+
+        :param state: CheckpointState from ScanCheckpoint.load()
+        :param checkpoint: the ScanCheckpoint, to continue the record
+        :param dark_library: see the constructor
+        """
+        settings = state.settings
+        scan = cls(
+            motor,
+            spectrometer,
+            state.plan,
+            ambient=state.store.ambient,
+            dark_library=dark_library,
+            hdr_exposure_ladder=settings["hdr_exposure_ladder"],
+            adaptive_exposure_max_factor=settings["adaptive_exposure_max_factor"],
+            max_saturated_pixels=settings["max_saturated_pixels"],
+            motion_params=settings["motion_params"],
+            checkpoint=checkpoint,
+        )
+        scan.result.store = state.store
+        scan._first_index = state.n_completed
+        scan._resumed_settings = settings
+        return scan
+
+    def settings(self):
+        """
+        :return settings: JSON serializable settings of the scan, recorded
+            in the checkpoint
+        """
+        def to_list(value):
+            return None if value is None else [float(v) for v in value]
+
+        return {
+            "T0_um": float(self.plan.T0_um),
+            "integration_time_micros": self._reference_integration_time_micros,
+            "hdr_exposure_ladder": to_list(self.hdr_exposure_ladder),
+            "adaptive_exposure_max_factor": self.adaptive_exposure_max_factor,
+            "max_saturated_pixels": self.max_saturated_pixels,
+            "motion_params": to_list(self.motion_params),
+        }
+
+    def stop(self):
+        """
+        Ends the scan before the next move, can be called from another thread
+        """
+        self._stop = True
+
+    def run(self, callback=None, position_callback=None):
+        """
+        :param callback: optional function called with every ScanPoint
+        :param position_callback: optional function called with every stage
+            position reading while moving
+        :return result: ScanResult
+        """
+        for point in self.points(position_callback):
+            if callback is not None:
+                callback(point)
+        return self.result
+
+    def __iter__(self):
+        return self.points()
+
+    def points(self, position_callback=None):
+        """
+        Generator of the ScanPoints, measured as they are requested
+        """
+        self._position_callback = position_callback
+        self._start()
+        try:
+            n = self._first_index
+            # direction of the last move, the rows are corrected for the
+            # stage's direction dependent offset
+            previous_um = self.motor.pos_um()
+            direction = 1.0
+            while not self._stop:
+                # adaptive plans add targets once the current ones are measured
+                if n > 0 and n == self.plan.n_points:
+                    self.plan.extend(self.result.store.T_fs, self.result.store.subtracted())
+                if n >= self.plan.n_points:
+                    break
+
+                target_um = self.plan.targets_um[n]
+                self._set_motion_params(target_um - previous_um)
+                if target_um != previous_um:
+                    direction = np.sign(target_um - previous_um)
+                previous_um = target_um
+                self.motor.move_to_um(target_um)
+                # the last reading of the settle check, right before the exposure
+                pos_um = self.motor.wait_until_settled(target_um, callback=position_callback)
+
+                point = self._measure(n, target_um, pos_um, direction)
+                yield point
+
+                if self._saturation_abort(point):
+                    self.result.error = "spectrogram stopped, detector is saturated"
+                    break
+                n += 1
+
+            # nothing left to resume
+            if n >= self.plan.n_points and self.checkpoint is not None:
+                self.checkpoint.clear()
+        finally:
+            self._finish()
+
+    def _start(self):
+        metadata = self.result.metadata
+        if self._resumed_settings is not None:
+            self._resume()
+
+        self._reference_integration_time_micros = self.spectrometer.integration_time_micros
+        metadata["integration_time_micros"] = self._reference_integration_time_micros
+        if self.hdr_exposure_ladder is not None:
+            metadata["hdr_exposure_ladder"] = self.hdr_exposure_ladder
+
+        # set per move by _set_motion_params(), the move to the start and
+        # long jumps keep the original profile
+        self._original_motion_params = self.motor.motion_params
+        if self._original_motion_params is not None:
+            self._original_motion_params = tuple(self._original_motion_params)
+        self._active_motion_params = self._original_motion_params
+        if self._original_motion_params is not None:
+            motion_params = self.motion_params
+            if motion_params is None:
+                motion_params = scan_motion_params(
+                    self.motor, self.plan.step_um, self._original_motion_params)
+            self._scan_motion_params = tuple(motion_params)
+            metadata["max_velocity_um_s"] = motion_params[0]
+            metadata["acceleration_um_s2"] = motion_params[1]
+
+        if self.checkpoint is not None and self._resumed_settings is None:
+            self.checkpoint.start(self.plan, self.result.store, self.settings())
+
+    def _resume(self):
+        metadata = self.result.metadata
+        metadata["resumed_at_point"] = self._first_index + 1
+
+        self.motor.reconnect()
+        self.spectrometer.reconnect()
+        self.spectrometer.integration_time_micros = self._resumed_settings["integration_time_micros"]
+
+        # the stage may have lost its position with the link, find T0 again
+        # and move the remaining targets with it
+        T0_um = self.plan.T0_um
+        lower_um, upper_um = self.motor.travel_limits_um
+        search_range_um = (max(T0_um - resume_T0_span_um, lower_um),
+                           min(T0_um + resume_T0_span_um, upper_um))
+        result = find_T0(self.motor, self.spectrometer, search_range_um=search_range_um,
+                         coarse_step_um=resume_T0_step_um, ambient=self.ambient,
+                         callback=self._position_callback)
+        if not result.confident:
+            print("T0 could not be verified (", result, "), continuing with the recorded T0")
+            metadata["T0_verified"] = False
+            return
+
+        metadata["T0_verified"] = True
+        offset_um = result.T0_um - T0_um
+        if abs(offset_um) > self.motor.settle_tol_um:
+            print("T0 moved by", "%.2f" % offset_um, "um, shifting the scan")
+            self.plan.shift(offset_um)
+            metadata["T0_shift_um"] = float(offset_um)
+
+    def _finish(self):
+        self.result.metadata["n_points"] = self.result.n_points
+        self.result.metadata.update(self.plan.report())
+        self._store_saturation_mask()
+        self._store_directions()
+        self._store_positions()
+        self._restore_integration_time()
+
+        if self._original_motion_params is not None:
+            if self._active_motion_params != self._original_motion_params:
+                self.motor.motion_params = self._original_motion_params
+            self._original_motion_params = None
+            self._active_motion_params = None
+
+    def _set_motion_params(self, dist_um):
+        # the short step profile is capped at the peak velocity of one step,
+        # far too slow for the move to the start of the scan or a jump
+        # across the range (e.g. back to T0 in an AutoRangeScanPlan)
+        if self._scan_motion_params is None:
+            return
+        if abs(dist_um) <= long_move_steps * abs(self.plan.step_um):
+            motion_params = self._scan_motion_params
+        else:
+            motion_params = self._original_motion_params
+        if motion_params != self._active_motion_params:
+            self.motor.motion_params = motion_params
+            self._active_motion_params = motion_params
+
+    def _measure(self, n, target_um, pos_before_um, direction=1.0):
+        intensities, saturated = self.read_spectrum()
+        pos_after_um = self.motor.pos_um()
+
+        # the row is tagged with where the stage actually was during the
+        # exposure (whichever way it came from), so a missed step or an
+        # overshoot moves the row instead of corrupting the delay axis
+        offset_um = self.motor.direction_offset_um(direction)
+        pos_before_um += offset_um
+        pos_after_um += offset_um
+        pos_um = (pos_before_um + pos_after_um) / 2
+        self._row_directions.append(direction)
+        self._row_positions.append((target_um, pos_before_um, pos_after_um))
+        T_fs = dist_um_to_T_fs(pos_um - self.plan.T0_um)
+        self.result.store.append(T_fs, intensities, saturated)
+        if self.checkpoint is not None:
+            store = self.result.store
+            self.checkpoint.add_point(self.plan, T_fs, store.raw[-1], store.saturated[-1])
+        # the stored copy, the spectrometer may reuse the buffer it returned
+        return ScanPoint(n, self.plan.n_points, pos_um, T_fs,
+                         self.result.store.raw[-1], saturated)
+
+    def read_spectrum(self):
+        """
+        :return (intensities, saturated): the row, and the saturation mask of
+            the raw counts it was made from
+        """
+        if self.hdr_exposure_ladder is not None:
+            return self.read_hdr_spectrum()
+
+        if self.adaptive_exposure_max_factor is None:
+            intensities = self.spectrometer.intensities()
+            return intensities, saturation_mask(intensities, self.spectrometer.max_counts)
+
+        # re-expose points that are saturated or too dim, and normalize the
+        # row to the integration time the scan was started with
+        reference_us = self._reference_integration_time_micros
+        intensities, integration_time_micros = expose_in_range(
+            self.spectrometer,
+            max_integration_time_micros=self.adaptive_exposure_max_factor * reference_us,
+        )
+        self._row_integration_times.append(integration_time_micros)
+        saturated = saturation_mask(intensities, self.spectrometer.max_counts)
+
+        # only the signal is rescaled, so that the ambient subtracted later
+        # is the right one. Without an ambient for the integration time
+        # actually used, the one of the scan is taken as an offset that does
+        # not scale with the integration time.
+        ambient = None
+        if self.dark_library is not None:
+            ambient = self.dark_library.get(integration_time_micros)
+        if ambient is None:
+            ambient = self.ambient
+        ratio = reference_us / integration_time_micros
+        intensities = (intensities - ambient) * ratio + self.ambient
+        return intensities, saturated
+
+    def read_hdr_spectrum(self):
+        # merge a ladder of exposures onto the scale of the integration time
+        # the scan was started with. Each exposure has the dark of its own
+        # integration time removed before rescaling, and the ambient of the
+        # scan is added back, so that it is still subtracted correctly from
+        # the merged row.
+        reference_us = self._reference_integration_time_micros
+        lower_us, upper_us = self.spectrometer.integration_time_micros_limit
+        times_us = np.clip(reference_us * np.array(self.hdr_exposure_ladder),
+                           lower_us, upper_us)
+
+        # without a dark for an integration time, the ambient of the scan is
+        # taken as an offset that does not scale with the integration time
+        darks = None
+        if self.dark_library is not None:
+            darks = np.array([self.ambient if dark is None else dark
+                              for dark in map(self.dark_library.get, times_us)],
+                             dtype=processing_dtype)
+
+        frames = read_exposure_ladder(self.spectrometer, times_us)
+        return merge_exposures(
+            frames,
+            times_us,
+            self.spectrometer.max_counts,
+            reference_time_micros=reference_us,
+            offset=self.ambient,
+            darks=darks,
+        )
+
+    def _saturation_abort(self, point):
+        n_saturated = saturated_pixel_counts(point.saturated)
+        if n_saturated == 0:
+            return False
+
+        print("point", point.n + 1, "has", n_saturated, "saturated pixels")
+        return self.max_saturated_pixels is not None and n_saturated > self.max_saturated_pixels
+
+    def _store_saturation_mask(self):
+        # saved with the delay of each row in the first column, in the order
+        # the rows were measured
+        store = self.result.store
+        mask = store.saturated
+        if len(mask) == 0 or not np.any(mask):
+            return
+        self.result.metadata["saturated_rows"] = int(
+            np.count_nonzero(saturated_pixel_counts(mask)))
+        self.result.arrays["saturation"] = np.hstack((store.T_fs[:, np.newaxis], mask))
+
+    def _store_positions(self):
+        # measured and nominal delay of each row, with the stage readings
+        # before and after the exposure, in the order the rows were measured
+        if len(self._row_positions) == 0:
+            return
+        target_um, before_um, after_um = np.array(self._row_positions).T
+        first = self._first_index
+        T_fs = self.result.store.T_fs[first:first + len(target_um)]
+        nominal_T_fs = dist_um_to_T_fs(target_um - self.plan.T0_um)
+        self.result.arrays["delays"] = np.column_stack((T_fs, nominal_T_fs, before_um, after_um))
+        self.result.metadata["max_delay_error_fs"] = float(np.max(np.abs(T_fs - nominal_T_fs)))
+
+    def _store_directions(self):
+        # only of interest if the rows were corrected for them
+        if len(self._row_directions) == 0 or not np.any(self.motor.direction_offsets_um):
+            return
+        self.result.metadata["direction_offsets_um"] = list(self.motor.direction_offsets_um)
+        first = self._first_index
+        self.result.arrays["direction"] = np.column_stack(
+            (self.result.store.T_fs[first:first + len(self._row_directions)],
+             self._row_directions))
+
+    def _restore_integration_time(self):
+        if self.adaptive_exposure_max_factor is None:
+            return
+
+        self.spectrometer.integration_time_micros = self._reference_integration_time_micros
+        if len(self._row_integration_times) > 0:
+            n_rows = len(self._row_integration_times)
+            first = self._first_index
+            self.result.arrays["integration_time_micros"] = np.column_stack(
+                (self.result.store.T_fs[first:first + n_rows], self._row_integration_times))
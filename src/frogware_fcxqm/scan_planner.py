@@ -0,0 +1,181 @@
+"""Plans the stage targets of a delay scan before anything moves"""
+
+import copy
+
+import numpy as np
+
+from .hardware_comms.device_interfaces import StageOutOfBoundsException
+from .hardware_comms.utilities import T_fs_to_dist_um, dist_um_to_T_fs, move_time_s
+from .resampling import resample_to_uniform
+
+
+class ScanPlan:
+    """
+    Absolute stage targets of a delay scan. The whole grid is generated up
+    front, so the number of points is known before the scan starts, every
+    target is checked against the stage limits before the first move, and
+    the scan can move to absolute positions instead of stepping relative to
+    the last one (which accumulates position error).
+    """
+
+    def __init__(self, start_um, end_um, step_um, T0_um, travel_limits_um=None, clamp=False):
+        """
+        :param start_um: first stage position in micron
+        :param end_um: last stage position in micron, included if it lies
+            on the grid
+        :param step_um: step size in micron, the sign is taken from the
+            direction of start_um -> end_um
+        :param T0_um: stage position of time zero in micron
+        :param travel_limits_um: (lower bound, upper bound) in micron, the
+            plan is not validated if None
+        :param clamp: if True, drop the targets outside of travel_limits_um
+            instead of raising StageOutOfBoundsException
+        """
+        if step_um == 0:
+            raise ValueError("step size cannot be 0")
+
+        span_um = end_um - start_um
+        step_um = abs(step_um) * (-1 if span_um < 0 else 1)
+
+        # round to a nm so that an end position on the grid is not lost to
+        # floating point error
+        n_points = int(np.floor(np.round(span_um / step_um, 3))) + 1
+
+        self.start_um = start_um
+        self.end_um = end_um
+        self.step_um = step_um
+        self.T0_um = T0_um
+        self.targets_um = start_um + step_um * np.arange(n_points, dtype=float)
+
+        if travel_limits_um is not None:
+            self._validate(travel_limits_um, clamp)
+
+    @classmethod
+    def from_fs(cls, start_fs, end_fs, step_fs, T0_um, travel_limits_um=None, clamp=False):
+        """
+        Same as the constructor, with the start, end and step given as
+        delays in femtoseconds (with respect to T0_um)
+        """
+        return cls(
+            T_fs_to_dist_um(start_fs) + T0_um,
+            T_fs_to_dist_um(end_fs) + T0_um,
+            T_fs_to_dist_um(step_fs),
+            T0_um,
+            travel_limits_um=travel_limits_um,
+            clamp=clamp,
+        )
+
+    def _validate(self, travel_limits_um, clamp):
+        lower_um, upper_um = travel_limits_um
+        outside = (self.targets_um < lower_um) | (self.targets_um > upper_um)
+        if not np.any(outside):
+            return
+
+        if not clamp or np.all(outside):
+            raise StageOutOfBoundsException(
+                f"{np.count_nonzero(outside)} of {len(self.targets_um)} scan "
+                f"points would exceed the software limits "
+                f"({lower_um} um, {upper_um} um)")
+
+        self.targets_um = self.targets_um[~outside]
+
+    @property
+    def targets_fs(self):
+        return dist_um_to_T_fs(self.targets_um - self.T0_um)
+
+    @property
+    def n_points(self):
+        return len(self.targets_um)
+
+    def estimate_duration_s(self, exposure_s, motion_params=None, settle_s=0.0):
+        """
+        :param exposure_s: time to read one spectrum in seconds
+        :param motion_params: (max velocity in um/s, acceleration in um/s^2)
+            used for the moves between targets, moves are not counted if None
+        :param settle_s: time spent settling after each move in seconds
+        :return duration_s: estimated duration of the scan, not counting the
+            move to the first target
+        """
+        n_moves = self.n_points - 1
+        duration_s = self.n_points * exposure_s + n_moves * settle_s
+
+        if motion_params is not None and n_moves > 0:
+            moves_um = np.diff(self.targets_um)
+            duration_s += np.sum(move_time_s(moves_um, *motion_params))
+
+        return float(duration_s)
+
+    def shift(self, offset_um):
+        """
+        Moves the plan along the stage, for a T0 that has moved by offset_um.
+        The delays of the targets stay the same.
+        """
+        self.start_um += offset_um
+        self.end_um += offset_um
+        self.T0_um += offset_um
+        self.targets_um = self.targets_um + offset_um
+
+    def reversed(self):
+        """
+        :return plan: copy of the plan that goes through the targets in the
+            opposite direction
+        """
+        plan = copy.copy(self)
+        plan.start_um, plan.end_um = self.end_um, self.start_um
+        plan.step_um = -self.step_um
+        plan.targets_um = self.targets_um[::-1].copy()
+        return plan
+
+    def starting_near(self, pos_um):
+        """
+        :param pos_um: current stage position in micron
+        :return plan: the plan, or its reversed() copy if that starts closer
+            to pos_um, so that a scan need not return to the start first
+        """
+        if abs(self.targets_um[-1] - pos_um) < abs(self.targets_um[0] - pos_um):
+            return self.reversed()
+        return self
+
+    def extend(self, T_fs, rows):
+        """
+        Called by the scan once every target has been measured. Plans that
+        choose their points from the data add targets here.
+
+        :param T_fs: delays of the rows measured so far in femtoseconds
+        :param rows: 2D array of the spectra measured so far, one per delay
+        :return targets_um: targets appended to the plan, in micron
+        """
+        return np.array([])
+
+    def resample(self, T_fs, rows):
+        """
+        :param T_fs: delays of the rows measured so far in femtoseconds
+        :param rows: 2D array of the spectra measured so far, one per delay
+        :return (T_fs, rows): delay axis and spectrogram to display and save.
+            The rows are interpolated from the delays they were measured at
+            onto the planned delays, an exactly uniform axis.
+        """
+        if len(T_fs) == 0:
+            return T_fs, rows
+        T_uniform_fs = self.grid_within(np.sort(self.targets_fs), T_fs)
+        return T_uniform_fs, resample_to_uniform(T_fs, rows, T_uniform_fs)
+
+    @staticmethod
+    def grid_within(grid_fs, T_fs):
+        """
+        :param grid_fs: sorted uniform delay grid in femtoseconds
+        :param T_fs: measured delays
+        :return grid_fs: the part of the grid covered by the measured delays,
+            which may be off their target by up to half a step
+        """
+        half_step_fs = abs(grid_fs[1] - grid_fs[0]) / 2 if len(grid_fs) > 1 else 0.0
+        inside = ((grid_fs >= np.min(T_fs) - half_step_fs) &
+                  (grid_fs <= np.max(T_fs) + half_step_fs))
+        return grid_fs[inside]
+
+    def report(self):
+        """
+        :return report: dict of what the plan found out during the scan, to
+            be saved with the spectrogram
+        """
+        return {}
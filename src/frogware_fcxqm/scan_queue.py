@@ -0,0 +1,236 @@
+"""Unattended series of spectrograms, resumed after a restart"""
+
+import json
+import os
+import time
+from pathlib import Path
+
+from .hardware_comms.device_interfaces import StageOutOfBoundsException, StageNotSettledException, \
+    SpectrometerIntegrationException
+from .hardware_comms.utilities import T_fs_to_dist_um
+from .scan_planner import ScanPlan
+from .adaptive_sampling import AdaptiveScanPlan
+from .auto_range import AutoRangeScanPlan
+from .scan_core import Scan
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+plan_types = {
+    "ScanPlan": ScanPlan,
+    "AdaptiveScanPlan": AdaptiveScanPlan,
+    "AutoRangeScanPlan": AutoRangeScanPlan,
+}
+
+
+class QueueItem:
+    """
+    One spectrogram of a ScanQueue. The settings that are None are left as
+    the devices are.
+
+    name: used for the output file
+    start_fs, end_fs, step_fs: delay range and step, with respect to T0
+    plan: name of the plan type, a key of plan_types. AutoRangeScanPlan
+        only uses step_fs.
+    integration_time_micros: spectrometer integration time
+    T0_um: stage position of time zero in micron, the T0 of the motor if
+        None. Only the plan of the item uses it, the calibrated T0 of the
+        motor is left alone.
+    max_velocity_um_s, acceleration_um_s2: motion profile of the moves of
+        the scan, both have to be given
+    delay_s: wait before the scan starts, in seconds
+    status: PENDING, DONE or FAILED
+    output: file the spectrogram was saved to
+    error: message of the failure
+    """
+
+    fields = ("name", "start_fs", "end_fs", "step_fs", "plan", "integration_time_micros", "T0_um",
+              "max_velocity_um_s", "acceleration_um_s2", "delay_s", "status", "output", "error")
+
+    def __init__(self, name, start_fs, end_fs, step_fs, plan="ScanPlan", integration_time_micros=None,
+                 T0_um=None, max_velocity_um_s=None, acceleration_um_s2=None, delay_s=0.0,
+                 status=PENDING, output=None, error=None):
+        if plan not in plan_types:
+            raise ValueError(f"unknown plan {plan}, use one of {', '.join(plan_types)}")
+
+        self.name = name
+        self.start_fs = start_fs
+        self.end_fs = end_fs
+        self.step_fs = step_fs
+        self.plan = plan
+        self.integration_time_micros = integration_time_micros
+        self.T0_um = T0_um
+        self.max_velocity_um_s = max_velocity_um_s
+        self.acceleration_um_s2 = acceleration_um_s2
+        self.delay_s = delay_s
+        self.status = status
+        self.output = output
+        self.error = error
+
+    @classmethod
+    def from_dict(cls, item):
+        return cls(**item)
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.fields}
+
+    @property
+    def motion_params(self):
+        if self.max_velocity_um_s is None or self.acceleration_um_s2 is None:
+            return None
+        return self.max_velocity_um_s, self.acceleration_um_s2
+
+    def create_plan(self, motor):
+        """
+        :param motor: LinearMotor with T0 and travel limits set
+        :return plan: ScanPlan of this item
+        """
+        T0_um = motor.T0_um if self.T0_um is None else self.T0_um
+        if self.plan == "AutoRangeScanPlan":
+            return AutoRangeScanPlan(T0_um, T_fs_to_dist_um(self.step_fs),
+                                     motor.travel_limits_um)
+
+        # from the end of the range the last item left the stage at
+        plan = plan_types[self.plan].from_fs(
+            self.start_fs, self.end_fs, self.step_fs, T0_um,
+            travel_limits_um=motor.travel_limits_um)
+        return plan.starting_near(motor.pos_um())
+
+
+class ScanQueue:
+    """
+    Runs a list of QueueItems back to back. The queue is kept in a JSON
+    file ({"items": [...]}, with the fields of QueueItem) that is rewritten
+    after every item, and the spectrograms are saved next to it. Running a
+    queue loaded from the same file again continues with the items that are
+    still pending.
+
+    A failed item is recorded and the queue moves on. The T0 and
+    integration time of the devices are restored once the queue ends.
+    """
+
+    # failures of one item that do not stop the queue
+    item_exceptions = (StageOutOfBoundsException, StageNotSettledException,
+                       SpectrometerIntegrationException, ValueError)
+
+    def __init__(self, motor, spectrometer, items, path, dark_library=None):
+        """
+        :param motor: LinearMotor
+        :param spectrometer: Spectrometer
+        :param items: list of QueueItems
+        :param path: JSON file the queue is kept in
+        :param dark_library: optional DarkLibrary the ambient of each item's
+            integration time is taken from
+        """
+        self.motor = motor
+        self.spectrometer = spectrometer
+        self.items = items
+        self.path = Path(path)
+        self.dark_library = dark_library
+
+        self.scan = None
+        self._stop = False
+
+    @classmethod
+    def load(cls, motor, spectrometer, path, dark_library=None):
+        with open(path, "r") as file:
+            items = [QueueItem.from_dict(item) for item in json.load(file)["items"]]
+        return cls(motor, spectrometer, items, path, dark_library=dark_library)
+
+    def save(self):
+        # written to a temporary file first, so that a crash never leaves a
+        # truncated queue behind
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as file:
+            json.dump({"items": [item.to_dict() for item in self.items]}, file, indent=2)
+        os.replace(tmp_path, self.path)
+
+    @property
+    def pending(self):
+        return [i for i, item in enumerate(self.items) if item.status == PENDING]
+
+    def output_path(self, index):
+        return self.path.parent / f"{self.path.stem}_{index:03d}_{self.items[index].name}.txt"
+
+    def stop(self):
+        """
+        Stops the running scan and the queue, can be called from another
+        thread. The interrupted item stays pending.
+        """
+        self._stop = True
+        if self.scan is not None:
+            self.scan.stop()
+
+    def run(self, callback=None, position_callback=None):
+        """
+        Runs the pending items in order.
+
+        :param callback: optional function called with every ScanPoint
+        :param position_callback: optional function called with every stage
+            position reading while moving
+        :return items: the QueueItems, with their status
+        """
+        original_integration_time_micros = self.spectrometer.integration_time_micros
+        try:
+            for index in self.pending:
+                if not self._wait(self.items[index].delay_s):
+                    break
+                self.run_item(index, callback, position_callback)
+                if self._stop:
+                    break
+        finally:
+            self.spectrometer.integration_time_micros = original_integration_time_micros
+        return self.items
+
+    def run_item(self, index, callback=None, position_callback=None):
+        item = self.items[index]
+        print("queue item", index + 1, "of", len(self.items), ":", item.name)
+
+        try:
+            self.apply(item)
+            ambient = None
+            if self.dark_library is not None:
+                ambient = self.dark_library.get(self.spectrometer.integration_time_micros)
+
+            self.scan = Scan(self.motor, self.spectrometer, item.create_plan(self.motor),
+                             ambient=ambient, motion_params=item.motion_params)
+            if self._stop:
+                self.scan.stop()
+            result = self.scan.run(callback=callback, position_callback=position_callback)
+        except self.item_exceptions as e:
+            item.status = FAILED
+            item.error = getattr(e, "message", str(e))
+            self.save()
+            return
+        finally:
+            self.scan = None
+
+        # a stopped scan is run again when the queue resumes
+        if self._stop:
+            return
+
+        output = self.output_path(index)
+        result.save(str(output))
+        item.status = DONE
+        item.output = output.name
+        item.error = result.error
+        self.save()
+
+    def apply(self, item):
+        """
+        Sets the device state of item. The T0 of the item goes into its
+        plan instead (see QueueItem.create_plan()), since the T0 setter of the
+        motor saves it as the calibration.
+        """
+        if item.integration_time_micros is not None:
+            self.spectrometer.integration_time_micros = item.integration_time_micros
+
+    def _wait(self, delay_s):
+        # returns False if the queue was stopped while waiting
+        t_end = time.monotonic() + delay_s
+        while time.monotonic() < t_end:
+            if self._stop:
+                return False
+            time.sleep(max(min(0.1, t_end - time.monotonic()), 0.0))
+        return not self._stop
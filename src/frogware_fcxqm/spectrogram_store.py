@@ -0,0 +1,124 @@
+"""Storage of the rows of a spectrogram as they are acquired"""
+
+import numpy as np
+
+from .dtypes import processing_dtype, to_counts
+
+
+class SpectrogramStore:
+    """
+    Rows of a spectrogram in the order they were measured, kept as the
+    spectrometer counts together with the ambient they are to be corrected
+    with. The background subtracted rows are computed on demand (and only
+    for rows that were added since the last call), so a different
+    background treatment only needs the stored data, not a new scan.
+    """
+
+    def __init__(self, n_pixels, dtype=processing_dtype, ambient=None, capacity=256):
+        """
+        :param n_pixels: number of pixels of each row
+        :param dtype: dtype the rows are stored with, an unsigned integer
+            type for raw counts
+        :param ambient: ambient spectrum to subtract, zeros if None
+        :param capacity: number of rows allocated up front, the storage
+            doubles whenever it is full
+        """
+        self.dtype = np.dtype(dtype)
+        self._raw = np.empty((capacity, n_pixels), dtype=self.dtype)
+        self._saturated = np.zeros((capacity, n_pixels), dtype=bool)
+        self._T_fs = np.empty(capacity)
+        self._n = 0
+
+        self._subtracted = np.empty((capacity, n_pixels), dtype=processing_dtype)
+        self._n_subtracted = 0
+
+        if ambient is None:
+            ambient = np.zeros(n_pixels)
+        self.set_ambient(ambient)
+
+    def __len__(self):
+        return self._n
+
+    def _grow(self):
+        capacity = 2 * len(self._T_fs)
+        for name in ("_raw", "_saturated", "_subtracted"):
+            old = getattr(self, name)
+            new = np.zeros((capacity, old.shape[1]), dtype=old.dtype)
+            new[:self._n] = old[:self._n]
+            setattr(self, name, new)
+        T_fs = np.empty(capacity)
+        T_fs[:self._n] = self._T_fs[:self._n]
+        self._T_fs = T_fs
+
+    def append(self, T_fs, row, saturated=None):
+        """
+        :param T_fs: delay of the row in femtoseconds
+        :param row: spectrum, not background subtracted
+        :param saturated: optional saturation mask of the row
+        """
+        if self._n == len(self._T_fs):
+            self._grow()
+
+        if np.issubdtype(self.dtype, np.integer):
+            row = to_counts(row, self.dtype)
+        self._raw[self._n] = row
+        self._T_fs[self._n] = T_fs
+        if saturated is not None:
+            self._saturated[self._n] = saturated
+        self._n += 1
+
+    def set_ambient(self, ambient):
+        self.ambient = np.array(ambient, dtype=processing_dtype)
+        self._n_subtracted = 0
+
+    @property
+    def T_fs(self):
+        return self._T_fs[:self._n]
+
+    @property
+    def raw(self):
+        return self._raw[:self._n]
+
+    @property
+    def saturated(self):
+        return self._saturated[:self._n]
+
+    def subtracted(self):
+        """
+        :return rows: background subtracted rows, clamped at 0
+        """
+        new = slice(self._n_subtracted, self._n)
+        np.subtract(self._raw[new], self.ambient, out=self._subtracted[new],
+                    dtype=processing_dtype)
+        np.maximum(self._subtracted[new], 0.0, out=self._subtracted[new])
+        self._n_subtracted = self._n
+        return self._subtracted[:self._n]
+
+    def save(self, path, wavelengths=None):
+        """
+        Saves the stored rows, their delays, saturation masks and the
+        ambient to a compressed .npz file
+        """
+        arrays = dict(raw=self.raw, T_fs=self.T_fs, saturated=self.saturated,
+                      ambient=self.ambient)
+        if wavelengths is not None:
+            arrays["wavelengths"] = wavelengths
+        np.savez_compressed(path, **arrays)
+
+    def copy(self):
+        store = SpectrogramStore(self._raw.shape[1], dtype=self.dtype, ambient=self.ambient,
+                                 capacity=len(self._T_fs))
+        for name in ("_raw", "_saturated", "_T_fs"):
+            getattr(store, name)[:self._n] = getattr(self, name)[:self._n]
+        store._n = self._n
+        return store
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            raw = data["raw"]
+            store = cls(raw.shape[1], dtype=raw.dtype, ambient=data["ambient"],
+                        capacity=max(len(raw), 1))
+            for T_fs, row, saturated in zip(data["T_fs"], raw, data["saturated"]):
+                store.append(T_fs, row, saturated)
+        return store
@@ -0,0 +1,218 @@
+"""Automatic search for the stage position of time zero"""
+
+import numpy as np
+
+from .scan_planner import ScanPlan
+from .dtypes import precise_dtype
+from .hardware_comms.utilities import T_fs_to_dist_um
+
+
+class T0Result:
+    """
+    Outcome of find_T0().
+
+    T0_um: stage position of the signal peak in micron
+    uncertainty_um: 1 sigma uncertainty of T0_um from the final peak fit
+    snr: peak height of the coarse scan over its noise level
+    """
+
+    # below this the coarse scan is not considered to have found a peak
+    min_snr = 5.0
+
+    def __init__(self, T0_um, uncertainty_um, snr):
+        self.T0_um = T0_um
+        self.uncertainty_um = uncertainty_um
+        self.snr = snr
+
+    @property
+    def confident(self):
+        return self.snr >= self.min_snr and np.isfinite(self.uncertainty_um)
+
+    def __repr__(self):
+        return (f"T0Result(T0_um={self.T0_um:.3f}, "
+                f"uncertainty_um={self.uncertainty_um:.3f}, snr={self.snr:.1f})")
+
+
+def scan_signal(motor, spectrometer, targets_um, ambient=None, callback=None, stop_event=None):
+    """
+    Integrated (SHG) signal at each target position.
+
+    :param motor: LinearMotor to move
+    :param spectrometer: Spectrometer to read
+    :param targets_um: absolute stage positions in micron
+    :param ambient: optional background spectrum to subtract
+    :param callback: optional function called with every position reading
+    :param stop_event: optional threading.Event that ends the scan early
+    :return signal: array of the integrated spectrum at each target, None
+        if the scan was stopped
+    """
+    signal = np.empty(len(targets_um))
+    for i, target_um in enumerate(targets_um):
+        if stop_event is not None and stop_event.is_set():
+            return None
+        motor.move_to_um(target_um)
+        motor.wait_until_settled(target_um, callback=callback, stop_event=stop_event)
+        if stop_event is not None and stop_event.is_set():
+            return None
+
+        intensities = spectrometer.intensities()
+        if ambient is not None:
+            intensities = intensities - ambient
+        signal[i] = np.sum(intensities, dtype=precise_dtype)
+    return signal
+
+
+def baseline_and_noise(y):
+    """
+    :param y: signal of a scan that is mostly off the peak
+    :return (baseline, noise): median of y and its robust standard
+        deviation
+    """
+    y = np.asarray(y, dtype=float)
+    baseline = np.median(y)
+    return baseline, 1.4826 * np.median(np.abs(y - baseline))
+
+
+def fit_peak(x, y, n_fit=5, baseline=None, noise=None):
+    """
+    Fits a Gaussian (a parabola in log space) to the points around the
+    maximum of y.
+
+    :param x: sorted positions
+    :param y: signal at x
+    :param n_fit: number of points around the maximum used in the fit
+    :param baseline: signal level off the peak, and
+    :param noise: its standard deviation, both estimated from y if None.
+        A scan that only covers the peak has no points off it, pass those
+        of a wider scan instead.
+    :return (center, uncertainty, snr): center of the peak, its 1 sigma
+        uncertainty, and the height of the peak over the noise
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    if baseline is None or noise is None:
+        baseline, noise = baseline_and_noise(y)
+    i_max = np.argmax(y)
+    height = y[i_max] - baseline
+    snr = height / noise if noise > 0 else np.inf
+
+    step = np.abs(np.diff(x)).min() if len(x) > 1 else np.inf
+    window = slice(max(i_max - n_fit // 2, 0), i_max + n_fit // 2 + 1)
+    x_fit, y_fit = x[window], y[window] - baseline
+    keep = y_fit > 0
+    x_fit, y_fit = x_fit[keep], y_fit[keep]
+
+    if len(x_fit) < 3:
+        return x[i_max], step / 2, snr
+
+    # center the abscissa for a well conditioned fit
+    x0 = x[i_max]
+    if len(x_fit) > 4:
+        (a, b, _), cov = np.polyfit(x_fit - x0, np.log(y_fit), 2, cov=True)
+    else:
+        a, b, _ = np.polyfit(x_fit - x0, np.log(y_fit), 2)
+        cov = None
+
+    if a >= 0:
+        # not peaked, fall back to the largest point
+        return x0, step / 2, snr
+
+    center = x0 - b / (2 * a)
+    if cov is None:
+        uncertainty = step / 2
+    else:
+        # propagate the covariance of (a, b) to -b / 2a
+        grad = np.array([b / (2 * a**2), -1 / (2 * a)])
+        uncertainty = np.sqrt(grad @ cov[:2, :2] @ grad)
+
+    # a center outside of the fitted points is not trustworthy
+    if not (x_fit.min() <= center <= x_fit.max()):
+        return x0, step / 2, snr
+
+    return center, uncertainty, snr
+
+
+def coarse_step_for_pulse(pulse_fwhm_fs, points_per_fwhm=3):
+    """
+    :param pulse_fwhm_fs: shortest pulse duration expected (FWHM) in fs
+    :param points_per_fwhm: coarse scan points within the FWHM of the signal
+    :return step_um: coarse step that does not step over the signal peak.
+        The SHG signal against delay is the intensity autocorrelation,
+        sqrt(2) times as wide as a Gaussian pulse.
+    """
+    return T_fs_to_dist_um(np.sqrt(2) * pulse_fwhm_fs) / points_per_fwhm
+
+
+def search_points(search_range_um, coarse_step_um=5.0, final_step_um=0.1, refine_factor=4):
+    """
+    :return n_points: number of positions find_T0() measures with these
+        settings when it finds a peak, to estimate how long it takes
+    """
+    lower_um, upper_um = search_range_um
+    n_points = int(np.floor((upper_um - lower_um) / coarse_step_um)) + 1
+    step_um = coarse_step_um
+    while step_um > final_step_um:
+        # each refinement covers +-2 steps of the previous scan
+        next_step_um = max(step_um / refine_factor, final_step_um)
+        n_points += int(np.floor(4 * step_um / next_step_um)) + 1
+        step_um = next_step_um
+    return n_points
+
+
+def find_T0(motor, spectrometer, search_range_um=None, coarse_step_um=5.0, final_step_um=0.1,
+            refine_factor=4, ambient=None, callback=None, stop_event=None):
+    """
+    Coarse-to-fine search for the position of the FROG signal peak. A coarse
+    scan over the search range locates the peak, then progressively finer
+    scans around the fitted peak refine it until the step reaches
+    final_step_um.
+
+    :param motor: LinearMotor with software limits set
+    :param spectrometer: Spectrometer to read the signal with
+    :param search_range_um: (lower, upper) stage positions to search in
+        micron, defaults to the stage travel limits
+    :param coarse_step_um: step of the coarse scan in micron, should be
+        smaller than the width of the cross correlation (see
+        coarse_step_for_pulse())
+    :param final_step_um: step of the last refinement scan in micron
+    :param refine_factor: step size reduction between refinements
+    :param ambient: optional background spectrum to subtract
+    :param callback: optional function called with every position reading
+    :param stop_event: optional threading.Event that ends the search early
+    :return result: T0Result, T0 is not changed on the motor, None if the
+        search was stopped
+    """
+    if search_range_um is None:
+        search_range_um = motor.travel_limits_um
+    lower_um, upper_um = search_range_um
+
+    step_um = coarse_step_um
+    snr = baseline = noise = None
+    while True:
+        plan = ScanPlan(lower_um, upper_um, step_um, motor.T0_um,
+                        travel_limits_um=motor.travel_limits_um, clamp=True)
+        signal = scan_signal(motor, spectrometer, plan.targets_um, ambient=ambient,
+                             callback=callback, stop_event=stop_event)
+        if signal is None:
+            return None
+
+        # the coarse scan is mostly off the peak, its baseline, noise and
+        # signal to noise ratio are the meaningful ones, the fine scans
+        # only cover the peak
+        if snr is None:
+            baseline, noise = baseline_and_noise(signal)
+        center_um, uncertainty_um, scan_snr = fit_peak(plan.targets_um, signal,
+                                                       baseline=baseline, noise=noise)
+        if snr is None:
+            snr = scan_snr
+            if snr < T0Result.min_snr:
+                break
+
+        if step_um <= final_step_um:
+            break
+
+        lower_um, upper_um = center_um - 2 * step_um, center_um + 2 * step_um
+        step_um = max(step_um / refine_factor, final_step_um)
+
+    return T0Result(center_um, uncertainty_um, snr)
@@ -519,6 +519,47 @@ class MainWindow_Ui(object):
         self.actionStop.setObjectName("actionStop")
         self.toolBar.addAction(self.actionSave)
         self.toolBar.addAction(self.actionStop)
+        self.actionAdaptiveSampling = QtWidgets.QAction(MainWindow)
+        self.actionAdaptiveSampling.setCheckable(True)
+        self.actionAdaptiveSampling.setObjectName("actionAdaptiveSampling")
+        self.toolBar.addAction(self.actionAdaptiveSampling)
+        self.actionAutoRange = QtWidgets.QAction(MainWindow)
+        self.actionAutoRange.setCheckable(True)
+        self.actionAutoRange.setObjectName("actionAutoRange")
+        self.toolBar.addAction(self.actionAutoRange)
+        self.actionFindT0 = QtWidgets.QAction(MainWindow)
+        self.actionFindT0.setObjectName("actionFindT0")
+        self.toolBar.addAction(self.actionFindT0)
+        self.actionAutoExposure = QtWidgets.QAction(MainWindow)
+        self.actionAutoExposure.setObjectName("actionAutoExposure")
+        self.toolBar.addAction(self.actionAutoExposure)
+        self.actionAdaptiveExposure = QtWidgets.QAction(MainWindow)
+        self.actionAdaptiveExposure.setCheckable(True)
+        self.actionAdaptiveExposure.setObjectName("actionAdaptiveExposure")
+        self.toolBar.addAction(self.actionAdaptiveExposure)
+        self.actionHDR = QtWidgets.QAction(MainWindow)
+        self.actionHDR.setCheckable(True)
+        self.actionHDR.setObjectName("actionHDR")
+        self.toolBar.addAction(self.actionHDR)
+        self.actionAbortOnSaturation = QtWidgets.QAction(MainWindow)
+        self.actionAbortOnSaturation.setCheckable(True)
+        self.actionAbortOnSaturation.setObjectName("actionAbortOnSaturation")
+        self.toolBar.addAction(self.actionAbortOnSaturation)
+        self.actionRunQueue = QtWidgets.QAction(MainWindow)
+        self.actionRunQueue.setObjectName("actionRunQueue")
+        self.toolBar.addAction(self.actionRunQueue)
+        self.actionResumeSpectrogram = QtWidgets.QAction(MainWindow)
+        self.actionResumeSpectrogram.setObjectName("actionResumeSpectrogram")
+        self.toolBar.addAction(self.actionResumeSpectrogram)
+        self.actionMeasureBacklash = QtWidgets.QAction(MainWindow)
+        self.actionMeasureBacklash.setObjectName("actionMeasureBacklash")
+        self.toolBar.addAction(self.actionMeasureBacklash)
+        self.actionXFROG = QtWidgets.QAction(MainWindow)
+        self.actionXFROG.setObjectName("actionXFROG")
+        self.toolBar.addAction(self.actionXFROG)
+        self.actionFROGRetrieval = QtWidgets.QAction(MainWindow)
+        self.actionFROGRetrieval.setObjectName("actionFROGRetrieval")
+        self.toolBar.addAction(self.actionFROGRetrieval)
 
         self.retranslateUi(MainWindow)
         self.tabWidget.setCurrentIndex(0)
@@ -604,3 +645,15 @@ class MainWindow_Ui(object):
         self.actionOpen.setText(_translate("MainWindow", "Open"))
         self.actionSave.setText(_translate("MainWindow", "Save"))
         self.actionStop.setText(_translate("MainWindow", "Stop"))
+        self.actionAdaptiveSampling.setText(_translate("MainWindow", "Adaptive Sampling"))
+        self.actionAutoRange.setText(_translate("MainWindow", "Auto Range"))
+        self.actionFindT0.setText(_translate("MainWindow", "Find T0"))
+        self.actionAutoExposure.setText(_translate("MainWindow", "Auto Exposure"))
+        self.actionAdaptiveExposure.setText(_translate("MainWindow", "Adapt Exposure per Point"))
+        self.actionHDR.setText(_translate("MainWindow", "HDR"))
+        self.actionAbortOnSaturation.setText(_translate("MainWindow", "Abort on Saturation"))
+        self.actionRunQueue.setText(_translate("MainWindow", "Run Scan Queue"))
+        self.actionResumeSpectrogram.setText(_translate("MainWindow", "Resume Spectrogram"))
+        self.actionMeasureBacklash.setText(_translate("MainWindow", "Measure Backlash"))
+        self.actionXFROG.setText(_translate("MainWindow", "XFROG Retrieval"))
+        self.actionFROGRetrieval.setText(_translate("MainWindow", "FROG Retrieval"))